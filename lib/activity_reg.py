@@ -3,8 +3,8 @@ from .perfutils import TJSync
 from .tablesync import TableSyncActivity
 from .levelscan import LevelScan, FZLevelScan
 from .monitutils import Monitoring
-from .datarollup import CounterLinesRoll
-from .datatransfer import VGPerf, ApdexCalc
+from .datarollup import CounterLinesRoll, CounterFactsRoll, CounterAggsRoll
+from .datatransfer import VGPerf, ApdexCalc, ApdexAggCalc, PerfFleet
 from .intraservice import ClosedFix, ISServiceUpdater
 from .archiver import Archiver
 from .reports.report_reg import activity_list as report_activity_list
@@ -20,8 +20,12 @@ activity_list = [
     FZLevelScan,
     Monitoring,
     CounterLinesRoll,
+    CounterFactsRoll,
+    CounterAggsRoll,
     VGPerf,
     ApdexCalc,
+    ApdexAggCalc,
+    PerfFleet,
     ClosedFix,
     Archiver,
     ISActualizer,
@@ -1,6 +1,8 @@
-from .activities import CounterLinesRoll
+from .activities import CounterLinesRoll, CounterFactsRoll, CounterAggsRoll
 
 __all__ = \
     (
         'CounterLinesRoll',
+        'CounterFactsRoll',
+        'CounterAggsRoll',
     )
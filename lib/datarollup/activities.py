@@ -1,5 +1,7 @@
 from datetime import datetime, timedelta
 
+from psycopg2 import extras, sql
+
 from lib.schedutils import Activity, NullStarter
 from .utils import RollupRule, AggregateRule
 from . import utils
@@ -63,6 +65,49 @@ class CounterLinesRoll(Activity):
         print(f'Rollup: {rollup_interval_count} interval(s)')
 
 
+class CounterFactsRoll(CounterLinesRoll):
+    """ CounterLinesRoll of dictionary encoded counters, see datatransfer/sql/counter_dims.sql """
+    rule = RollupRule(
+        source='CounterFacts',
+        key_field='dim_id',
+        rollup_value_field='flt_value',
+        rollup_fields=['base1s'],
+        stamp_field='stamp',
+        data_filter={'no_filter': 'defined bellow'},
+        aggregate_rules=CounterLinesRoll.rule.aggregate_rules,
+    )
+    roll_data_map = {
+        'CounterFactsRoll1Min': timedelta(minutes=1),
+        'CounterFactsRoll15Min': timedelta(minutes=15),
+    }
+
+
+class CounterAggsRoll(CounterLinesRoll):
+    """ CounterLinesRoll of counters aggregated while transfer (PerfFleet pre_aggregate): roll tables are filled
+        from per file aggregates by counter_aggs_roll(), CounterLines are not scanned, see
+        datatransfer/sql/aggregates.sql. Roll rows are the same: counter value includes its host
+    """
+    roll_minutes_map = {
+        'CounterLinesRoll1Min': 1,
+        'CounterLinesRoll15Min': 15,
+    }
+
+    def run(self):
+        self.rule.data_filter = {'base1s': self['base1s']}
+
+        interval = utils.RollupInterval(*self.full_period(self['from'], self['to']))
+        with utils.get_connection(KeyChain.PG_PERF_KEY) as conn:
+            for table_name, minutes in self.roll_minutes_map.items():
+                utils.clear_interval(conn, interval, self.rule, table_name)
+                source = sql.SQL('counter_aggs_roll({}, {}, {}, {})').format(
+                    sql.Literal(self['base1s']), sql.Literal(interval.left_bound), sql.Literal(interval.right_bound),
+                    sql.Literal(minutes)
+                )
+                utils.insert_rolled_into(conn, source, table_name, self.rule)
+
+        print(f'Rollup: {len(self.roll_minutes_map)} table(s) of {interval.left_bound}-{interval.right_bound}')
+
+
 import unittest
 from unittest import TestCase
 
@@ -93,5 +138,80 @@ class _CounterLinesRollTest(TestCase):
         self.assertEqual(__to, datetime(2020, 9, 29, 14), '_to fail')
 
 
+class _CounterAggsRollTest(TestCase):
+    BASE = 'test_aggs_roll'
+    TABLES = ('CounterLines', 'CounterMinuteAggs', 'CounterLinesRoll1Min', 'CounterLinesRoll15Min')
+
+    def setUp(self) -> None:
+        # the same counter of two hosts, values of the period are loaded with and without pre_aggregate
+        from lib.datatransfer.aggregators import CounterMinutes
+        from lib.datatransfer.parsers.syscounters import CounterLine
+        from lib.pg_utils import record_text
+
+        self.begin = datetime(2020, 9, 29, 12, 5)
+        lines = [
+            CounterLine(
+                self.begin + timedelta(seconds=20 * i), (host, 'Process(rphost)', '% Processor Time'), host,
+                'Process(rphost)', '% Processor Time', None if i % 7 == 0 else i % 11 * (2 if host == 'SRV-2' else 1),
+                ''
+            )
+            for i in range(150) for host in ('SRV-1', 'SRV-2')
+        ]
+        aggregator = CounterMinutes()
+        for line in lines:
+            aggregator.on_line(line)
+        self._clear()
+        with utils.get_connection(KeyChain.PG_PERF_KEY) as conn:
+            cursor = conn.cursor()
+            extras.execute_values(
+                cursor,
+                'insert into "CounterLines" (base1s, stamp, counter, host, context, type, flt_value) values %s',
+                [(self.BASE, line.stamp, record_text(line.counter), line.host, line.context, line.type, line.flt_value)
+                 for line in lines]
+            )
+            extras.execute_values(
+                cursor,
+                'insert into "CounterMinuteAggs" (file_id, base1s, stamp, counter, host, context, type, flt_value_sum, '
+                ' flt_value_count, flt_value_min, flt_value_max) values %s',
+                [(0, self.BASE, row['stamp'], record_text(row['counter']), row['host'], row['context'], row['type'],
+                  row['flt_value_sum'], row['flt_value_count'], row['flt_value_min'], row['flt_value_max'])
+                 for row in aggregator.rows()[CounterMinutes.TABLE]]
+            )
+            conn.commit()
+
+    def tearDown(self) -> None:
+        self._clear()
+
+    def _clear(self):
+        with utils.get_connection(KeyChain.PG_PERF_KEY) as conn:
+            for table in self.TABLES:
+                conn.cursor().execute(f'delete from "{table}" where base1s = %s', (self.BASE,))
+            conn.commit()
+
+    def _rows(self) -> list:
+        with utils.get_connection(KeyChain.PG_PERF_KEY) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'select 1, stamp, counter, host, flt_value_sum::real, flt_value_count, flt_value_avg::real, '
+                ' flt_value_min, flt_value_max from "CounterLinesRoll1Min" where base1s = %(base1s)s '
+                ' union all select 15, stamp, counter, host, flt_value_sum::real, flt_value_count, '
+                ' flt_value_avg::real, flt_value_min, flt_value_max from "CounterLinesRoll15Min" '
+                ' where base1s = %(base1s)s order by 1, 2, 3',
+                {'base1s': self.BASE}
+            )
+            return cursor.fetchall()
+
+    def test_lines_roll_values(self):
+        rolls = []
+        for roll_type in (CounterLinesRoll, CounterAggsRoll):
+            a = roll_type(NullStarter)
+            a['from'] = self.begin
+            a['to'] = self.begin + timedelta(minutes=50)
+            a['base1s'] = self.BASE
+            a.run()
+            rolls.append(self._rows())
+        self.assertEqual({row[3] for row in rolls[0]}, {'SRV-1', 'SRV-2'})
+        self.assertEqual(rolls[0], rolls[1])
+
 if __name__ == '__main__':
     unittest.main()
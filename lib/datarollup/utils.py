@@ -12,6 +12,7 @@ __all__ = (
     # helpers
     'plan_interval_list_for_period',
     'roll_up_interval_into',
+    'insert_rolled_into',
     'read_key_enums',
     'get_connection',
 )
@@ -150,6 +151,23 @@ def roll_up_interval_into(conn, interval: RollupInterval, destination_table: str
     conn.commit()
 
 
+def insert_rolled_into(conn, source: sql.Composable, destination_table: str, rule: RollupRule):
+    """ Insert rows of source, already rolled up rows of destination_table columns (e.g. set returning
+        function of the interval), the rule source is not scanned
+    """
+    fields = [rule.stamp_field, rule.key_field] + rule.rollup_fields + [
+        agg_rule.destination_field_name for agg_rule in rule.aggregate_rules
+    ]
+    q_insert = sql.SQL('insert into {0} ({1}) select {1} from {2}').format(
+        sql.Identifier(destination_table),
+        sql.SQL(', ').join([sql.Identifier(_field) for _field in fields]),
+        source
+    )
+    cursor = conn.cursor()
+    cursor.execute(q_insert)
+    conn.commit()
+
+
 def plan_interval_list_for_period(from_date, to_date, interval: timedelta) -> list:
     assert from_date < to_date
     result = []
@@ -1,8 +1,11 @@
 from .activities.vg_perf import VGPerf
-from .activities.apdex_calc import ApdexCalc
+from .activities.apdex_calc import ApdexCalc, ApdexAggCalc
+from .activities.fleet import PerfFleet
 
 __all__ = \
     [
         'VGPerf',
-        'ApdexCalc'
+        'ApdexCalc',
+        'ApdexAggCalc',
+        'PerfFleet',
     ]
@@ -3,7 +3,11 @@
 """
 
 from ._session import DataFilter
-from .pg_session import PGSession
+from .pg_session import PGSession, PGCopySession, PGCheckpointSession
+from .mem_session import MemSession
+from .parquet_session import ParquetSession
+from .tee_session import TeeSession
 from .ftp_session import FtpSession
+from .local_session import LocalDirSession
 from .procesor import Processor
 from .procesor import ParserJob
@@ -3,14 +3,35 @@
         -- TransferSession class for transfer services (FTP, HTTP, etc..)
 """
 
-from dataclasses import dataclass
-from typing import List
+from collections import namedtuple
+from dataclasses import dataclass, fields
+from typing import List, Iterator
 
 
 @dataclass
 class FileBadge:
     name: str
     data_type: str
+    fingerprint: str = None  # file content hash, None if unknown
+
+
+@dataclass
+class FileStages:
+    """ Processor stage timings of file (ms) with its sizes, or their totals for several files.
+        Stream mode download overlaps parse and submit
+    """
+    list_ms: float = 0.0  # home dir listing and file claim
+    download_ms: float = 0.0
+    parse_ms: float = 0.0  # decode and parse, validator and aggregator included
+    submit_ms: float = 0.0
+    commit_ms: float = 0.0  # aggregates and file status
+    wire_bytes: int = 0  # transferred, compressed size for .gz and .zst files
+    bytes: int = 0
+    lines: int = 0
+
+    def add(self, other: 'FileStages'):
+        for item in fields(self):
+            setattr(self, item.name, getattr(self, item.name) + getattr(other, item.name))
 
 
 @dataclass
@@ -34,20 +55,90 @@ class DataFilter(List[_DataFilterItem]):
         return '|'.join(map(repr, self))
 
 
+def line_fields(line) -> tuple:
+    """ Field names of parser line: typed record (NamedTuple) or dict """
+    return line._fields if isinstance(line, tuple) else tuple(line)
+
+
+def line_values(line):
+    """ Field values of parser line in line_fields order """
+    return line if isinstance(line, tuple) else list(line.values())
+
+
+def batch_lines(batch) -> Iterator[tuple]:
+    """ Lines of pandas.DataFrame batch as typed records, the same as line parsers yield:
+        None for missing values, datetime stamps
+    """
+    columns = {}
+    for name, column in batch.items():
+        if column.dtype.kind == 'M':
+            column = column.dt.to_pydatetime()
+        columns[name] = column.astype(object).where(column.notna(), None) if column.dtype.kind == 'f' else column
+    record = namedtuple('BatchLine', columns.keys(), rename=True)
+    return map(record._make, zip(*columns.values()))
+
+
 class StorageSession:
     def __init__(self, _filter: DataFilter = None):
         self._filter = _filter or DataFilter()
         self._storage_rule = {}
 
+    def _spawn_args(self) -> tuple:
+        """ Constructor args for the session copy in worker process """
+        raise NotImplementedError
+
+    def __reduce__(self):
+        # session is sent to worker process as a new session with the same rules and own connection
+        return self.__class__, self._spawn_args(), {'_storage_rule': self._storage_rule}
+
     def attach_file(self, badge: FileBadge) -> int:  # -> file_id
         pass
 
     def submit_line(self, file_id: int, line_data: dict):
         pass
 
+    def submit_batch(self, file_id: int, batch):
+        """ Submit pandas.DataFrame lines batch, override it for bulk load """
+        for line in batch_lines(batch):
+            self.submit_line(file_id, line)
+
+    def submit_rows(self, file_id: int, table: str, rows: list):
+        """ Replace file rows of side table (e.g. ParserJob.Aggregator results), call before update_file_status """
+        pass
+
+    def append_rows(self, file_id: int, table: str, rows: list):
+        """ Add file rows of side table by parts, e.g. ParserJob.Aggregator.flush results. The first call
+            of the table after attach_file replaces rows stored before (unfinished attach), as submit_rows
+        """
+        pass
+
+    def submit_dict(self, table: str, rows: list):
+        """ Add dictionary rows (e.g. ParserJob.Aggregator.dicts()), rows with stored table key are skipped.
+            Dictionary is shared by all files, key is the first row field. Call before update_file_status
+        """
+        pass
+
+    def drop_file(self, file_id: int):
+        """ Discard submitted lines of the file, e.g. content is found duplicate after parse,
+            call before update_file_status
+        """
+        pass
+
     def update_file_status(self, file_id, is_ok, fail_reason=None):
         pass
 
+    def submit_stages(self, file_id: int, stages: FileStages):
+        """ Store file stage timings, call after update_file_status """
+        pass
+
+    def is_duplicate(self, badge: FileBadge) -> bool:
+        """ True if file with the same fingerprint is already loaded """
+        return False
+
+    def resume_offset(self, file_id: int) -> int:
+        """ Count of first file lines already stored by previous unfinished attach """
+        return 0
+
     # specify where to store data for types
     def add_store_rule(self, data_type: str, storage_place: str):
         self._storage_rule[data_type] = storage_place
@@ -60,9 +151,21 @@ class TransferSession:
     def __init__(self):
         self._transfer_rule = {}
 
+    def _spawn_args(self) -> tuple:
+        """ Constructor args for the session copy in worker process """
+        raise NotImplementedError
+
+    def __reduce__(self):
+        # session is sent to worker process as a new session with the same rules and own connection
+        return self.__class__, self._spawn_args(), {'_transfer_rule': self._transfer_rule}
+
     def attach_file(self, data_type: str) -> int:  # -> file_id, None if home dir is empty
         pass
 
+    def finish_file(self, file_id: int):
+        """ Call after file parsing: wait for the file transfer end, raise transfer error """
+        pass
+
     def to_fail(self, file_id: int):
         pass
 
@@ -75,6 +178,20 @@ class TransferSession:
     def file_name(self, file_id) -> str:
         pass
 
+    def fingerprint(self, file_id) -> str:
+        """ File content hash, None until it is known (e.g. file is not transferred yet) """
+        return None
+
+    def pending(self, data_type: str) -> int:
+        """ Count of files of type waiting for transfer, None if unknown """
+        return None
+
+    def file_stages(self, file_id) -> dict:
+        """ Transfer stages of attached file as FileStages fields: list_ms, download_ms, wire_bytes, bytes.
+            Complete after finish_file, empty if unknown
+        """
+        return {}
+
     # specify where from transfer data for types
     def add_transfer_rule(self, data_type: str, transfer_path: str):
         self._transfer_rule[data_type] = transfer_path
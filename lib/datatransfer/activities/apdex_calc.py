@@ -35,6 +35,7 @@ class ApdexUtils(PGMix):
         self.base1s = base1s
         self.APDEX_TABLE = 'ApdexLines'
         self.APDEX_FIELD = 'apdex'
+        self.APDEX_ROLL = 'ApdexHourRoll'
         self.log = _Log(base1s)
 
     ''' Return next empty APDEX period for calc or None '''
@@ -101,7 +102,22 @@ class ApdexUtils(PGMix):
         cursor.execute(apdex_calc_query)
         return cursor.fetchall()
 
-    def calculate(self, max_hours):
+    def ops_apdex_aggregated(self, period: _Period):
+        ''' ops_apdex_for2 values by "ApdexHourRoll" of files aggregated while transfer (PerfFleet pre_aggregate),
+            measures are not read: N is the aggregates one, so measures of files loaded without aggregates
+            are not counted. Empty if the period is not aggregated, see sql/aggregates.sql '''
+        apdex_calc_query = pgs.SQL(
+            'SELECT ops_uid AS id, apdex FROM {} WHERE base1s = {} AND start = {}::TIMESTAMP'
+        ).format(
+            pgs.Identifier(self.APDEX_ROLL),
+            pgs.Literal(self.base1s),
+            pgs.Literal(period.begin),
+        )
+        cursor = self.cursor(named=True)
+        cursor.execute(apdex_calc_query)
+        return cursor.fetchall()
+
+    def calculate(self, max_hours, aggregated: bool = False):
         batch_cursor = self.cursor()
 
         batch_update_query = pgs.SQL(
@@ -112,6 +128,7 @@ class ApdexUtils(PGMix):
             pgs.Literal(self.base1s),
         )
         batch_params_list = []
+        aggregated_periods = set()
 
         for _ in range(max_hours):
             period = self.get_next_period()
@@ -119,7 +136,12 @@ class ApdexUtils(PGMix):
             if not period:
                 break
 
-            ops_map = self.ops_apdex_for2(period)
+            ops_map = None
+            if aggregated and period.begin not in aggregated_periods:
+                aggregated_periods.add(period.begin)
+                ops_map = self.ops_apdex_aggregated(period)
+            if not ops_map:  # not aggregated period or operations left empty by aggregates
+                ops_map = self.ops_apdex_for2(period)
             for ops in ops_map or ():
                 batch_params_list.append((ops.apdex, period.begin, period.end, ops.id))
 
@@ -131,6 +153,7 @@ class ApdexUtils(PGMix):
 
 class ApdexCalc(Activity):
     DEFAULT_MAX_HOURS = 24
+    AGGREGATED = False  # apdex by ApdexUtils.ops_apdex_aggregated
 
     def _fields(self) -> str:
         return 'base1s'
@@ -139,12 +162,17 @@ class ApdexCalc(Activity):
         prf = cProfile.Profile()
         prf.enable()
         calc = ApdexUtils(KeyChain.PG_PERF_KEY, self['base1s'])
-        calc.calculate(self.DEFAULT_MAX_HOURS)
+        calc.calculate(self.DEFAULT_MAX_HOURS, self.AGGREGATED)
         print(calc.log)
         prf.disable()
         prf.print_stats(sort=2)
 
 
+class ApdexAggCalc(ApdexCalc):
+    """ ApdexCalc of APDEX aggregated while transfer (PerfFleet pre_aggregate) """
+    AGGREGATED = True
+
+
 from unittest import TestCase
 from lib.schedutils import NullStarter
 
@@ -162,6 +190,13 @@ class _ApdexUtilsTest(TestCase):
         self.assertNotEqual(len(result_foo), 0, 'Results len is 0, test is impossible!')
         self.assertEqual(set(result_foo), set(result_bar))
 
+    def test_aggregated_results(self):
+        period = self.utils.get_next_period()
+        self.assertIsNotNone(period, 'Period is empty, test is impossible!')
+        aggregated = {ops.id: ops.apdex for ops in self.utils.ops_apdex_aggregated(period)}
+        self.assertTrue(aggregated, 'Period is not aggregated, test is impossible!')
+        self.assertEqual(aggregated, {ops.id: ops.apdex for ops in self.utils.ops_apdex_for2(period)})
+
 
 class _ApdexCalcTest(TestCase):
     def setUp(self) -> None:
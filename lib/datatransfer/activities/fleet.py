@@ -0,0 +1,172 @@
+"""
+    Config driven performance data transfer for the fleet of 1C bases
+"""
+
+from functools import partial
+from typing import List, Dict
+
+import yaml
+from pydantic import BaseModel, validator
+
+from cfg import CONFIG_COMMON_PATH
+from keys import KeyChain
+from lib.schedutils import Activity
+
+from ..aggregators import CounterMinutes, ApdexHours, EventFacts, SqlFingerprints, AggregatorSet
+from ..encoders import CounterDims
+from ..local_session import LocalDirSession
+from ..parsers import techjrnl
+from ..procesor import execute_fleet
+from .vg_perf import JOB_TEMPLATES, base_processor, aggregate
+
+cfg_path = f'{CONFIG_COMMON_PATH}/perf_fleet.yaml'
+
+AGGREGATORS = {'cntr': CounterMinutes, 'apdx': ApdexHours}
+
+
+class FleetBase(BaseModel):
+    ftp_key: dict  # KeyChain.FTP_TJ_KEYS name in config
+    base1s: str = None  # FTP user by default
+    jobs: List[str] = list(JOB_TEMPLATES)
+    time_zone_adjust: Dict[str, int] = {}  # data type: hours, JOB_TEMPLATES values by default
+    max_files: int = 300  # per data type
+    workers: int = 1  # base quota of the fleet worker processes
+    pre_aggregate: bool = False  # counters and APDEX aggregates are stored while transfer, see sql/aggregates.sql
+    local_dir: str = None  # FTP root of the base on this host: files are parsed in place by LocalDirSession
+    watch: bool = False  # local_dir inotify readiness, see LocalDirSession
+    split_workers: int = 0  # experimental: large local_dir journals are parsed by byte ranges, see techjrnl.parse_split
+    props: bool = False  # journal event properties are stored into TJLines.props, see sql/tjlines_props.sql
+    event_facts: bool = False  # DBMSSQL, CALL, TLOCK, EXCP journal events typed facts, see sql/tjfacts.sql
+    sql_fingerprints: bool = False  # DBMSSQL hour aggregates by normalized statement, see sql/tjsql_fingerprints.sql
+    counter_dims: bool = False  # counters are stored into CounterFacts with dictionary ids, see sql/counter_dims.sql
+    resume: bool = False  # unfinished files are resumed from TJFiles.checkpoint, see sql/tjfiles_checkpoint.sql
+    dedup: bool = False  # already loaded file content is skipped, see sql/tjfiles_content_hash.sql
+
+    @validator('ftp_key', pre=True)
+    def convert_ftp_key_name_to_dict(cls, value):
+        return KeyChain.FTP_TJ_KEYS[value]
+
+    @validator('base1s', always=True)
+    def default_base1s(cls, value, values):
+        return value or values.get('ftp_key', {}).get('user')
+
+    @validator('jobs', each_item=True)
+    def check_job(cls, value):
+        if value not in JOB_TEMPLATES:
+            raise ValueError(f'Wrong job: {value}, expected one of {list(JOB_TEMPLATES)}')
+        return value
+
+    @validator('event_facts', 'sql_fingerprints')
+    def check_props(cls, value, values, field):
+        if value and not values.get('props'):
+            raise ValueError(f'{field.name} aggregates journal event properties, props option is required')
+        return value
+
+    def job_changes(self) -> dict:
+        changes = {}
+        for data_type in self.jobs:
+            changes[data_type] = {'max_files': self.max_files, 'workers': self.workers}
+            if data_type in self.time_zone_adjust:
+                changes[data_type]['time_zone_adjust'] = self.time_zone_adjust[data_type]
+            aggregators = []
+            if self.pre_aggregate and data_type in AGGREGATORS:
+                aggregators.append(AGGREGATORS[data_type]())
+            if self.event_facts and data_type == 'logs':
+                aggregators.append(EventFacts())
+            if self.sql_fingerprints and data_type == 'logs':
+                aggregators.append(SqlFingerprints())
+            if aggregators:
+                changes[data_type]['aggregator'] = aggregators[0] if len(aggregators) == 1 else AggregatorSet(*aggregators)
+            if self.counter_dims and data_type == 'cntr':
+                changes[data_type]['encoder'] = CounterDims()
+                changes[data_type]['store_place'] = CounterDims.STORE_PLACE
+            if data_type == 'logs':
+                props = techjrnl.PROPS if self.props else None
+                if self.split_workers:
+                    changes[data_type]['parser'] = partial(
+                        techjrnl.parse_split, props=props, workers=self.split_workers
+                    )
+                elif props:
+                    changes[data_type]['parser'] = partial(techjrnl.parse, props=props)
+        return changes
+
+    def transfer(self):
+        """ Base transfer session, None for FtpSession default """
+        return LocalDirSession(self.local_dir, watch=self.watch) if self.local_dir else None
+
+
+class Config(BaseModel):
+    db_key: dict  # KeyChain attribute name in config
+    workers: int = 4  # fleet worker processes
+    budget: int = None  # run seconds, the follow-up run is planned if files are left
+    metrics_path: str = None  # Prometheus text file written after run, e.g. for node_exporter textfile collector
+    bases: List[FleetBase]
+
+    @validator('db_key', pre=True)
+    def convert_db_key_name_to_dict(cls, value):
+        return getattr(KeyChain, value)
+
+
+def load_cfg(file_path):
+    """ Return config dict """
+    with open(file_path, mode='rt') as file:
+        return yaml.safe_load(file)
+
+
+class PerfFleet(Activity):
+    config: Config = None
+
+    @classmethod
+    def get_crontab(cls):
+        return ''  # cfg/perf_fleet.yaml bases are still processed by VGPerf, to be scheduled on the cut-over
+
+    def run(self):
+        if not self.config:
+            self.config = Config(
+                **load_cfg(file_path=cfg_path)
+            )
+        bases = self.config.bases
+        processors = [
+            base_processor(
+                base.ftp_key, self.config.db_key, base.base1s, base.job_changes(), self.config.budget, base.transfer(),
+                base.resume, base.dedup
+            )
+            for base in bases
+        ]
+        execute_fleet(processors, self.config.workers, self.config.metrics_path)
+        for base, processor in zip(bases, processors):
+            aggregate(self._ldr, base.base1s, processor)
+
+        if any(processor.remaining() for processor in processors):
+            PerfFleet(self._ldr).apply()  # the budget is over, continue without waiting for the schedule
+
+
+from unittest import TestCase
+
+
+class TestConfig(TestCase):
+    def test_validate(self):
+        config = Config(**load_cfg(cfg_path))
+        for base in config.bases:
+            self.assertTrue(base.base1s)
+            self.assertEqual(set(base.job_changes()), set(base.jobs))
+
+    def test_schema_options(self):
+        self.assertNotIn('parser', FleetBase(ftp_key='tjtest').job_changes()['logs'])
+        changes = FleetBase(ftp_key='tjtest', props=True).job_changes()
+        self.assertEqual(changes['logs']['parser'].keywords, {'props': techjrnl.PROPS})
+        with self.assertRaises(ValueError):
+            FleetBase(ftp_key='tjtest', event_facts=True)
+
+
+class TestPerfFleet(TestCase):
+    def test_run(self):
+        from lib.schedutils import NullStarter
+
+        fleet = PerfFleet(NullStarter())
+        fleet.config = Config(
+            db_key='PG_PERF_KEY',
+            workers=2,
+            bases=[{'ftp_key': 'tjtest', 'max_files': 1, 'workers': 2, 'time_zone_adjust': {'apdx': 0}}]
+        )
+        fleet.run()
@@ -2,13 +2,94 @@
     Activities for VG performance data transfer
 """
 
+from dataclasses import replace
+from datetime import datetime
+from functools import partial
+
 from keys import KeyChain
 from lib.schedutils import Activity
-from lib.datarollup import CounterLinesRoll
+from lib.datarollup import CounterLinesRoll, CounterFactsRoll, CounterAggsRoll
 
-from .._index import Processor, DataFilter, FtpSession, PGSession, ParserJob
+from .._index import Processor, DataFilter, FtpSession, PGCopySession, PGCheckpointSession, ParserJob
+from .._session import TransferSession
 from ..parsers import techjrnl, syscounters, apdex
-from .apdex_calc import ApdexCalc
+from ..parsers.syscounters import CounterLine
+from .apdex_calc import ApdexCalc, ApdexAggCalc
+
+
+# 1C base ParserJob templates by data type
+JOB_TEMPLATES = {
+    'logs': ParserJob(
+        parser=techjrnl.parse,
+        data_type='logs',
+        transfer_path='logs',
+        store_place='TJLines',
+        time_zone_adjust=0,
+    ),
+    'apdx': ParserJob(
+        parser=apdex.parse,
+        data_type='apdx',
+        transfer_path='apdx',
+        store_place='ApdexLines',
+        time_zone_adjust=+3,
+    ),
+    'cntr': ParserJob(
+        parser=syscounters.parse_columnar,
+        data_type='cntr',
+        transfer_path='cntr',
+        store_place='CounterLines',
+        time_zone_adjust=0,
+        batches=True,
+    ),
+}
+
+
+def base_processor(
+        ftp_key: dict, db_key, base1s: str, jobs: dict, budget: float = None, transfer: TransferSession = None,
+        resume: bool = False, dedup: bool = False
+) -> Processor:
+    """ Processor of 1C base files, jobs: {data_type: JOB_TEMPLATES item changes}.
+        Counters job gets CountersBoundValidator. Files are transferred by FtpSession if transfer is not set.
+        Resume and dedup storage modes need the TJFiles migrations: sql/tjfiles_checkpoint.sql,
+        sql/tjfiles_content_hash.sql
+    """
+    storage_class = PGCheckpointSession if resume else PGCopySession
+    processor = Processor(
+        transfer=transfer or FtpSession(ftp_key),
+        storage=storage_class(db_key, DataFilter().add('base1s', base1s), dedup=dedup),
+        budget=budget,
+    )
+    for data_type, changes in jobs.items():
+        if data_type == 'cntr':
+            changes = dict(changes, validator=CountersBoundValidator())
+        processor.add_parser_job(replace(JOB_TEMPLATES[data_type], **changes))
+    return processor
+
+
+def _counters_roll(job: ParserJob) -> type:
+    # dictionary encoded counters have no aggregates of their roll tables, they are rescanned
+    if job.store_place == CounterFactsRoll.rule.source:
+        return CounterFactsRoll
+    return CounterAggsRoll if job.aggregator else CounterLinesRoll
+
+
+def aggregate(ldr, base1s: str, processor: Processor):
+    """ Plan base APDEX calc and counters roll for the processed period,
+        types aggregated while transfer (ParserJob.aggregator) get them from aggregates, without lines rescan
+    """
+    aggregated = {job.data_type for job in processor.parser_jobs if job.aggregator}
+    calc = (ApdexAggCalc if 'apdx' in aggregated else ApdexCalc)(ldr)
+    calc['base1s'] = base1s
+    calc.apply()
+
+    for job in processor.parser_jobs:
+        validator = job.validator
+        if isinstance(validator, CountersBoundValidator) and validator.left and validator.right:
+            roll = _counters_roll(job)(ldr)
+            roll['base1s'] = base1s
+            roll['from'] = validator.left
+            roll['to'] = validator.right
+            roll.apply()
 
 
 class VGPerf(Activity):
@@ -22,57 +103,11 @@ class VGPerf(Activity):
     def run(self):
         ftp_key = KeyChain.FTP_TJ_KEYS['vgunf']
         base1s = ftp_key['user']
-        transfer = FtpSession(ftp_key)
-        storage = PGSession(
-            KeyChain.PG_PERF_KEY,
-            DataFilter().add('base1s', base1s)
-        )
-
-        processor = Processor(transfer=transfer, storage=storage)
-        processor.add_parser_job(
-            ParserJob(
-                parser=techjrnl.parse,
-                data_type='logs',
-                transfer_path='logs',
-                store_place='TJLines',
-                time_zone_adjust=0,
-                max_files=self.DEFAULT_MAX_FILES,
-            )
-        )
-        processor.add_parser_job(
-            ParserJob(
-                parser=apdex.parse,
-                data_type='apdx',
-                transfer_path='apdx',
-                store_place='ApdexLines',
-                time_zone_adjust=+3,
-                max_files=self.DEFAULT_MAX_FILES,
-            )
-        )
-        validator = CountersBoundValidator()
-        processor.add_parser_job(
-            ParserJob(
-                parser=syscounters.parse,
-                data_type='cntr',
-                transfer_path='cntr',
-                store_place='CounterLines',
-                time_zone_adjust=0,
-                max_files=self.DEFAULT_MAX_FILES,
-                validator=validator
-            )
-        )
+        jobs = {data_type: {'max_files': self.DEFAULT_MAX_FILES} for data_type in JOB_TEMPLATES}
+        jobs['logs']['parser'] = partial(techjrnl.parse, props=techjrnl.PROPS)
+        processor = base_processor(ftp_key, KeyChain.PG_PERF_KEY, base1s, jobs, resume=True)
         processor.execute()
-
-        calc = ApdexCalc(self._ldr)
-        calc['base1s'] = base1s
-        calc.apply()
-
-        if validator.left and validator.right:  # check if Apdex file is an empty
-            roll = CounterLinesRoll(self._ldr)
-            roll['base1s'] = base1s
-            roll['from'] = validator.left
-            roll['to'] = validator.right
-            roll.apply()
+        aggregate(self._ldr, base1s, processor)
 
 
 class CountersBoundValidator(ParserJob.Validator):
@@ -80,11 +115,21 @@ class CountersBoundValidator(ParserJob.Validator):
         self.left = None
         self.right = None
 
-    def on_line(self, line: dict):
-        stamp = line['stamp']
+    def _bound(self, stamp: datetime):
         self.left = min(stamp, self.left or stamp)
         self.right = max(stamp, self.right or stamp)
 
+    def on_line(self, line: CounterLine):
+        self._bound(line.stamp)
+
+    def on_batch(self, batch):
+        if len(batch):
+            self._bound(batch['stamp'].min().to_pydatetime())
+            self._bound(batch['stamp'].max().to_pydatetime())
+
+    def merge(self, other: 'CountersBoundValidator'):
+        for stamp in filter(None, (other.left, other.right)):
+            self._bound(stamp)
 
 from unittest import TestCase
 from lib.schedutils import NullStarter
@@ -0,0 +1,428 @@
+"""
+    Streaming aggregators for ParserJob: per file partial aggregates are stored in side tables,
+    see sql/aggregates.sql, views merge partials of all files.
+    EventFacts routes journal events into typed fact tables, see sql/tjfacts.sql
+    SqlFingerprints aggregates DBMSSQL events by normalized statement text, see sql/tjsql_fingerprints.sql
+"""
+
+from datetime import datetime
+import hashlib
+import json
+import re
+
+from .procesor import ParserJob
+
+
+class CounterMinutes(ParserJob.Aggregator):
+    """ Counter values by minute: sum, count, min, max of flt_value, the same as CounterLinesRoll1Min """
+    TABLE = 'CounterMinuteAggs'
+
+    def __init__(self):
+        self._groups = {}  # (stamp, counter, host, context, type) -> [sum, count, min, max]
+
+    def _add(self, key: tuple, value_sum, count: int, value_min, value_max):
+        group = self._groups.get(key)
+        if group is None:
+            self._groups[key] = [value_sum, count, value_min, value_max]
+        elif count:
+            if group[1]:
+                group[0] += value_sum
+                group[2] = min(group[2], value_min)
+                group[3] = max(group[3], value_max)
+            else:
+                group[0], group[2], group[3] = value_sum, value_min, value_max
+            group[1] += count
+
+    def on_line(self, line: tuple):
+        key = (line.stamp.replace(second=0, microsecond=0), line.counter, line.host, line.context, line.type)
+        value = line.flt_value
+        self._add(key, value, 0 if value is None else 1, value, value)
+
+    def on_batch(self, batch):
+        if not len(batch):
+            return
+        frame = batch.assign(stamp=batch['stamp'].dt.floor('min'))
+        groups = frame.groupby(['stamp', 'counter', 'host', 'context', 'type'], sort=False)['flt_value'].agg(
+            ['sum', 'count', 'min', 'max']
+        )
+        for key, value_sum, count, value_min, value_max in zip(
+                groups.index, groups['sum'], groups['count'], groups['min'], groups['max']):
+            key = (key[0].to_pydatetime(),) + key[1:]
+            if count:
+                self._add(key, float(value_sum), int(count), float(value_min), float(value_max))
+            else:
+                self._add(key, None, 0, None, None)
+
+    def rows(self) -> dict:
+        rows = [
+            {
+                'stamp': stamp, 'counter': counter, 'host': host, 'context': context, 'type': _type,
+                'flt_value_sum': value_sum, 'flt_value_count': count, 'flt_value_min': value_min,
+                'flt_value_max': value_max,
+            }
+            for (stamp, counter, host, context, _type), (value_sum, count, value_min, value_max)
+            in self._groups.items()
+        ]
+        self._groups = {}
+        return {self.TABLE: rows}
+
+
+class ApdexHours(ParserJob.Aggregator):
+    """ APDEX measures count by operation and hour: N, NS, NT. Hour APDEX is (NS + NT / 2) / N """
+    TABLE = 'ApdexHourAggs'
+
+    def __init__(self):
+        self._groups = {}  # (ops_uid, hour) -> [n, ns, nt]
+
+    def on_line(self, line: tuple):
+        key = (line.ops_uid, line.start.replace(minute=0, second=0, microsecond=0))
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = [0, 0, 0]
+        group[0] += 1
+        if line.status == 'NS':
+            group[1] += 1
+        elif line.status == 'NT':
+            group[2] += 1
+
+    def rows(self) -> dict:
+        rows = [
+            {'ops_uid': ops_uid, 'start': start, 'n': n, 'ns': ns, 'nt': nt}
+            for (ops_uid, start), (n, ns, nt) in self._groups.items()
+        ]
+        self._groups = {}
+        return {self.TABLE: rows}
+
+
+def text_hash(text: str):
+    """ Signed 64 bit hash of text, the same as SQL tj_text_hash(text), None for None """
+    if text is None:
+        return None
+    return int.from_bytes(hashlib.md5(text.encode()).digest()[:8], 'big', signed=True)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _sql_fields(line, props: dict) -> dict:
+    return {
+        'event': line.event,
+        'rows': _int(props.get('Rows')),
+        'rows_affected': _int(props.get('RowsAffected')),
+        'sql_hash': text_hash(props.get('Sql')),
+    }
+
+
+def _call_fields(line, props: dict) -> dict:
+    return {
+        'memory': _int(props.get('Memory')),
+        'memory_peak': _int(props.get('MemoryPeak')),
+        'in_bytes': _int(props.get('InBytes')),
+        'out_bytes': _int(props.get('OutBytes')),
+        'cpu_time': _int(props.get('CpuTime')),
+    }
+
+
+def _lock_fields(line, props: dict) -> dict:
+    return {
+        'regions': props.get('Regions'),
+        'wait_connections': props.get('WaitConnections'),
+    }
+
+
+def _excp_fields(line, props: dict) -> dict:
+    return {
+        'exception': line.exception,
+        'descr_hash': text_hash(line.descr),
+    }
+
+
+class EventFacts(ParserJob.Aggregator):
+    """ Journal events of DBMSSQL (DBPOSTGRS), CALL, TLOCK and EXCP types as rows of typed fact tables:
+        numeric duration, rows, memory, CPU time, hashes of Sql and Context texts.
+        Lines are techjrnl.TJPropsLine, parser is used with props=techjrnl.PROPS
+    """
+    SQL = 'TJSqlFacts'
+    CALL = 'TJCallFacts'
+    LOCK = 'TJLockFacts'
+    EXCP = 'TJExcpFacts'
+
+    # event -> (table, event specific fields)
+    EVENTS = {
+        'DBMSSQL': (SQL, _sql_fields),
+        'DBPOSTGRS': (SQL, _sql_fields),
+        'CALL': (CALL, _call_fields),
+        'TLOCK': (LOCK, _lock_fields),
+        'EXCP': (EXCP, _excp_fields),
+    }
+
+    def __init__(self):
+        self._rows = {table: [] for table, fields in self.EVENTS.values()}
+
+    def on_line(self, line: tuple):
+        route = self.EVENTS.get(line.event)
+        if route is None:
+            return
+        table, fields = route
+        props = json.loads(line.props)
+        row = {
+            'stamp': line.stamp,
+            'rphost': line.rphost,
+            'dur_us': _int(line.dur),
+            'usr': props.get('Usr'),
+            'session_id': _int(props.get('SessionID')),
+            'context_hash': text_hash(props.get('Context')),
+        }
+        row.update(fields(line, props))
+        self._rows[table].append(row)
+
+    def flush(self) -> dict:
+        return self.rows()  # fact rows are complete at once
+
+    def rows(self) -> dict:
+        rows, self._rows = self._rows, {table: [] for table in self._rows}
+        return rows
+
+
+# 1C statement parameter values, appended to Sql text: p_0: 0x8A3B...
+_RE_SQL_PARAMS = re.compile(r'\s+p_\d+:.*', re.DOTALL)
+# literals and parameters: 'text', N'text', E'text', 0x8A3B, 12.5, @P1, $1
+_RE_SQL_VALUE = re.compile(
+    r"""[NnEe]?'(?:[^']|'')*'|\b0x[0-9A-Fa-f]*|(?<![\w@$#])\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b|@P\d+|\$\d+"""
+)
+_RE_SQL_LIST = re.compile(r'\?(?:\s*,\s*\?)+')  # IN (?, ?, ?)
+# temp tables of 1C: #tt12 (MS SQL), tt12 or pg_temp.tt12 (PostgreSQL)
+_RE_SQL_TEMP = re.compile(r'#\w+|\b(?:pg_temp\.)?tt\d+\b')
+_RE_SQL_SPACE = re.compile(r'\s+')
+
+
+def sql_fingerprint(text: str) -> str:
+    """ Normalized statement text: literals, parameters and value lists are ?, temp tables are #tt (tt),
+        single spaces. Statements differing by values only have the same text and text_hash()
+    """
+    text = _RE_SQL_PARAMS.sub('', text)
+    text = _RE_SQL_VALUE.sub('?', text)
+    text = _RE_SQL_LIST.sub('?', text)
+    text = _RE_SQL_TEMP.sub(lambda match: '#tt' if match.group().startswith('#') else 'tt', text)
+    return _RE_SQL_SPACE.sub(' ', text).strip()
+
+
+class SqlFingerprints(ParserJob.Aggregator):
+    """ DBMSSQL (DBPOSTGRS) events by statement fingerprint and hour: count, total and max duration.
+        Normalized statement texts are the dictionary of fingerprints, see sql_fingerprint().
+        Lines are techjrnl.TJPropsLine, parser is used with props=techjrnl.PROPS
+    """
+    HOURS = 'TJSqlHourAggs'
+    TEXTS = 'TJSqlFingerprints'
+
+    EVENTS = frozenset(('DBMSSQL', 'DBPOSTGRS'))
+    CACHE_SIZE = 10000  # statement texts -> fingerprint, the same texts are repeated a lot
+
+    def __init__(self):
+        self._groups = {}  # (fingerprint, hour) -> [count, dur sum, dur max]
+        self._texts = {}  # file fingerprints -> normalized text
+        self._cache = {}  # statement text -> (fingerprint, normalized text)
+
+    def _fingerprint(self, sql_text: str) -> tuple:
+        known = self._cache.get(sql_text)
+        if known is None:
+            if len(self._cache) >= self.CACHE_SIZE:
+                self._cache.clear()
+            normalized = sql_fingerprint(sql_text)
+            known = self._cache[sql_text] = text_hash(normalized), normalized
+        return known
+
+    def on_line(self, line: tuple):
+        if line.event not in self.EVENTS:
+            return
+        sql_text = json.loads(line.props).get('Sql')
+        if sql_text is None:
+            return
+        fingerprint, normalized = self._fingerprint(sql_text)
+        self._texts[fingerprint] = normalized
+        key = (fingerprint, line.stamp.replace(minute=0, second=0, microsecond=0))
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = [0, 0, 0]
+        dur = _int(line.dur) or 0
+        group[0] += 1
+        group[1] += dur
+        group[2] = max(group[2], dur)
+
+    def rows(self) -> dict:
+        rows = [
+            {'fingerprint': fingerprint, 'hour': hour, 'n': n, 'dur_sum': dur_sum, 'dur_max': dur_max}
+            for (fingerprint, hour), (n, dur_sum, dur_max) in self._groups.items()
+        ]
+        self._groups = {}
+        return {self.HOURS: rows}
+
+    def dicts(self) -> dict:
+        rows = [{'fingerprint': fingerprint, 'sql': text} for fingerprint, text in self._texts.items()]
+        self._texts = {}
+        return {self.TEXTS: rows}
+
+
+class AggregatorSet(ParserJob.Aggregator):
+    """ Several aggregators of one ParserJob, e.g. EventFacts and SqlFingerprints of journal """
+
+    def __init__(self, *aggregators: ParserJob.Aggregator):
+        self.aggregators = aggregators
+
+    def on_line(self, line: tuple):
+        for aggregator in self.aggregators:
+            aggregator.on_line(line)
+
+    def on_batch(self, batch):
+        for aggregator in self.aggregators:
+            aggregator.on_batch(batch)
+
+    def flush(self) -> dict:
+        rows = {}
+        for aggregator in self.aggregators:
+            rows.update(aggregator.flush())
+        return rows
+
+    def rows(self) -> dict:
+        rows = {}
+        for aggregator in self.aggregators:
+            rows.update(aggregator.rows())
+        return rows
+
+    def dicts(self) -> dict:
+        rows = {}
+        for aggregator in self.aggregators:
+            rows.update(aggregator.dicts())
+        return rows
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from .parsers import syscounters, apdex, techjrnl
+
+
+class _CounterMinutesTest(TestCase):
+    def setUp(self) -> None:
+        self._path = os.path.join(tempfile.gettempdir(), 'counter_minutes_test.csv')
+        syscounters._write_synthetic_counters(self._path, 5, 300)
+
+    def tearDown(self) -> None:
+        os.remove(self._path)
+
+    def test_lines_and_batches(self):
+        by_lines, by_batches = CounterMinutes(), CounterMinutes()
+        lines = list(syscounters.parse(self._path, 'counters.csv', 0))
+        for line in lines:
+            by_lines.on_line(line)
+        for batch in syscounters.parse_columnar(self._path, 'counters.csv', 0, chunk_rows=7):
+            by_batches.on_batch(batch)
+
+        rows = by_lines.rows()[CounterMinutes.TABLE]
+        self.assertEqual(sum(row['flt_value_count'] for row in rows), sum(1 for line in lines if line.flt_value is not None))
+        self.assertTrue(all(row['stamp'].second == 0 for row in rows))
+        key = lambda row: (row['stamp'], row['counter'])
+        batch_rows = sorted(by_batches.rows()[CounterMinutes.TABLE], key=key)
+        for row, batch_row in zip(sorted(rows, key=key), batch_rows):
+            self.assertEqual(row.keys(), batch_row.keys())
+            for name, value in row.items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(value, batch_row[name])
+                else:
+                    self.assertEqual(value, batch_row[name])
+        self.assertEqual(len(rows), len(batch_rows))
+        self.assertEqual(by_lines.rows(), {CounterMinutes.TABLE: []})  # reset
+
+
+class _ApdexHoursTest(TestCase):
+    def test_counts(self):
+        aggregator = ApdexHours()
+        stamp = datetime(2020, 9, 23, 10, 5)
+        for status in ('NS', 'NS', 'NT'):
+            aggregator.on_line(apdex._apdex_line(('uid', 'ops', 1.0, 'user', stamp, 1, False, 1.0, 'Normal', status)))
+        self.assertEqual(
+            aggregator.rows(),
+            {ApdexHours.TABLE: [{'ops_uid': 'uid', 'start': datetime(2020, 9, 23, 10), 'n': 3, 'ns': 2, 'nt': 1}]}
+        )
+
+
+class _EventFactsTest(TestCase):
+    def test_routing(self):
+        origin = 'rphost_1020_20092316.log'
+        path = os.path.join(tempfile.gettempdir(), origin)
+        techjrnl._write_synthetic_journal(path, 16)
+        facts = EventFacts()
+        events = {}
+        for line in techjrnl.parse(path, origin, +3, techjrnl.PROPS):
+            facts.on_line(line)
+            events[line.event] = events.get(line.event, 0) + 1
+        os.remove(path)
+
+        rows = facts.rows()
+        self.assertEqual(
+            {table: len(table_rows) for table, table_rows in rows.items()},
+            {EventFacts.SQL: events['DBMSSQL'], EventFacts.CALL: events['CALL'], EventFacts.EXCP: events['EXCP'],
+             EventFacts.LOCK: 0}
+        )
+        sql = rows[EventFacts.SQL][0]
+        self.assertEqual((sql['rows'], sql['dur_us'], sql['usr']), (1, 1, 'User'))
+        self.assertEqual(sql['sql_hash'], text_hash('SELECT T1._IDRRef\nFROM dbo._Reference12 T1\nWHERE T1._Fld13 = @P1'))
+        self.assertEqual((rows[EventFacts.CALL][0]['memory'], rows[EventFacts.CALL][0]['cpu_time']), (1024, 15))
+        self.assertEqual(rows[EventFacts.EXCP][0]['exception'], 'a1b2')
+        self.assertEqual(facts.rows()[EventFacts.SQL], [])  # reset
+
+    def test_text_hash(self):
+        # SQL: ('x' || substr(md5('abc'), 1, 16))::bit(64)::bigint
+        self.assertEqual(text_hash('abc'), -8070080442485551184)
+        self.assertIsNone(text_hash(None))
+
+
+class _SqlFingerprintsTest(TestCase):
+    def test_normalize(self):
+        self.assertEqual(
+            sql_fingerprint(
+                "SELECT T1._IDRRef\r\nFROM dbo._Reference12 T1\r\nWHERE T1._Fld13 = @P1 AND T1._Fld14RRef = 0x8A3B00 "
+                "AND T1._Fld15 IN (1, 2.5, N'a''b') AND T1._Fld16 > '4020-01-01 00:00:00'\np_0: 42\np_1: 'x'"
+            ),
+            "SELECT T1._IDRRef FROM dbo._Reference12 T1 WHERE T1._Fld13 = ? AND T1._Fld14RRef = ? "
+            "AND T1._Fld15 IN (?) AND T1._Fld16 > ?"
+        )
+        self.assertEqual(
+            sql_fingerprint('INSERT INTO #tt12 WITH(TABLOCK) (_Q_000_F_000) SELECT 1 FROM pg_temp.tt3 WHERE x = $1'),
+            'INSERT INTO #tt WITH(TABLOCK) (_Q_000_F_000) SELECT ? FROM tt WHERE x = ?'
+        )
+        self.assertEqual(sql_fingerprint('DROP TABLE #tt5'), sql_fingerprint('DROP  TABLE #tt77'))
+
+    def test_hours(self):
+        origin = 'rphost_1020_20092316.log'
+        path = os.path.join(tempfile.gettempdir(), origin)
+        techjrnl._write_synthetic_journal(path, 64)
+        fingerprints = SqlFingerprints()
+        facts = EventFacts()
+        aggregators = AggregatorSet(facts, fingerprints)
+        durs = []
+        for line in techjrnl.parse(path, origin, +3, techjrnl.PROPS):
+            aggregators.on_line(line)
+            if line.event == 'DBMSSQL':
+                durs.append(int(line.dur))
+        os.remove(path)
+
+        rows = aggregators.rows()
+        self.assertEqual(len(rows[EventFacts.SQL]), len(durs))
+        hours = rows[SqlFingerprints.HOURS]
+        self.assertEqual(
+            (sum(row['n'] for row in hours), sum(row['dur_sum'] for row in hours), max(row['dur_max'] for row in hours)),
+            (len(durs), sum(durs), max(durs))
+        )
+        texts = aggregators.dicts()[SqlFingerprints.TEXTS]
+        self.assertEqual(
+            texts, [{'fingerprint': hours[0]['fingerprint'],
+                     'sql': 'SELECT T1._IDRRef FROM dbo._Reference12 T1 WHERE T1._Fld13 = ?'}]
+        )
+        self.assertEqual(texts[0]['fingerprint'], text_hash(texts[0]['sql']))
+        self.assertEqual(aggregators.dicts(), {SqlFingerprints.TEXTS: []})  # reset
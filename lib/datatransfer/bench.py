@@ -0,0 +1,248 @@
+""" Offline ingestion benchmark: synthetic files -> local FTP server -> Processor -> memory or local PG storage
+
+    python -m lib.datatransfer.bench --files 2 --logs-mb 50 --apdx-mb 10 --cntr-mb 10
+    python -m lib.datatransfer.bench --pg db_name=perf,user=postgres,pwd=,host=localhost --staged
+
+    Each data type is measured in own fresh process: lines/sec, MB/sec, stage times and peak RSS.
+    Stage times: transfer (FtpSession calls, includes stream wait in finish_file), store (storage calls),
+    parse (the rest of Processor time). Requires pyftpdlib, see requirements-dev.txt.
+    PG storage requires the perf database tables.
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+
+from ._session import DataFilter
+from .ftp_session import FtpSession
+from .mem_session import MemSession
+from .pg_session import PGCopySession
+from .procesor import Processor, ParserJob
+from .parsers import techjrnl, apdex, syscounters
+
+FTP_USER = 'bench'
+FTP_PWD = 'bench'
+BASE1S = 'bench'
+
+_MB = 1 << 20
+
+
+@dataclass
+class BenchType:
+    data_type: str
+    store_place: str
+    parser: Callable
+    batches: bool = False
+
+
+BENCH_TYPES = {
+    'logs': BenchType('logs', 'TJLines', techjrnl.parse),
+    'apdx': BenchType('apdx', 'ApdexLines', apdex.parse),
+    'cntr': BenchType('cntr', 'CounterLines', syscounters.parse_columnar, batches=True),
+}
+
+
+def write_files(home: str, data_type: str, files: int, size_mb: float) -> int:
+    """ Write synthetic files of type into FTP home, return total size in bytes """
+    os.makedirs(home, exist_ok=True)
+    for sub_dir in (FtpSession.PARSING, FtpSession.DONE, FtpSession.FAIL):
+        os.makedirs(os.path.join(home, sub_dir), exist_ok=True)
+    for i in range(files):
+        if data_type == 'logs':
+            path = os.path.join(home, f'rphost_{1000 + i}_200923{i % 24:02}.log')
+            techjrnl._write_synthetic_journal(path, int(size_mb * 1024))
+        elif data_type == 'apdx':  # ~120 bytes per measurement
+            path = os.path.join(home, f'apdex_{i}.xml')
+            apdex._write_synthetic_apdex(path, 20, max(1, int(size_mb * _MB / 120 / 20)))
+        else:  # ~26 bytes per UTF-16 cell
+            path = os.path.join(home, f'counters_{i}.csv')
+            syscounters._write_synthetic_counters(path, 50, max(1, int(size_mb * _MB / 26 / 50)))
+    return sum(os.path.getsize(entry.path) for entry in os.scandir(home) if entry.is_file())
+
+
+def restore_files(home: str):
+    """ Move processed files back to FTP home """
+    for sub_dir in (FtpSession.PARSING, FtpSession.DONE, FtpSession.FAIL):
+        for name in os.listdir(os.path.join(home, sub_dir)):
+            os.replace(os.path.join(home, sub_dir, name), os.path.join(home, name))
+
+
+def start_ftp(root: str):
+    """ Local FTP server thread, return (server, port) """
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_user(FTP_USER, FTP_PWD, root, perm='elradfmwMT')
+    handler = type('BenchFTPHandler', (FTPHandler,), {'authorizer': authorizer})
+    server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.address[1]
+
+
+class _Timed:
+    """ Session proxy, adds its method calls time to the stage """
+
+    def __init__(self, session, stage: str, times: dict):
+        self._session = session
+        self._stage = stage
+        self._times = times
+
+    def __getattr__(self, name):
+        attr = getattr(self._session, name)
+        if not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            begin = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._times[self._stage] += time.perf_counter() - begin
+        return timed
+
+
+class _LinesCounter(ParserJob.Validator):
+    def __init__(self):
+        self.lines = 0
+
+    def on_line(self, line: tuple):
+        self.lines += 1
+
+    def on_batch(self, batch):
+        self.lines += len(batch)
+
+    def merge(self, other: '_LinesCounter'):
+        self.lines += other.lines
+
+
+@dataclass
+class BenchCase:
+    data_type: str
+    ftp_port: int
+    stream: bool = True
+    pg_key: dict = None  # None for MemSession storage
+    chunk_size: int = PGCopySession.DEFAULT_CHUNK_SIZE
+
+
+@dataclass
+class BenchResult:
+    data_type: str
+    files: int = 0
+    bytes: int = 0
+    lines: int = 0
+    seconds: float = 0.0
+    stages: dict = field(default_factory=dict)
+    peak_rss: int = 0  # bytes
+
+    def __repr__(self):
+        seconds = self.seconds or float('nan')
+        return '[{}]:files.{}:{:.1f}MB:lines.{}:{:.2f}s:{:.0f}lines/s:{:.1f}MB/s:{}:rss.{:.0f}MB'.format(
+            self.data_type, self.files, self.bytes / _MB, self.lines, self.seconds,
+            self.lines / seconds, self.bytes / _MB / seconds,
+            ':'.join(f'{stage}.{value:.2f}s' for stage, value in self.stages.items()),
+            self.peak_rss / _MB,
+        )
+
+
+def run_case(case: BenchCase) -> BenchResult:
+    """ Processor.execute for all case type files, run it in fresh process for peak RSS """
+    bench_type = BENCH_TYPES[case.data_type]
+    times = defaultdict(float)
+    transfer = FtpSession({'host': '127.0.0.1', 'port': case.ftp_port, 'user': FTP_USER, 'pwd': FTP_PWD},
+                          stream=case.stream)
+    _filter = DataFilter().add('base1s', BASE1S)
+    storage = PGCopySession(case.pg_key, _filter, case.chunk_size) if case.pg_key else MemSession(_filter)
+
+    processor = Processor(_Timed(transfer, 'transfer', times), _Timed(storage, 'store', times))
+    counter = _LinesCounter()
+    processor.add_parser_job(
+        ParserJob(
+            parser=bench_type.parser,
+            data_type=bench_type.data_type,
+            transfer_path=bench_type.data_type,
+            store_place=bench_type.store_place,
+            validator=counter,
+            batches=bench_type.batches,
+        )
+    )
+    begin = time.perf_counter()
+    processor.execute()
+    seconds = time.perf_counter() - begin
+
+    result = BenchResult(case.data_type, lines=counter.lines, seconds=seconds)
+    result.stages = {
+        'transfer': times['transfer'],
+        'parse': seconds - times['transfer'] - times['store'],
+        'store': times['store'],
+    }
+    result.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux: kilobytes
+    return result
+
+
+def bench(sizes: dict, files: int = 1, stream: bool = True, pg_key: dict = None, root: str = None) -> list:
+    """ Benchmark types of sizes {data_type: file size MB}, return BenchResult list """
+    root = root or tempfile.mkdtemp(prefix='dt_bench_')
+    server, port = start_ftp(root)
+    results = []
+    try:
+        context = multiprocessing.get_context('spawn')
+        for data_type, size_mb in sizes.items():
+            home = os.path.join(root, data_type)
+            total = write_files(home, data_type, files, size_mb)
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                result = pool.submit(run_case, BenchCase(data_type, port, stream, pg_key)).result()
+            result.files, result.bytes = files, total
+            restore_files(home)
+            results.append(result)
+    finally:
+        server.close_all()
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def _pg_key(value: str) -> dict:
+    # db_name=perf,user=postgres,pwd=,host=localhost[,port=5432]
+    return dict(item.split('=', 1) for item in value.split(','))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline ingestion benchmark')
+    parser.add_argument('--files', type=int, default=1, help='files count of each type')
+    parser.add_argument('--logs-mb', type=float, default=20, help='technical journal file size, 0 to skip')
+    parser.add_argument('--apdx-mb', type=float, default=5, help='APDEX file size, 0 to skip')
+    parser.add_argument('--cntr-mb', type=float, default=5, help='perfmon counters file size, 0 to skip')
+    parser.add_argument('--staged', action='store_true', help='FtpSession staged mode instead of stream')
+    parser.add_argument('--pg', type=_pg_key, help='PGCopySession key, MemSession is used by default')
+    args = parser.parse_args()
+
+    sizes = {'logs': args.logs_mb, 'apdx': args.apdx_mb, 'cntr': args.cntr_mb}
+    for result in bench({t: s for t, s in sizes.items() if s}, args.files, not args.staged, args.pg):
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
+
+
+from unittest import TestCase
+
+
+class _BenchTest(TestCase):
+    def test_bench(self):
+        results = bench({'logs': 0.5, 'apdx': 0.2, 'cntr': 0.2}, files=2)
+        self.assertEqual([result.data_type for result in results], ['logs', 'apdx', 'cntr'])
+        for result in results:
+            print(result)
+            self.assertTrue(result.lines)
+            self.assertEqual(set(result.stages), {'transfer', 'parse', 'store'})
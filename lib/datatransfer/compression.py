@@ -0,0 +1,159 @@
+"""
+    Transparent decompression of transferred files: <name>.gz and <name>.zst are <name> content.
+    Transfer sessions decompress while download, parsers open compressed local paths with open_text().
+    zstd requires zstandard package
+"""
+
+import gzip
+import io
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, .zst files fail
+    zstandard = None
+
+SUFFIXES = ('.gz', '.zst')
+
+
+def _suffix(name: str) -> str:
+    for suffix in SUFFIXES:
+        if name.endswith(suffix):
+            return suffix
+    return ''
+
+
+def plain_name(name: str) -> str:
+    """ File name without archive suffix: rphost_1234_20092310.log.gz -> rphost_1234_20092310.log """
+    suffix = _suffix(name)
+    return name[:-len(suffix)] if suffix else name
+
+
+def _zstd():
+    if zstandard is None:
+        raise ImportError('zstd compressed files require zstandard package')
+    return zstandard
+
+
+class _GzipDecompressor:
+    """ zlib decompressor for gzip data of several members, as gzip tool writes on append """
+
+    def __init__(self):
+        self._zlib = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    def decompress(self, data: bytes) -> bytes:
+        result = []
+        while data:
+            result.append(self._zlib.decompress(data))
+            if not self._zlib.eof:
+                break
+            data = self._zlib.unused_data  # the next member
+            self._zlib = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        return b''.join(result)
+
+    def flush(self) -> bytes:
+        return self._zlib.flush()
+
+
+class _ZstdDecompressor:
+    """ zstd decompressor for data of several frames, as zstd tool writes for concatenated files """
+
+    def __init__(self):
+        self._zstd = _zstd().ZstdDecompressor().decompressobj()
+
+    def decompress(self, data: bytes) -> bytes:
+        result = []
+        while data:
+            result.append(self._zstd.decompress(data))
+            if not self._zstd.eof:
+                break
+            data = self._zstd.unused_data  # the next frame
+            self._zstd = _zstd().ZstdDecompressor().decompressobj()
+        return b''.join(result)
+
+    def flush(self) -> bytes:
+        return b''
+
+
+def _zstd_reader(path: str):
+    # all frames of the file, reader stops at the end of the first one by default
+    return _zstd().ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+
+
+def decompressor(name: str):
+    """ Incremental decompressor by file name suffix: decompress(bytes), flush(); None for plain file """
+    suffix = _suffix(name)
+    if suffix == '.gz':
+        return _GzipDecompressor()
+    if suffix == '.zst':
+        return _ZstdDecompressor()
+    return None
+
+
+def open_text(path: str, encoding: str = None):
+    """ open(path, encoding=encoding) for plain and compressed files """
+    suffix = _suffix(path)
+    if suffix == '.gz':
+        return gzip.open(path, 'rt', encoding=encoding)
+    if suffix == '.zst':
+        return io.TextIOWrapper(_zstd_reader(path), encoding)
+    return open(path, encoding=encoding)
+
+
+def open_binary(path: str):
+    """ open(path, 'rb') for plain and compressed files: decompressed content """
+    suffix = _suffix(path)
+    if suffix == '.gz':
+        return gzip.open(path, 'rb')
+    if suffix == '.zst':
+        return _zstd_reader(path)
+    return open(path, 'rb')
+
+
+import os
+import tempfile
+from unittest import TestCase, skipIf
+
+
+class _CompressionTest(TestCase):
+    TEXT = 'Строка журнала,Descr=\'a\r\nb\'\r\n' * 1000
+
+    def setUp(self) -> None:
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        for name in os.listdir(self._dir):
+            os.remove(os.path.join(self._dir, name))
+        os.rmdir(self._dir)
+
+    def _check(self, name: str, data: bytes):
+        path = os.path.join(self._dir, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        with open_text(path, 'utf-16') as file:
+            self.assertEqual(file.read(), self.TEXT.replace('\r\n', '\n'))
+
+        unpack = decompressor(name)
+        chunks = [unpack.decompress(data[i:i + 100]) for i in range(0, len(data), 100)]
+        self.assertEqual(b''.join(chunks) + unpack.flush(), self.TEXT.encode('utf-16'))
+
+    def test_names(self):
+        self.assertEqual(plain_name('rphost_1234_20092310.log.gz'), 'rphost_1234_20092310.log')
+        self.assertEqual(plain_name('apdex.xml.zst'), 'apdex.xml')
+        self.assertEqual(plain_name('counters.csv'), 'counters.csv')
+        self.assertIsNone(decompressor('counters.csv'))
+
+    def test_gzip(self):
+        data = self.TEXT.encode('utf-16')
+        half = len(data) // 2
+        self._check('journal.log.gz', gzip.compress(data[:half]) + gzip.compress(data[half:]))  # two members
+
+    @skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        data = self.TEXT.encode('utf-16')
+        half = len(data) // 2
+        self._check('journal.log.zst', zstandard.ZstdCompressor().compress(data))
+        self._check(
+            'journal.log.zst',
+            zstandard.ZstdCompressor().compress(data[:half]) + zstandard.ZstdCompressor().compress(data[half:])
+        )  # two frames
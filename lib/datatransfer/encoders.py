@@ -0,0 +1,148 @@
+"""
+    Line encoders for ParserJob: dimension values of lines are stored once in dictionary tables,
+    storage lines get dictionary ids, see sql/counter_dims.sql
+"""
+
+from collections import namedtuple
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from lib.pg_utils import copy_value, record_text
+
+from .aggregators import text_hash
+from .procesor import ParserJob
+
+CounterFact = namedtuple('CounterFact', ('dim_id', 'stamp', 'flt_value', 'str_value'))
+_counter_fact = partial(tuple.__new__, CounterFact)
+
+
+class CounterDims(ParserJob.Encoder):
+    """ Counter lines (syscounters.CounterLine or parse_columnar batches) as CounterFact lines of CounterFacts:
+        counter, host, context and type are replaced by dim_id, signed 64 bit hash of them.
+        Ids are known without storage round trips, in-process cache keeps ids of met dimensions.
+        Dimensions met first in the file are flushed at once, so they are stored before the facts
+    """
+    TABLE = 'CounterDims'
+    STORE_PLACE = 'CounterFacts'
+    FIELDS = ('counter', 'host', 'context', 'type')
+
+    def __init__(self):
+        self._ids = {}  # dimension values -> id, all files of process, counters dimensions are few
+        self._file = set()  # file dimension ids
+        self._new = []  # (id, values) of file dimensions not flushed yet
+
+    def _id(self, values: tuple) -> int:
+        dim_id = self._ids.get(values)
+        if dim_id is None:
+            dim_id = self._ids[values] = text_hash('\t'.join(map(copy_value, values)))  # COPY line of values
+        if dim_id not in self._file:
+            self._file.add(dim_id)
+            self._new.append((dim_id, values))
+        return dim_id
+
+    def encode_line(self, line: tuple) -> tuple:
+        dim_id = self._id((line.counter, line.host, line.context, line.type))
+        return _counter_fact((dim_id, line.stamp, line.flt_value, line.str_value))
+
+    def encode_batch(self, batch):
+        # rows of the same dimensions are found by column codes, values of each dimensions are hashed once
+        columns = [batch[name].to_numpy() for name in self.FIELDS]
+        keys = np.zeros(len(batch), dtype=np.int64)
+        for column in columns:
+            codes, uniques = pd.factorize(column)  # None, NaN code is -1: shifted to the own slot 0
+            keys = keys * (len(uniques) + 1) + codes + 1
+        keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        ids = np.array([self._id(tuple(column[i] for column in columns)) for i in first], dtype=np.int64)
+        return pd.DataFrame({
+            'dim_id': ids[inverse.ravel()],
+            'stamp': batch['stamp'].to_numpy(),
+            'flt_value': batch['flt_value'].to_numpy(),
+            'str_value': batch['str_value'].to_numpy(),
+        })
+
+    def _rows(self) -> list:
+        rows = [
+            {'id': dim_id, **{
+                name: record_text(value) if isinstance(value, tuple) else value
+                for name, value in zip(self.FIELDS, values)
+            }}
+            for dim_id, values in self._new
+        ]
+        self._new = []
+        return rows
+
+    def flush(self) -> dict:
+        if not self._new:  # frequent case: called for each line
+            return {}
+        return {self.TABLE: self._rows()}
+
+    def dicts(self) -> dict:
+        rows = self._rows()
+        self._file = set()
+        return {self.TABLE: rows}
+
+
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from ._session import batch_lines
+
+from .parsers import syscounters
+
+
+class _CounterDimsTest(TestCase):
+    def setUp(self) -> None:
+        self._path = os.path.join(tempfile.gettempdir(), 'counter_dims_test.csv')
+        syscounters._write_synthetic_counters(self._path, 5, 300)
+
+    def tearDown(self) -> None:
+        os.remove(self._path)
+
+    def test_lines_and_batches(self):
+        by_lines, by_batches = CounterDims(), CounterDims()
+        lines = list(syscounters.parse(self._path, 'counters.csv', 0))
+        facts = [by_lines.encode_line(line) for line in lines]
+        batch = pd.concat([
+            by_batches.encode_batch(batch)
+            for batch in syscounters.parse_columnar(self._path, 'counters.csv', 0, chunk_rows=7)
+        ])
+        self.assertEqual(list(batch['dim_id']), [fact.dim_id for fact in facts])
+        self.assertEqual(list(batch['str_value']), [fact.str_value for fact in facts])
+
+        dims = by_lines.dicts()[CounterDims.TABLE]
+        self.assertEqual(dims, by_batches.dicts()[CounterDims.TABLE])
+        self.assertEqual(len(dims), 5)
+        self.assertEqual(
+            dims[0],
+            {'id': facts[0].dim_id, 'counter': '(SRV-1C,"Process(rphost#0)","% Processor Time")', 'host': 'SRV-1C',
+             'context': 'Process(rphost#0)', 'type': '% Processor Time'}
+        )
+        self.assertEqual(by_lines.dicts(), {CounterDims.TABLE: []})  # reset
+        self.assertEqual(by_lines.encode_line(lines[0]).dim_id, facts[0].dim_id)  # cached id
+
+    def test_batch_none(self):
+        rows = [('c1', 'h1', 'x', 'u'), ('c1', 'h1', 'x', 'v'), ('c1', 'h1', 'y', None)]  # (y, None) key was (x, v) one
+        batch = pd.DataFrame(
+            [{'counter': counter, 'host': host, 'context': context, 'type': _type, 'stamp': datetime(2020, 9, 23),
+              'flt_value': 1.0, 'str_value': '1'} for counter, host, context, _type in rows]
+        )
+        ids = list(CounterDims().encode_batch(batch)['dim_id'])
+        self.assertEqual(ids, [CounterDims().encode_line(line).dim_id for line in batch_lines(batch)])
+        self.assertEqual(len(set(ids)), 3)
+
+    def test_flush(self):
+        dims = CounterDims()
+        lines = list(syscounters.parse(self._path, 'counters.csv', 0))
+        flushed = []
+        for line in lines:
+            dim_id = dims.encode_line(line).dim_id
+            flushed.extend(row['id'] for row in dims.flush().get(CounterDims.TABLE, []))
+            self.assertIn(dim_id, flushed)  # stored before the fact
+        self.assertEqual(len(flushed), 5)  # once per file
+        self.assertEqual(dims.dicts(), {CounterDims.TABLE: []})  # rest is flushed
+        dims.encode_line(lines[0])
+        self.assertEqual(len(dims.flush()[CounterDims.TABLE]), 1)  # the next file stores its dims again
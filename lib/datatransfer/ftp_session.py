@@ -1,57 +1,236 @@
 import ftplib
+import hashlib
+import io
 import os
+import shutil
 import tempfile
+import threading
+import time
+from collections import deque
 
+try:
+    import fcntl
+except ImportError:  # not posix, stream mode is not available
+    fcntl = None
+
+from . import compression
 from ._session import TransferSession
 
 
 class FtpSession(TransferSession):
+    """ Stream mode (default on posix): local path of the file is a named pipe, which is filled
+        by download thread while parser reads it, so download overlaps parse and store.
+        Without stream mode the file is staged in session temp dir before parsing.
+        Compressed files (.gz, .zst) are decompressed while download, file name is without archive suffix.
+        Claim time is set as the claimed file modify time (MFMT), files of crashed runs are claimed again
+        after stale_age seconds, so the storage resumes them (see PGCheckpointSession).
+    """
 
     PARSING: str = 'pars'
     DONE: str = 'done'
     FAIL: str = 'fail'
 
-    def __init__(self, key):
+    PIPE_SIZE: int = 1 << 20  # stream mode pipe buffer, bytes
+    STALE_AGE: float = 6 * 3600  # seconds, claimed file older than it is left by crashed run
+
+    def __init__(self, key, stream: bool = True, stale_age: float = STALE_AGE):
         super().__init__()
-        self._con = ftplib.FTP(key['host'])
+        self._key = key
+        self._stream = stream and hasattr(os, 'mkfifo')
+        self._stale_age = stale_age
+        self._con = ftplib.FTP()
+        self._con.connect(key['host'], key.get('port', 0))
         self._con.login(key['user'], key['pwd'])
+        try:  # without MFMT claim time is unknown, claimed files are not reclaimed
+            self._reclaim = 'MFMT' in self._con.sendcmd('FEAT')
+        except ftplib.error_perm:
+            self._reclaim = False
         self._file_name = None
         self._local_path = None
         self._home_dir = None
         self._file_type = None
+        self._fingerprint = None
+        self._stages = {}  # attached file transfer stages, see file_stages()
+
+        # claim queues of listed home dir files by data type, re-listed when empty
+        self._queues = {}
+        self.listing_count = 0
+        self.listing_time = 0.0  # seconds
+
+        # own dir of local files: workers and bases may have files of the same name
+        self._local_dir = tempfile.mkdtemp()
+
+        # stream mode download thread
+        self._loader = None
+        self._load_error = None
 
     def __del__(self):
         self._con.close()
+        shutil.rmtree(self._local_dir, ignore_errors=True)
+
+    def __repr__(self) -> str:
+        # listing metric: ls.<count>:<seconds>
+        return f'ls.{self.listing_count}:{self.listing_time:.2f}s'
+
+    def _spawn_args(self) -> tuple:
+        return self._key, self._stream, self._stale_age
+
+    def _download(self, remote_path: str, local_file):
+        # download with decompression and content hash calculation, hash is of decompressed content
+        begin = time.perf_counter()
+        content_hash = hashlib.sha256()
+        unpack = compression.decompressor(remote_path)
+        sizes = [0, 0]  # wire bytes, bytes
+
+        def write(data: bytes):
+            sizes[0] += len(data)
+            if unpack:
+                data = unpack.decompress(data)
+            sizes[1] += len(data)
+            content_hash.update(data)
+            local_file.write(data)
+
+        self._con.retrbinary(f'RETR {remote_path}', write)
+        if unpack:
+            tail = unpack.flush()
+            sizes[1] += len(tail)
+            content_hash.update(tail)
+            local_file.write(tail)
+        self._fingerprint = content_hash.hexdigest()
+        self._stages.update(
+            download_ms=(time.perf_counter() - begin) * 1000, wire_bytes=sizes[0], bytes=sizes[1]
+        )
+
+    def _load_stream(self, remote_path: str):
+        # download thread: FTP data connection -> named pipe -> parser
+        replied = True  # server reply for RETR is read
+        try:
+            with open(self._local_path, 'wb') as pipe:  # wait for parser open
+                if hasattr(fcntl, 'F_SETPIPE_SZ'):
+                    try:
+                        fcntl.fcntl(pipe, fcntl.F_SETPIPE_SZ, self.PIPE_SIZE)
+                    except OSError:  # over system limit, default size is used
+                        pass
+                replied = False
+                self._download(remote_path, pipe)
+                replied = True
+        except ftplib.Error as e:
+            self._load_error = e
+        except Exception as e:
+            self._load_error = e
+            if not replied:  # data connection is aborted, skip the transfer reply
+                try:
+                    self._con.voidresp()
+                except ftplib.all_errors:
+                    pass
+
+    def _close_stream(self):
+        # wait for download thread, unblock it if parser has not read the pipe to the end
+        while self._loader.is_alive():
+            try:
+                os.close(os.open(self._local_path, os.O_RDONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+            self._loader.join(0.1)
+        self._loader = None
+
+    def _exists(self, path: str) -> bool:
+        try:
+            self._con.sendcmd(f'MLST {path}')
+        except ftplib.error_perm:
+            return False
+        return True
+
+    def _claim(self, home_dir: str, name: str, to_dir: str, touch: bool = False) -> bool:
+        # rename is the file claim, other sessions may work with the same home dir
+        try:
+            if touch:  # claim time is set before rename: claimed file is never seen stale
+                self._con.voidcmd(f'MFMT {time.strftime("%Y%m%d%H%M%S", time.gmtime())} {home_dir}/{name}')
+            self._con.rename(f'{home_dir}/{name}', f'{to_dir}/{name}')
+        except ftplib.error_perm as e:
+            if not str(e).startswith('550') or self._exists(f'{home_dir}/{name}'):
+                raise
+            return False  # no source file: claimed by other session
+        return True
+
+    def _files(self, path: str) -> list:
+        # [(modify, name)] of dir files, oldest first
+        return sorted(
+            (facts.get('modify', ''), name)
+            for name, facts in self._con.mlsd(path, facts=['type', 'modify'])
+            if facts['type'] == 'file'
+        )
+
+    def _list_files(self, home_dir: str) -> deque:
+        # pending file names of home dir, oldest first; reclaimed files of crashed runs are the first
+        begin = time.perf_counter()
+        reclaimed = []
+        if self._reclaim:
+            process_dir = f'{home_dir}/{self.PARSING}'
+            border = time.strftime('%Y%m%d%H%M%S', time.gmtime(time.time() - self._stale_age))
+            for modify, name in self._files(process_dir):
+                if modify[:14] <= border and self._claim(process_dir, name, home_dir):
+                    reclaimed.append(name)
+        files = [name for modify, name in self._files(home_dir) if name not in reclaimed]
+        self.listing_time += time.perf_counter() - begin
+        self.listing_count += 1
+        return deque(reclaimed + files)
 
     def attach_file(self, data_type: str) -> int:  # -> file_id, None if home dir is empty
+        begin = time.perf_counter()
         self._home_dir = self._transfer_rule[data_type]
-        files = self._con.mlsd(self._home_dir)
-
         self._file_type = data_type
         self._file_name = None
-        for name, facts in files:
-            if facts['type'] == 'file':
-                self._file_name = name
-                break
+        self._fingerprint = None
+        self._stages = {}
+        process_dir = f'{self._home_dir}/{self.PARSING}'
+
+        queue = self._queues.get(data_type)
+        listed = False
+        while True:
+            if not queue:
+                if listed:
+                    break
+                queue = self._queues[data_type] = self._list_files(self._home_dir)
+                listed = True
+                continue
+            name = queue.popleft()
+            if not self._claim(self._home_dir, name, process_dir, touch=self._reclaim):
+                continue
+            self._file_name = name
+            break
 
         if not self._file_name:
             return 0
+        self._stages['list_ms'] = (time.perf_counter() - begin) * 1000
 
-        process_dir = f'{self._home_dir}/{self.PARSING}'
-
-        self._con.rename(
-            f'{self._home_dir}/{self._file_name}',
-            f'{process_dir}/{self._file_name}'
-        )
+        if self._stream:
+            self._local_path = os.path.join(self._local_dir, compression.plain_name(self._file_name))
+            os.mkfifo(self._local_path)
+            self._load_error = None
+            self._loader = threading.Thread(
+                target=self._load_stream, args=(f'{process_dir}/{self._file_name}',), daemon=True
+            )
+            self._loader.start()
+            return 1
 
-        tmp_dir = tempfile.gettempdir()
-        self._local_path = f'{tmp_dir}/{self._file_name}'
+        self._local_path = os.path.join(self._local_dir, compression.plain_name(self._file_name))
         parse_file = open(self._local_path, 'wb')
-        self._con.retrbinary("RETR " + f'{process_dir}/{self._file_name}', parse_file.write)
+        self._download(f'{process_dir}/{self._file_name}', parse_file)
         parse_file.close()
         return 1  # threading plug
 
+    def finish_file(self, file_id: int):
+        if not self._loader:
+            return
+        self._close_stream()
+        error, self._load_error = self._load_error, None
+        if error:
+            raise error
+
     def to_fail(self, file_id: int):
+        if self._loader:
+            self._close_stream()
         self._con.rename(
             f'{self._home_dir}/{self.PARSING}/{self._file_name}',
             f'{self._home_dir}/{self.FAIL}/{self._file_name}'
@@ -59,6 +238,8 @@ class FtpSession(TransferSession):
         os.remove(self._local_path)
 
     def to_done(self, file_id: int):
+        if self._loader:
+            self._close_stream()
         self._con.rename(
             f'{self._home_dir}/{self.PARSING}/{self._file_name}',
             f'{self._home_dir}/{self.DONE}/{self._file_name}'
@@ -69,7 +250,22 @@ class FtpSession(TransferSession):
         return self._local_path
 
     def file_name(self, file_id) -> str:
-        return self._file_name
+        # .gz and .zst files are downloaded decompressed
+        return compression.plain_name(self._file_name)
+
+    def fingerprint(self, file_id) -> str:
+        # sha256 of file content, stream mode: known after finish_file
+        return None if self._loader else self._fingerprint
+
+    def file_stages(self, file_id) -> dict:
+        # stream mode: download is known after finish_file
+        return {} if self._loader else dict(self._stages)
+
+    def pending(self, data_type: str) -> int:
+        # listed files not claimed yet, home dir is re-listed when they are over
+        if not self._queues.get(data_type):
+            self._queues[data_type] = self._list_files(self._transfer_rule[data_type])
+        return len(self._queues[data_type])
 
 
 from unittest import TestCase
@@ -88,4 +284,60 @@ class _FtpSessionTest(TestCase):
         print(s.local_path(_id))
         s.to_fail(_id)
 
+    def test_listing(self):
+        s = FtpSession(KeyChain.FTP_TJ_KEYS['tjtest'])
+        s.add_transfer_rule('logs', 'logs')
+        for i in range(2):
+            s.to_fail(s.attach_file('logs'))
+        self.assertEqual(s.listing_count, 1)
+
+    def test_stream(self):
+        s = FtpSession(KeyChain.FTP_TJ_KEYS['tjtest'], stream=True)
+        s.add_transfer_rule('logs', 'logs')
+        _id = s.attach_file('logs')
+        with open(s.local_path(_id), 'rb') as stream:
+            size = len(stream.read())
+        s.finish_file(_id)
+        stages = s.file_stages(_id)
+        s.to_fail(_id)
+        self.assertTrue(size)
+        self.assertEqual(stages['bytes'], size)
+        self.assertTrue(stages['wire_bytes'] and 'list_ms' in stages and 'download_ms' in stages)
+
+        _id = s.attach_file('logs')  # parser failed without reading
+        s.to_fail(_id)
+
+    def test_staged_dir(self):
+        sessions = [FtpSession(KeyChain.FTP_TJ_KEYS['tjtest'], stream=False) for _ in range(2)]
+        paths = []
+        for s in sessions:
+            s.add_transfer_rule('logs', 'logs')
+            paths.append(s.local_path(s.attach_file('logs')))
+        self.assertNotEqual(os.path.dirname(paths[0]), os.path.dirname(paths[1]))  # own dir of each session
+        for s, path in zip(sessions, paths):
+            self.assertTrue(os.path.isfile(path))
+            s.to_fail(1)
+            self.assertFalse(os.path.exists(path))
+
+    def test_claim_race(self):
+        sessions = [FtpSession(KeyChain.FTP_TJ_KEYS['tjtest'], stream=False) for _ in range(2)]
+        for s in sessions:
+            s.add_transfer_rule('logs', 'logs')
+        sessions[0].pending('logs')  # listed before the other session claim
+        sessions[1].attach_file('logs')
+        sessions[0].attach_file('logs')
+        self.assertNotEqual(sessions[0].file_name(1), sessions[1].file_name(1))  # claimed file is skipped
+        for s in sessions:
+            s.to_fail(1)
 
+    def test_claim_error(self):
+        s = FtpSession(KeyChain.FTP_TJ_KEYS['tjtest'], stream=False)
+        s._con.mkd('no_pars')  # home dir without process dir
+        s._con.storbinary('STOR no_pars/file.log', io.BytesIO(b'line'))
+        s.add_transfer_rule('logs', 'no_pars')
+        try:
+            with self.assertRaises(ftplib.error_perm):  # not a claim race, is not skipped
+                s.attach_file('logs')
+        finally:
+            s._con.delete('no_pars/file.log')
+            s._con.rmd('no_pars')
@@ -0,0 +1,297 @@
+import ctypes
+import ctypes.util
+import hashlib
+import mmap
+import os
+import struct
+import time
+from collections import deque
+
+from . import compression
+from ._session import TransferSession
+
+
+class _Inotify:
+    """ Linux inotify by libc, non-blocking: names of files closed after write or moved into watched dirs """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = os.O_CLOEXEC
+    _EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}  # watch descriptor -> dir
+
+    def add(self, path: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.IN_CLOSE_WRITE | self.IN_MOVED_TO)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed: {path}')
+        self._dirs[wd] = path
+
+    def events(self) -> list:
+        # [(dir, file name)] since the last call
+        result = []
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                return result
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, length = self._EVENT.unpack_from(data, pos)
+                pos += self._EVENT.size
+                name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+                pos += length
+                if wd in self._dirs and name:
+                    result.append((self._dirs[wd], name))
+
+    def close(self):
+        os.close(self._fd)
+
+
+class LocalDirSession(TransferSession):
+    """ Transfer session for the FTP root on this host (e.g. ~/ftp/vgunf): files are claimed
+        by os.rename into pars dir, as FtpSession does by FTP rename, and parsed in place, without copy.
+        File is ready when its last modification is settle seconds ago, so files being uploaded are not taken.
+        With watch=True (Linux inotify) files closed after write are ready at once.
+        Compressed files (.gz, .zst) are parsed as is, file name is without archive suffix.
+    """
+
+    PARSING: str = 'pars'
+    DONE: str = 'done'
+    FAIL: str = 'fail'
+
+    SETTLE: float = 30.0  # seconds
+
+    def __init__(self, root: str, settle: float = SETTLE, watch: bool = False, fingerprints: bool = True):
+        super().__init__()
+        self._root = root
+        self._path = os.path.expanduser(root)
+        self._settle = settle
+        self._fingerprints = fingerprints
+        self._file_name = None
+        self._home_dir = None
+        self._fingerprint = None
+        self._stages = {}  # attached file transfer stages, see file_stages()
+
+        # claim queues of listed home dir files by data type, re-listed when empty
+        self._queues = {}
+        self._closed = {}  # home dir -> names of files closed after write, by inotify
+        self._inotify = _Inotify() if watch else None
+        self.listing_count = 0
+        self.listing_time = 0.0  # seconds
+
+    def __del__(self):
+        if getattr(self, '_inotify', None):
+            self._inotify.close()
+
+    def __repr__(self) -> str:
+        # listing metric: ls.<count>:<seconds>
+        return f'ls.{self.listing_count}:{self.listing_time:.2f}s'
+
+    def _spawn_args(self) -> tuple:
+        return self._root, self._settle, self._inotify is not None, self._fingerprints
+
+    def add_transfer_rule(self, data_type: str, transfer_path: str):
+        super().add_transfer_rule(data_type, transfer_path)
+        home_dir = os.path.join(self._path, transfer_path)
+        for _dir in (self.PARSING, self.DONE, self.FAIL):
+            os.makedirs(os.path.join(home_dir, _dir), exist_ok=True)
+        self._watch(home_dir)
+
+    def _watch(self, home_dir: str):
+        # worker process copy starts watching on the first listing
+        if self._inotify and home_dir not in self._closed:
+            self._closed[home_dir] = set()
+            self._inotify.add(home_dir)
+
+    def _list_files(self, home_dir: str) -> deque:
+        # ready file names of home dir, oldest first
+        begin = time.perf_counter()
+        self._watch(home_dir)
+        if self._inotify:
+            for _dir, name in self._inotify.events():
+                self._closed[_dir].add(name)
+        closed = self._closed.get(home_dir, set())
+        settled = time.time() - self._settle
+        files = []
+        with os.scandir(home_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                modify = entry.stat().st_mtime
+                if modify <= settled or entry.name in closed:
+                    files.append((modify, entry.name))
+        self.listing_time += time.perf_counter() - begin
+        self.listing_count += 1
+        return deque(name for modify, name in sorted(files))
+
+    def _home_path(self, *parts, data_type: str = None) -> str:
+        home_dir = self._transfer_rule[data_type] if data_type else self._home_dir
+        return os.path.join(self._path, home_dir, *parts)
+
+    def _content_hash(self, path: str) -> str:
+        # sha256 of file content, decompressed for .gz and .zst as FtpSession hash is
+        content_hash = hashlib.sha256()
+        size = 0
+        if path.endswith(compression.SUFFIXES):
+            with compression.open_binary(path) as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    size += len(block)
+                    content_hash.update(block)
+        elif os.path.getsize(path):
+            with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                size = len(data)
+                content_hash.update(data)
+        self._stages['bytes'] = size
+        return content_hash.hexdigest()
+
+    def attach_file(self, data_type: str) -> int:  # -> file_id, None if home dir is empty
+        begin = time.perf_counter()
+        self._home_dir = self._transfer_rule[data_type]
+        self._file_name = None
+        self._fingerprint = None
+        self._stages = {}
+        home_dir = self._home_path()
+
+        queue = self._queues.get(data_type)
+        listed = False
+        while True:
+            if not queue:
+                if listed:
+                    break
+                queue = self._queues[data_type] = self._list_files(home_dir)
+                listed = True
+                continue
+            name = queue.popleft()
+            try:  # rename is the file claim, other sessions may work with the same home dir
+                os.rename(os.path.join(home_dir, name), os.path.join(home_dir, self.PARSING, name))
+            except FileNotFoundError:
+                continue
+            self._closed.get(home_dir, set()).discard(name)
+            self._file_name = name
+            break
+
+        if not self._file_name:
+            return 0
+        self._stages['list_ms'] = (time.perf_counter() - begin) * 1000
+
+        path = self.local_path(1)
+        self._stages['wire_bytes'] = os.path.getsize(path)
+        if not path.endswith(compression.SUFFIXES):
+            self._stages['bytes'] = self._stages['wire_bytes']
+        if self._fingerprints:
+            begin = time.perf_counter()
+            self._fingerprint = self._content_hash(path)
+            self._stages['download_ms'] = (time.perf_counter() - begin) * 1000  # content read instead of download
+        return 1
+
+    def _move(self, target: str):
+        os.rename(
+            self._home_path(self.PARSING, self._file_name),
+            self._home_path(target, self._file_name)
+        )
+
+    def to_fail(self, file_id: int):
+        self._move(self.FAIL)
+
+    def to_done(self, file_id: int):
+        self._move(self.DONE)
+
+    def local_path(self, file_id) -> str:
+        # parsers read the claimed file in place
+        return self._home_path(self.PARSING, self._file_name)
+
+    def file_name(self, file_id) -> str:
+        return compression.plain_name(self._file_name)
+
+    def fingerprint(self, file_id) -> str:
+        return self._fingerprint
+
+    def file_stages(self, file_id) -> dict:
+        return dict(self._stages)
+
+    def pending(self, data_type: str) -> int:
+        # listed files not claimed yet, home dir is re-listed when they are over
+        if not self._queues.get(data_type):
+            self._queues[data_type] = self._list_files(self._home_path(data_type=data_type))
+        return len(self._queues[data_type])
+
+
+import gzip
+import pickle
+import shutil
+import sys
+import tempfile
+from unittest import TestCase, skipIf
+
+
+class _LocalDirSessionTest(TestCase):
+    def setUp(self) -> None:
+        self._root = tempfile.mkdtemp()
+        self._logs = os.path.join(self._root, 'logs')
+        os.makedirs(self._logs)
+        for i in range(3):
+            with open(os.path.join(self._logs, f'rphost_{i}_20092310.log'), 'wb') as file:
+                file.write(f'file {i}'.encode())
+            os.utime(os.path.join(self._logs, f'rphost_{i}_20092310.log'), (1000 + i, 1000 + i))
+        with open(os.path.join(self._logs, 'rphost_3_20092310.log.gz'), 'wb') as file:
+            file.write(gzip.compress(b'file 3'))
+        os.utime(os.path.join(self._logs, 'rphost_3_20092310.log.gz'), (2000, 2000))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self._root)
+
+    def _session(self, **kwargs) -> LocalDirSession:
+        session = LocalDirSession(self._root, **kwargs)
+        session.add_transfer_rule('logs', 'logs')
+        return session
+
+    def test_claim(self):
+        session = self._session()
+        self.assertEqual(session.pending('logs'), 4)
+        other = pickle.loads(pickle.dumps(session))  # worker copy with the same home dir
+        self.assertEqual(other.attach_file('logs'), 1)  # the oldest file is claimed
+        self.assertEqual(other.file_name(1), 'rphost_0_20092310.log')
+
+        names = []
+        while session.attach_file('logs'):
+            self.assertTrue(os.path.isfile(session.local_path(1)))  # in place
+            names.append(session.file_name(1))
+            (session.to_done if len(names) % 2 else session.to_fail)(1)
+        self.assertEqual(names, ['rphost_1_20092310.log', 'rphost_2_20092310.log', 'rphost_3_20092310.log'])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self._logs, 'done'))), ['rphost_1_20092310.log', 'rphost_3_20092310.log.gz']
+        )
+        self.assertEqual(os.listdir(os.path.join(self._logs, 'pars')), ['rphost_0_20092310.log'])
+        self.assertEqual(session.listing_count, 2)
+
+    def test_fingerprint(self):
+        session = self._session()
+        fingerprints = {}
+        while session.attach_file('logs'):
+            fingerprints[session.file_name(1)] = session.fingerprint(1), session.file_stages(1)
+            session.to_done(1)
+        fingerprint, stages = fingerprints['rphost_3_20092310.log']
+        self.assertEqual(fingerprint, hashlib.sha256(b'file 3').hexdigest())  # decompressed content hash
+        self.assertEqual(stages['bytes'], 6)
+        self.assertGreater(stages['wire_bytes'], 6)
+
+    def test_settle(self):
+        path = os.path.join(self._logs, 'rphost_9_20092310.log')
+        open(path, 'w').close()  # just written
+        session = self._session(fingerprints=False)
+        self.assertEqual(session.pending('logs'), 4)
+        self.assertIsNone(session.fingerprint(session.attach_file('logs')))
+
+    @skipIf(not sys.platform.startswith('linux'), 'inotify is Linux only')
+    def test_watch(self):
+        session = self._session(watch=True)
+        path = os.path.join(self._logs, 'rphost_9_20092310.log')
+        with open(path, 'w') as file:
+            file.write('new')
+        self.assertEqual(session.pending('logs'), 5)  # closed file is ready before settle
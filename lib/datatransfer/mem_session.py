@@ -0,0 +1,96 @@
+from dataclasses import dataclass, field
+from typing import List, Dict
+
+from ._session import StorageSession, DataFilter, FileBadge, FileStages, line_values
+
+
+@dataclass
+class MemFile:
+    badge: FileBadge
+    status: str = 'new'
+    lines_count: int = 0
+    lines: List = field(default_factory=list)  # lines and batches, if session keeps lines
+    rows: Dict = field(default_factory=dict)  # side table -> rows
+    stages: FileStages = None
+
+
+class MemSession(StorageSession):
+    """ In-memory storage for tests and benchmarks, no data is saved.
+        Only lines count is kept by default, keep_lines=True keeps submitted lines and batches
+    """
+
+    def __init__(self, _filter: DataFilter = None, keep_lines: bool = False):
+        StorageSession.__init__(self, _filter)
+        self._keep_lines = keep_lines
+        self.files = {}  # file_id -> MemFile
+        self.dicts = {}  # dictionary table -> {key: row}
+
+    def _spawn_args(self) -> tuple:
+        return self._filter, self._keep_lines
+
+    def attach_file(self, badge: FileBadge) -> int:
+        for file_id, file in self.files.items():
+            if (file.badge.name, file.badge.data_type) == (badge.name, badge.data_type):
+                self.files[file_id] = MemFile(badge, 'update')
+                return file_id
+        file_id = len(self.files) + 1
+        self.files[file_id] = MemFile(badge)
+        return file_id
+
+    def submit_line(self, file_id: int, line_data: dict):
+        file = self.files[file_id]
+        file.lines_count += 1
+        if self._keep_lines:
+            file.lines.append(line_data)
+
+    def submit_batch(self, file_id: int, batch):
+        file = self.files[file_id]
+        file.lines_count += len(batch)
+        if self._keep_lines:
+            file.lines.append(batch)
+
+    def submit_rows(self, file_id: int, table: str, rows: list):
+        self.files[file_id].rows[table] = rows
+
+    def append_rows(self, file_id: int, table: str, rows: list):
+        self.files[file_id].rows.setdefault(table, []).extend(rows)
+
+    def submit_dict(self, table: str, rows: list):
+        stored = self.dicts.setdefault(table, {})
+        for row in rows:
+            stored.setdefault(line_values(row)[0], row)
+
+    def drop_file(self, file_id: int):
+        self.files[file_id].lines_count = 0
+        self.files[file_id].lines = []
+
+    def update_file_status(self, file_id, is_ok, fail_reason=None):
+        self.files[file_id].status = 'done' if is_ok else 'fail'
+
+    def submit_stages(self, file_id: int, stages: FileStages):
+        self.files[file_id].stages = stages
+
+    def is_duplicate(self, badge: FileBadge) -> bool:
+        return any(
+            file.status == 'done' and file.badge.fingerprint == badge.fingerprint
+            and file.badge.data_type == badge.data_type
+            for file in self.files.values()
+        )
+
+
+from unittest import TestCase
+
+
+class _MemSessionTest(TestCase):
+    def test_main_usage(self):
+        session = MemSession(keep_lines=True)
+        badge = FileBadge('some_data_file.xml', 'apdx', 'hash')
+        _id = session.attach_file(badge)
+        for i in range(10):
+            session.submit_line(_id, {'duration': i})
+        session.update_file_status(_id, True)
+        self.assertEqual(session.files[_id].lines_count, 10)
+        self.assertTrue(session.is_duplicate(FileBadge('renamed.xml', 'apdx', 'hash')))
+
+        self.assertEqual(session.attach_file(badge), _id)  # reload
+        self.assertEqual(session.files[_id].lines_count, 0)
@@ -0,0 +1,324 @@
+""" Parquet storage for cold performance data, requires pyarrow
+
+    Dataset layout: <root>/<filter field>=<value>/.../data_type=<type>/day=<YYYY-MM-DD>/<file_id>.parquet
+    File lines are split into day partitions by the first datetime column, the file registry is <root>/_manifest.json
+"""
+
+import json
+import os
+from datetime import datetime, date
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+
+try:
+    import fcntl
+except ImportError:  # not posix, manifest is not locked
+    fcntl = None
+
+from lib.pg_utils import record_text
+
+from ._session import StorageSession, DataFilter, FileBadge
+
+
+class _Manifest:
+    """ Dataset file registry: json {file_id: entry}, changes are done under the lock file """
+
+    def __init__(self, root: str):
+        self._path = os.path.join(root, '_manifest.json')
+        self._lock_path = os.path.join(root, '_manifest.lock')
+        self._lock = None
+        self.files = {}
+
+    def __enter__(self):
+        self._lock = open(self._lock_path, 'a')
+        if fcntl:
+            fcntl.flock(self._lock, fcntl.LOCK_EX)
+        if os.path.exists(self._path):
+            with open(self._path) as manifest:
+                self.files = {int(file_id): entry for file_id, entry in json.load(manifest).items()}
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if not exc_type:
+                with open(self._path + '.tmp', 'w') as manifest:
+                    json.dump(self.files, manifest, default=str)
+                os.replace(self._path + '.tmp', self._path)
+        finally:
+            self._lock.close()  # lock is released
+
+
+class ParquetSession(StorageSession):
+    """ File lines are written while parsing: chunks of CHUNK_LINES lines are row groups of the day partition
+        files, which are hidden (dot prefixed) until the file status commit, so memory usage doesn't depend
+        on file size. Column types of the file are set by its first chunk
+    """
+    CHUNK_LINES = 50000  # submitted lines are collected in DataFrame chunks of this size
+    COMPRESSION = 'zstd'
+
+    def __init__(self, root: str, _filter: DataFilter = None):
+        if pa is None:
+            raise ImportError('ParquetSession requires pyarrow')
+        StorageSession.__init__(self, _filter)
+        self._root = root
+        os.makedirs(root, exist_ok=True)
+
+        self._badges = {}
+        self._frames = []  # current file DataFrame chunks, not written yet
+        self._frames_lines = 0
+        self._lines = []  # current file lines, not collected into chunk yet
+        self._writers = {}  # current file day -> (pq.ParquetWriter, hidden part file path)
+        self._schema = None  # current file arrow schema
+        self._stamp = None  # current file partition column, the first datetime one
+        self._lines_count = 0  # current file written lines
+
+    def _spawn_args(self) -> tuple:
+        return self._root, self._filter
+
+    def _filter_values(self) -> dict:
+        return {item.field: item.value for item in self._filter}
+
+    def _match(self, entry: dict, badge: FileBadge) -> bool:
+        return entry['type'] == badge.data_type and entry['filter'] == self._filter_values()
+
+    def _partition(self, data_type: str, day: str) -> str:
+        parts = [f'{item.field}={item.value}' for item in self._filter]
+        return os.path.join(self._root, *parts, f'data_type={data_type}', f'day={day}')
+
+    def _remove_parts(self, entry: dict):
+        for part in entry['parts']:
+            path = os.path.join(self._root, part)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _reset_file(self):
+        # discard current file data: written part files are removed
+        for writer, path in self._writers.values():
+            writer.close()
+            os.remove(path)
+        self._writers.clear()
+        self._frames.clear()
+        self._frames_lines = 0
+        self._lines.clear()
+        self._schema = None
+        self._stamp = None
+        self._lines_count = 0
+
+    def attach_file(self, badge: FileBadge) -> int:
+        self._reset_file()
+        with _Manifest(self._root) as manifest:
+            status = 'update'
+            for file_id, entry in manifest.files.items():
+                if entry['name'] == badge.name and self._match(entry, badge):
+                    self._remove_parts(entry)  # file already submitted, clear data for update
+                    break
+            else:
+                status = 'new'
+                file_id = max(manifest.files, default=0) + 1
+            manifest.files[file_id] = {
+                'name': badge.name,
+                'type': badge.data_type,
+                'table': self._storage_rule[badge.data_type],
+                'filter': self._filter_values(),
+                'status': status,
+                'lines_count': 0,
+                'content_hash': None,
+                'parts': [],
+                'last_update': datetime.now(),
+            }
+        self._badges[file_id] = badge
+        return file_id
+
+    def _collect_lines(self):
+        if self._lines:
+            self._frames.append(pd.DataFrame(self._lines))
+            self._frames_lines += len(self._lines)
+            self._lines.clear()
+
+    def _flush_frames(self, file_id: int):
+        # write collected chunks, parser batches are joined: row groups are not too small
+        frames = [frame for frame in self._frames if len(frame)]
+        self._frames.clear()
+        self._frames_lines = 0
+        if frames:
+            self._write_parts(file_id, pd.concat(frames, ignore_index=True))
+
+    def submit_line(self, file_id: int, line_data: dict):
+        self._lines.append(line_data)
+        if len(self._lines) >= self.CHUNK_LINES:
+            self._collect_lines()
+            self._flush_frames(file_id)
+
+    def submit_batch(self, file_id: int, batch):
+        if len(batch):
+            self._collect_lines()  # lines order is kept
+            self._frames.append(batch)
+            self._frames_lines += len(batch)
+            if self._frames_lines >= self.CHUNK_LINES:
+                self._flush_frames(file_id)
+
+    def _table(self, frame: pd.DataFrame):
+        # arrow table of the file schema, the first chunk sets it
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if self._schema is None:
+            for i, column in enumerate(table.schema):
+                if pa.types.is_null(column.type):  # no values in chunk, keep dataset schema stable
+                    table = table.set_column(i, column.name, table.column(i).cast(pa.string()))
+            self._schema = table.schema
+            return table
+        columns = [
+            table.column(field.name).cast(field.type) if field.name in table.column_names
+            else pa.nulls(len(table), field.type)
+            for field in self._schema
+        ]
+        return pa.Table.from_arrays(columns, schema=self._schema)
+
+    def _write_parts(self, file_id: int, frame: pd.DataFrame):
+        # append file lines to hidden day partition files
+        frame = frame.assign(file_id=file_id)
+        for name, column in frame.items():
+            if column.dtype == object and isinstance(column.iloc[0], tuple):
+                frame[name] = column.map(record_text)
+        if self._schema is None:
+            stamps = [name for name, column in frame.items() if column.dtype.kind == 'M']
+            self._stamp = stamps[0] if stamps else None
+        days = (
+            pd.to_datetime(frame[self._stamp]).dt.strftime('%Y-%m-%d').fillna('none') if self._stamp
+            else pd.Series('none', frame.index)
+        )
+        table = self._table(frame)
+        for day, rows in pd.Series(range(len(frame)), frame.index).groupby(days, sort=True):
+            if day not in self._writers:
+                directory = self._partition(self._id_to_badge(file_id).data_type, day)
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f'.{file_id}.parquet')
+                self._writers[day] = pq.ParquetWriter(path, self._schema, compression=self.COMPRESSION), path
+            self._writers[day][0].write_table(table.take(pa.array(rows.to_numpy())))
+        self._lines_count += len(frame)
+
+    def _commit_parts(self, file_id: int) -> list:
+        # finalize part files, return dataset relative paths
+        parts = []
+        for day in sorted(self._writers):
+            writer, hidden_path = self._writers.pop(day)
+            writer.close()
+            path = os.path.join(os.path.dirname(hidden_path), f'{file_id}.parquet')
+            os.replace(hidden_path, path)
+            parts.append(os.path.relpath(path, self._root))
+        return parts
+
+    def _id_to_badge(self, file_id):
+        return self._badges[file_id]
+
+    def drop_file(self, file_id: int):
+        self._reset_file()
+
+    def update_file_status(self, file_id: int, is_ok: bool, fail_reason: str = None):
+        parts, lines_count = [], 0
+        if is_ok:
+            self._collect_lines()
+            self._flush_frames(file_id)
+            parts, lines_count = self._commit_parts(file_id), self._lines_count
+        self._reset_file()
+
+        with _Manifest(self._root) as manifest:
+            entry = manifest.files[file_id]
+            entry.update(
+                status='done' if is_ok else 'fail',
+                fail_descr=fail_reason,
+                lines_count=lines_count,
+                content_hash=self._id_to_badge(file_id).fingerprint,
+                parts=parts,
+                last_update=datetime.now(),
+            )
+
+    def is_duplicate(self, badge: FileBadge) -> bool:
+        with _Manifest(self._root) as manifest:
+            return any(
+                entry['status'] == 'done' and entry['content_hash'] == badge.fingerprint and self._match(entry, badge)
+                for entry in manifest.files.values()
+            )
+
+    def scan(self, data_type: str, columns: list = None, since: date = None, till: date = None) -> pd.DataFrame:
+        """ Read stored lines of type for the session filter, only requested columns and day partitions are read """
+        directory = os.path.dirname(self._partition(data_type, ''))
+        if not os.path.exists(directory):
+            return pd.DataFrame(columns=columns)
+        dataset = ds.dataset(
+            directory, format='parquet',
+            partitioning=ds.partitioning(pa.schema([('day', pa.string())]), flavor='hive'),
+        )
+        condition = ds.scalar(True)
+        if since:
+            condition &= ds.field('day') >= since.isoformat()
+        if till:
+            condition &= ds.field('day') <= till.isoformat()
+        return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+import shutil
+import tempfile
+from unittest import TestCase
+
+
+class _ParquetSessionTest(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.session = ParquetSession(self.root, DataFilter().add('base1s', 'test_filter'))
+        self.session.add_store_rule('apdx', 'ApdexLines')
+        self.badge = FileBadge('some_data_file.xml', 'apdx', 'hash')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def _load(self, lines_count: int) -> int:
+        _id = self.session.attach_file(self.badge)
+        for i in range(lines_count):
+            self.session.submit_line(_id, {
+                'ops_uid': '100', 'user': 'Donald', 'descr': None,
+                'start': datetime(2020, 9, 23, 22) + pd.Timedelta(hours=i), 'duration': i
+            })
+        self.session.update_file_status(_id, True)
+        return _id
+
+    def test_main_usage(self):
+        _id = self._load(4)
+        self.assertEqual(self._load(5), _id)  # reload replaces file data
+        frame = self.session.scan('apdx', ['duration', 'descr'], since=date(2020, 9, 24), till=date(2020, 9, 24))
+        self.assertEqual(sorted(frame['duration']), [2, 3, 4])
+        self.assertEqual(list(frame.columns), ['duration', 'descr'])
+        self.assertTrue(self.session.is_duplicate(FileBadge('renamed.xml', 'apdx', 'hash')))
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.root, 'base1s=test_filter', 'data_type=apdx'))),
+            ['day=2020-09-23', 'day=2020-09-24']
+        )
+
+    def test_chunks(self):
+        self.session.CHUNK_LINES = 2
+        _id = self.session.attach_file(self.badge)
+        for i in range(5):
+            self.session.submit_line(_id, {
+                'ops_uid': '100', 'descr': None if i < 2 else f'd{i}',
+                'start': datetime(2020, 9, 23, 22) + pd.Timedelta(hours=i), 'duration': i
+            })
+        day = os.path.join(self.root, 'base1s=test_filter', 'data_type=apdx', 'day=2020-09-24')
+        self.assertEqual(os.listdir(day), [f'.{_id}.parquet'])  # written while parsing, hidden until commit
+        self.assertTrue(self.session.scan('apdx').empty)
+        self.session.update_file_status(_id, True)
+
+        self.assertEqual(pq.ParquetFile(os.path.join(day, f'{_id}.parquet')).num_row_groups, 2)  # by chunks
+        frame = self.session.scan('apdx', ['duration', 'descr']).sort_values('duration')
+        self.assertEqual(list(frame['descr'].fillna('')), ['', '', 'd2', 'd3', 'd4'])  # null chunk column is string
+
+        _id = self.session.attach_file(FileBadge('failed.xml', 'apdx'))
+        for i in range(3):
+            self.session.submit_line(_id, {'start': datetime(2020, 9, 25), 'duration': i})
+        self.session.update_file_status(_id, False)
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(day), 'day=2020-09-25', f'.{_id}.parquet')))
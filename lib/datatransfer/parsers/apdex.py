@@ -4,29 +4,126 @@
 """
 
 from datetime import datetime, timedelta
+from functools import lru_cache, partial
+from typing import NamedTuple
 from xml.etree import ElementTree
 
+from ..compression import open_text
+
+
+class ApdexLine(NamedTuple):
+    ops_uid: str
+    ops_name: str
+    duration: float
+    user: str
+    start: datetime
+    session: int
+    fail: bool
+    target: float
+    priority: str
+    status: str
+
+
+# positional record constructor without NamedTuple.__new__ call overhead
+_apdex_line = partial(tuple.__new__, ApdexLine)
+
+
+@lru_cache(maxsize=256)
+def decode_stamp(t_save_utc: str, time_zone_adjust: int) -> datetime:
+    """ tSaveUTC value to datetime, measures of the same second are frequent.
+        Cache is small: recent seconds only, memory doesn't depend on file period
+    """
+    return datetime.strptime(t_save_utc, '%Y-%m-%dT%H:%M:%S') + timedelta(hours=time_zone_adjust)
+
+
+def iter_measures(apdex_file):
+    """ Incremental (ops attributes, measure attributes) reader, elements are dropped just after read,
+        so memory usage doesn't depend on document size
+    """
+    path = []  # elements from root to the current one
+    for event, element in ElementTree.iterparse(apdex_file, events=('start', 'end')):
+        if event == 'start':
+            path.append(element)
+            continue
+        path.pop()
+        if len(path) == 2:  # measure is finished
+            yield path[1].attrib, element.attrib
+            del path[1][-1]
+        elif len(path) == 1:  # ops is finished
+            del path[0][-1]
+
 
 def parse(local_path: str, origin_file_name: str, time_zone_adjust: int):
-    apdex_file = open(local_path)
+    apdex_file = open_text(local_path)
     with apdex_file:
-        root = ElementTree.parse(apdex_file).getroot()
-        for ops in root:
-            for measure in ops:
-                ops_attribute = ops.attrib
-                measure_attribute = measure.attrib
-                line = {
-                    'ops_uid': ops_attribute['uid'],
-                    'ops_name': ops_attribute['name'],
-                    'duration': float(measure_attribute['value']),
-                    'user': measure_attribute['userName'],
-                    'start':
-                        datetime.strptime(measure_attribute['tSaveUTC'], '%Y-%m-%dT%H:%M:%S') +
-                        timedelta(hours=time_zone_adjust),
-                    'session': int(measure_attribute['sessionNumber']),
-                    'fail': not bool(measure_attribute['runningError']),
-                    'target': float(ops_attribute['targetValue']),
-                    'priority': ops_attribute['priority'],
-                }
-                line['status'] = 'NS' if line['target'] >= line['duration'] else 'NT'
-                yield line
+        for ops_attribute, measure_attribute in iter_measures(apdex_file):
+            duration = float(measure_attribute['value'])
+            target = float(ops_attribute['targetValue'])
+            yield _apdex_line((
+                ops_attribute['uid'],
+                ops_attribute['name'],
+                duration,
+                measure_attribute['userName'],
+                decode_stamp(measure_attribute['tSaveUTC'], time_zone_adjust),
+                int(measure_attribute['sessionNumber']),
+                not bool(measure_attribute['runningError']),
+                target,
+                ops_attribute['priority'],
+                'NS' if target >= duration else 'NT',
+            ))
+
+
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+
+def _write_synthetic_apdex(path: str, ops_count: int, measures_count: int):
+    with open(path, 'w') as apdex_file:
+        apdex_file.write('<?xml version="1.0" encoding="UTF-8"?>\n<Performance version="1.0.0.4">\n')
+        for ops in range(ops_count):
+            apdex_file.write(
+                f'<KeyOperation uid="uid-{ops}" name="Операция {ops}" targetValue="{ops % 5 + 0.5}" '
+                f'priority="Normal">\n'
+            )
+            for measure in range(measures_count):
+                apdex_file.write(
+                    f'<measurement value="{measure % 7 * 0.37:.3f}" userName="User{measure % 11}" '
+                    f'tSaveUTC="2020-09-23T10:{measure // 60 % 60:02}:{measure % 60:02}" '
+                    f'sessionNumber="{measure}" runningError="false"/>\n'
+                )
+            apdex_file.write('</KeyOperation>\n')
+        apdex_file.write('</Performance>\n')
+
+
+class _ApdexParserTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._path = os.path.join(tempfile.gettempdir(), 'apdex_test.xml')
+
+    def tearDown(self) -> None:
+        os.remove(self._path)
+
+    def test_parse(self):
+        _write_synthetic_apdex(self._path, 3, 100)
+        with open(self._path) as apdex_file:
+            root = ElementTree.parse(apdex_file).getroot()
+            reference = [(ops.attrib, measure.attrib) for ops in root for measure in ops]
+        with open(self._path) as apdex_file:
+            self.assertEqual(reference, list(iter_measures(apdex_file)))
+        lines = list(parse(self._path, 'apdex_test.xml', +3))
+        self.assertEqual(len(lines), 300)
+        self.assertEqual(lines[-1].start, datetime(2020, 9, 23, 13, 1, 39))
+
+    def test_flat_memory(self):
+        peaks = []
+        for measures_count in (1000, 10000):
+            _write_synthetic_apdex(self._path, 10, measures_count)
+            decode_stamp.cache_clear()
+            tracemalloc.start()
+            for _ in parse(self._path, 'apdex_test.xml', +3):
+                pass
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        print(peaks)
+        self.assertLess(peaks[1], peaks[0] * 2)
@@ -4,6 +4,31 @@
 import re
 import csv
 from datetime import datetime, timedelta
+from functools import partial
+from itertools import chain, islice
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..compression import open_text
+from .textreader import TextReader
+
+CHUNK_ROWS = 256  # csv rows for one parse_columnar batch
+
+
+class CounterLine(NamedTuple):
+    stamp: datetime
+    counter: Tuple[str, str, str]
+    host: str
+    context: str
+    type: str
+    flt_value: Optional[float]
+    str_value: str
+
+
+# positional record constructor without NamedTuple.__new__ call overhead
+_counter_line = partial(tuple.__new__, CounterLine)
 
 
 def _get_hdr_params(header_line):
@@ -23,7 +48,7 @@ def _get_hdr_params(header_line):
 
 
 def parse(local_path: str, origin_file_name: str, gmt_time_adjust: int):
-    counter_file = open(local_path, encoding="utf-16")
+    counter_file = open_text(local_path, encoding="utf-16")
     with counter_file:
 
         counter_data = iter(csv.reader(counter_file))
@@ -37,13 +62,109 @@ def parse(local_path: str, origin_file_name: str, gmt_time_adjust: int):
             for i in range(len(counter_values)):
                 str_value = counter_values[i].replace(' ', '')
 
-                line = {
-                    'stamp': stamp,
-                    'counter': params[i]['id'],
-                    'host': params[i]['host'],
-                    'context': params[i]['context'],
-                    'type': params[i]['type'],
-                    'flt_value': float(str_value) if str_value else None,
-                    'str_value': str_value,
-                }
-                yield line
+                yield _counter_line((
+                    stamp,
+                    params[i]['id'],
+                    params[i]['host'],
+                    params[i]['context'],
+                    params[i]['type'],
+                    float(str_value) if str_value else None,
+                    str_value,
+                ))
+
+
+def _param_column(params: dict, key: str) -> np.ndarray:
+    column = np.empty(len(params), dtype=object)
+    for i in range(len(params)):
+        column[i] = params[i][key]
+    return column
+
+
+def parse_columnar(local_path: str, origin_file_name: str, gmt_time_adjust: int, chunk_rows: int = CHUNK_ROWS):
+    """ Columnar parse mode: yield pandas.DataFrame batches of the same lines as parse(),
+        missing flt_value is NaN. Use it with ParserJob(batches=True)
+    """
+    counter_file = TextReader(local_path, "utf-16")
+    with counter_file:
+        params = _get_hdr_params(next(csv.reader(counter_file)))
+        columns = {key: _param_column(params, key) for key in ('id', 'host', 'context', 'type')}
+        width = len(params)
+        lines = counter_file.lines()
+
+        while True:
+            # spaces of values (and the one of stamp) are removed by one replace of the chunk text
+            rows = list(csv.reader(''.join(islice(lines, chunk_rows)).replace(' ', '').splitlines()))
+            if not rows:
+                break
+            stamps = pd.to_datetime([row.pop(0) for row in rows], format='%m/%d/%Y%H:%M:%S.%f')
+            counts = np.fromiter(map(len, rows), np.int64, len(rows))
+            if (counts == width).all():
+                counters = np.tile(np.arange(width), len(rows))
+            else:  # short lines
+                counters = np.concatenate([np.arange(count) for count in counts])
+
+            str_values = np.array(list(chain.from_iterable(rows)), dtype=object)
+            filled = str_values != ''
+            flt_values = np.full(len(str_values), np.nan)
+            flt_values[filled] = str_values[filled].astype(np.float64)
+
+            yield pd.DataFrame({
+                'stamp': np.repeat((stamps + pd.Timedelta(hours=gmt_time_adjust)).to_numpy(), counts),
+                'counter': pd.Series(columns['id'][counters], dtype=object),
+                'host': pd.Series(columns['host'][counters], dtype=object),
+                'context': pd.Series(columns['context'][counters], dtype=object),
+                'type': pd.Series(columns['type'][counters], dtype=object),
+                'flt_value': flt_values,
+                'str_value': pd.Series(str_values, dtype=object),
+            })
+
+
+import os
+import tempfile
+import unittest
+
+
+def _write_synthetic_counters(path: str, counters_count: int, samples_count: int):
+    """ Synthetic perfmon UTF-16 csv """
+    begin = datetime(2020, 9, 23, 16)
+    with open(path, 'w', encoding='utf-16', newline='') as counter_file:
+        writer = csv.writer(counter_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(
+            ['(PDH-CSV 4.0) (RTZ 2 (Standard Time)(-180)'] +
+            [f'\\\\SRV-1C\\Process(rphost#{i})\\% Processor Time' for i in range(counters_count)]
+        )
+        for sample in range(samples_count):
+            stamp = begin + timedelta(seconds=sample, milliseconds=sample % 1000)
+            writer.writerow(
+                [stamp.strftime('%m/%d/%Y %H:%M:%S.%f')[:-3]] +
+                [' ' if (sample + i) % 13 == 0 else f'{(sample * i) % 1000 / 7:.6f}' for i in range(counters_count)]
+            )
+
+
+class _SysCountersParserTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._path = os.path.join(tempfile.gettempdir(), 'counters_test.csv')
+
+    def tearDown(self) -> None:
+        os.remove(self._path)
+
+    def test_parse_columnar(self):
+        from .._session import batch_lines
+        _write_synthetic_counters(self._path, 20, 600)
+        with open(self._path, 'a', encoding='utf-16', newline='') as counter_file:  # short line
+            csv.writer(counter_file, quoting=csv.QUOTE_ALL).writerow(['09/23/2020 17:00:00.000', '1.5', ' ', '7'])
+        reference = list(parse(self._path, 'counters_test.csv', +3))
+        result = [
+            line for batch in parse_columnar(self._path, 'counters_test.csv', +3, chunk_rows=70)
+            for line in batch_lines(batch)
+        ]
+        self.assertEqual(reference, result)
+
+    def test_chunk_rows(self):
+        # batches don't depend on chunk bounds: the same lines for chunks of one row, a few rows and the whole file
+        _write_synthetic_counters(self._path, 50, 300)
+        reference = pd.concat(parse_columnar(self._path, 'counters_test.csv', +3, chunk_rows=1000), ignore_index=True)
+        self.assertEqual(len(reference), 50 * 300)
+        for chunk_rows in (1, 7, CHUNK_ROWS):
+            result = pd.concat(parse_columnar(self._path, 'counters_test.csv', +3, chunk_rows), ignore_index=True)
+            pd.testing.assert_frame_equal(reference, result)
@@ -2,8 +2,58 @@
     1S: Enterprise Technical Journal Parser
 """
 
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from functools import partial
+from typing import NamedTuple, Optional
+import codecs
+import io
+import json
+import mmap
+import os
 import re
+import sys
+
+from ..compression import SUFFIXES
+from .textreader import TextReader, iter_events
+
+BLOCK_SIZE = 1 << 20  # decoded chars read at once
+SPLIT_BYTES = 64 << 20  # parse_split byte range of worker task
+
+_RE_EVENT = re.compile(r'^\d\d:\d\d\.\d+-', re.MULTILINE)
+_RE_HEADER = re.compile(r'(\d\d):(\d\d)\.(\d+)-(\d+),(\w+),(\d+),')
+_RE_PARAMS = re.compile(r'([\w:]+)=([^,\r]+)')
+# event property: ,key=value, value is 'quoted' or "quoted" with doubled quotes inside, or plain
+_RE_PROP = re.compile(r''',([\w:]+)=('(?:[^']|'')*'|"(?:[^"]|"")*"|[^,\r\n]*)''')
+
+# properties for parse(props=...), stored as TJLines.props jsonb, see sql/tjlines_props.sql
+PROPS = (
+    'Usr', 'SessionID', 't:clientID', 't:applicationName', 'p:processName', 'Context', 'Sql', 'Rows',
+    'RowsAffected', 'Regions', 'Locks', 'WaitConnections', 'Memory', 'MemoryPeak', 'InBytes', 'OutBytes',
+    'CpuTime', 'Interface', 'Method', 'Func', 'Module',
+)
+
+
+class TJLine(NamedTuple):
+    rphost: int
+    dur: str
+    event: str
+    lvl: str
+    osthread: Optional[str]
+    exception: Optional[str]
+    descr: Optional[str]
+    stamp: datetime
+    source: str
+
+
+# positional record constructor without NamedTuple.__new__ call overhead
+_tj_line = partial(tuple.__new__, TJLine)
+
+# TJLine with props: json object of extracted event properties
+TJPropsLine = namedtuple('TJPropsLine', TJLine._fields + ('props',))
+_tj_props_line = partial(tuple.__new__, TJPropsLine)
+_props_json = json.JSONEncoder(ensure_ascii=False).encode
 
 
 def _get_meta(file_name: str):
@@ -18,70 +68,308 @@ def _get_meta(file_name: str):
     }
 
 
-def _parse_line(line: str, name_meta: dict, time_zone_adjust: int):
-    re_header = r'^(\d\d):(\d\d)\.(\d+)-(\d+),(\w+),(\d+),'
-    header = re.findall(re_header, line)
-    re_params = r'([\w:]+)=([^,\r]+)'
-    params = {g[0]: g[1] for g in re.findall(re_params, line)}
-
-    stamp = datetime(
-        2000 + int(name_meta['yy']),
-        int(name_meta['mm']),
-        int(name_meta['dd']),
-        int(name_meta['hh']),
-        int(header[0][0]),  # minutes
-        int(header[0][1]),  # seconds
-        int(header[0][2])  # milliseconds
-    ) + timedelta(hours=time_zone_adjust)
-
-    record = {
-        'rphost': name_meta['rphost'],
-        'dur': header[0][3],
-        'event': header[0][4], 'lvl': header[0][5],
-        'osthread': params.get('OSThread'),
-        'exception': params.get('Exception'),
-        'descr': params.get('Descr'),
-        'stamp': stamp,
-        'source': line
-    }
-    return record
+def _param(line: str, key: str):
+    """ Value of the last key=value pair, the same as dict(_RE_PARAMS.findall(line)).get(key),
+        but without scanning of whole event text
+    """
+    pattern = key + '='
+    end = len(line)
+    while True:
+        pos = line.rfind(pattern, 0, end)
+        if pos < 0:
+            return None
+        # pairs never cross separators, so the first pair of the separated part is checked only
+        part = max(line.rfind(',', 0, pos), line.rfind('\r', 0, pos)) + 1
+        match = _RE_PARAMS.search(line, part)
+        if match and match.start() == pos and match.end(1) == pos + len(key):
+            return match.group(2)
+        end = pos + len(pattern) - 1
 
 
-def parse(local_path: str, origin_file_name: str, gmt_time_zone: int):
-    re_hdr = r'^\d\d:\d\d\.\d+-'
-    accumulate_line = ''
+def _props(line: str, keys: frozenset) -> dict:
+    """ Event properties of keys, quoted values are unquoted. Property names inside
+        quoted values (e.g. Sql text) are not taken, last value of repeated property is kept
+    """
+    result = {}
+    for key, value in _RE_PROP.findall(line, _RE_HEADER.match(line).end() - 1):
+        if key in keys:
+            if value[:1] in ('"', "'"):
+                value = value[1:-1].replace(value[0] * 2, value[0])
+            result[key] = value
+    return result
+
+
+class _Stamps:
+    """ Event stamps for journal hour, datetime is built once for each event second """
+    def __init__(self, name_meta: dict, time_zone_adjust: int):
+        self._hour = datetime(
+            2000 + int(name_meta['yy']),
+            int(name_meta['mm']),
+            int(name_meta['dd']),
+            int(name_meta['hh']),
+        )
+        self._adjust = timedelta(hours=time_zone_adjust)
+        self._seconds = {}
+
+    def get(self, minutes: str, seconds: str, fraction: str) -> datetime:
+        second = self._seconds.get((minutes, seconds))
+        if second is None:
+            second = self._seconds[(minutes, seconds)] = \
+                self._hour.replace(minute=int(minutes), second=int(seconds)) + self._adjust
+        return second.replace(microsecond=int(fraction))
+
+
+def _parse_line(line: str, name_meta: dict, stamps: _Stamps) -> TJLine:
+    header = _RE_HEADER.match(line).groups()
+
+    return _tj_line((
+        name_meta['rphost'],
+        header[3],
+        header[4], header[5],
+        _param(line, 'OSThread'),
+        _param(line, 'Exception'),
+        _param(line, 'Descr'),
+        stamps.get(header[0], header[1], header[2]),
+        line
+    ))
+
+
+def _iter_events(log_file, block_size: int = BLOCK_SIZE):
+    """ Split journal text into events: event begins at the line with event header """
+    return iter_events(log_file, _RE_EVENT, block_size)
+
+
+def _parse_events(events, origin_file_name: str, gmt_time_zone: int, props: tuple = None):
     name_meta = _get_meta(origin_file_name)
+    stamps = _Stamps(name_meta, gmt_time_zone)
+    keys = frozenset(props or ())
 
-    with open(local_path, encoding='utf-16') as log_file:
-        while True:
-            log_line = log_file.readline()
-
-            if not log_line:
-                if len(accumulate_line):
-                    yield _parse_line(accumulate_line, name_meta, gmt_time_zone)
-                break
-            elif re.match(re_hdr, log_line):  # new line tag found
-                if len(accumulate_line) == 0:  # no line accumulated
-                    accumulate_line += log_line
-                else:
-                    yield _parse_line(accumulate_line, name_meta, gmt_time_zone)
-                    accumulate_line = log_line
-                    continue
-            else:
-                accumulate_line += log_line
+    for event in events:
+        line = _parse_line(event, name_meta, stamps)
+        if keys:
+            line = _tj_props_line(line + (_props_json(_props(event, keys)),))
+        yield line
+
+
+def parse(local_path: str, origin_file_name: str, gmt_time_zone: int, props: tuple = None):
+    """ Yield TJLine records, with props (property names, e.g. PROPS) yield TJPropsLine records.
+        Use functools.partial(parse, props=PROPS) as ParserJob parser
+    """
+    with TextReader(local_path, 'utf-16') as log_file:
+        yield from _parse_events(_iter_events(log_file), origin_file_name, gmt_time_zone, props)
+
+
+def _journal_encoding(local_path: str) -> tuple:
+    # (fixed byte order codec, text offset) by BOM, as 'utf-16' codec decodes
+    with open(local_path, 'rb') as journal:
+        bom = journal.read(2)
+    if bom == codecs.BOM_UTF16_LE:
+        return 'utf-16-le', 2
+    if bom == codecs.BOM_UTF16_BE:
+        return 'utf-16-be', 2
+    return f'utf-16-{sys.byteorder[0]}e', 0
 
 
+def _header_bytes(encoding: str):
+    """ Encoded event header with the previous line break, ASCII digits only:
+        every match is an event start of _RE_EVENT, some _RE_EVENT starts may be not matched
+    """
+    def char(c: str) -> bytes:
+        return re.escape(c.encode(encoding))
+    digit = b'[\\x30-\\x39]\\x00' if encoding == 'utf-16-le' else b'\\x00[\\x30-\\x39]'
+    return re.compile(
+        b'(?:' + char('\n') + b'|' + char('\r') + b')' + digit * 2 + char(':') + digit * 2 + char('.') +
+        b'(?:' + digit + b')+' + char('-')
+    )
+
+
+def _sync(data, offset: int, text_offset: int, header) -> int:
+    # byte offset of the first event header at or after offset, data end if there is none
+    pos = max(offset - 2, text_offset)
+    while True:
+        match = header.search(data, pos)
+        if match is None:
+            return len(data)
+        if (match.start() - text_offset) % 2 == 0:  # not a match across code units
+            return match.start() + 2
+        pos = match.start() + 1
+
+
+def _parse_range(local_path: str, origin_file_name: str, gmt_time_zone: int, props: tuple, begin: int, end: int):
+    """ parse_split worker task: lines of events which headers are in [begin, end) byte range,
+        range borders are moved to event headers, so ranges of all tasks cover the journal events once
+    """
+    encoding, text_offset = _journal_encoding(local_path)
+    header = _header_bytes(encoding)
+    with open(local_path, 'rb') as journal, mmap.mmap(journal.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = text_offset if begin <= text_offset else _sync(data, begin, text_offset, header)
+        stop = _sync(data, end, text_offset, header) if end < len(data) else len(data)
+        if start >= stop:
+            return []  # event is longer than range
+        text = data[start:stop].decode(encoding)
+    text = text.replace('\r\n', '\n').replace('\r', '\n')  # universal newlines, as parse() text is
+    return list(_parse_events(iter_events(io.StringIO(text), _RE_EVENT), origin_file_name, gmt_time_zone, props))
+
+
+def parse_split(
+        local_path: str, origin_file_name: str, gmt_time_zone: int, props: tuple = None,
+        workers: int = None, split_bytes: int = SPLIT_BYTES
+):
+    """ parse() of large journal by byte ranges in worker processes: yield the same records in the same order.
+        Pipe (stream mode), compressed or small (less than two ranges) journal is parsed by parse().
+        Experimental: the speedup is not measured on multi-core hosts yet
+    """
+    if local_path.endswith(SUFFIXES) or not os.path.isfile(local_path) \
+            or os.path.getsize(local_path) < 2 * split_bytes:
+        yield from parse(local_path, origin_file_name, gmt_time_zone, props)
+        return
+
+    workers = workers or os.cpu_count()
+    split_bytes += split_bytes % 2  # ranges begin at code unit
+    size = os.path.getsize(local_path)
+    text_offset = _journal_encoding(local_path)[1]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tasks = deque()
+        for begin in range(text_offset, size, split_bytes):
+            tasks.append(pool.submit(
+                _parse_range, local_path, origin_file_name, gmt_time_zone, props, begin, begin + split_bytes
+            ))
+            if len(tasks) > workers:  # results are kept for the next tasks only
+                yield from tasks.popleft().result()
+        while tasks:
+            yield from tasks.popleft().result()
+
+
+import tempfile
+import time
 import unittest
 
 
+def _parse_by_lines(local_path: str, origin_file_name: str, gmt_time_zone: int):
+    """ Line by line parser, reference for compatibility checks """
+    def parse_line(line):
+        header = re.findall(r'^(\d\d):(\d\d)\.(\d+)-(\d+),(\w+),(\d+),', line)
+        params = {g[0]: g[1] for g in re.findall(r'([\w:]+)=([^,\r]+)', line)}
+        stamp = datetime(
+            2000 + name_meta['yy'], name_meta['mm'], name_meta['dd'], name_meta['hh'],
+            int(header[0][0]), int(header[0][1]), int(header[0][2])
+        ) + timedelta(hours=gmt_time_zone)
+        return {
+            'rphost': name_meta['rphost'],
+            'dur': header[0][3],
+            'event': header[0][4], 'lvl': header[0][5],
+            'osthread': params.get('OSThread'),
+            'exception': params.get('Exception'),
+            'descr': params.get('Descr'),
+            'stamp': stamp,
+            'source': line
+        }
+
+    name_meta = _get_meta(origin_file_name)
+    accumulate_line = ''
+    with open(local_path, encoding='utf-16') as log_file:
+        for log_line in log_file:
+            if re.match(r'^\d\d:\d\d\.\d+-', log_line) and accumulate_line:
+                yield parse_line(accumulate_line)
+                accumulate_line = ''
+            accumulate_line += log_line
+    if accumulate_line:
+        yield parse_line(accumulate_line)
+
+
+def _write_synthetic_journal(path: str, size_kb: int):
+    """ Synthetic UTF-16 journal: single and multi-line events """
+    events = [
+        "{:02}:{:02}.{:06}-{},CALL,0,process=rphost,OSThread={},ClientID=2,Usr=User,Memory=1024,CpuTime=15\r\n",
+        "{:02}:{:02}.{:06}-{},DBMSSQL,4,process=rphost,OSThread={},Usr=User,Sql='SELECT T1._IDRRef\r\n"
+        "FROM dbo._Reference12 T1\r\nWHERE T1._Fld13 = @P1',Rows=1,Context='Форма.Вызов : Модуль\r\n"
+        "\tОбщийМодуль.Вызов : 12 : Выполнить();'\r\n",
+        "{:02}:{:02}.{:06}-{},EXCP,1,process=rphost,OSThread={},Exception=a1b2,Descr='Ошибка\r\nстрока'\r\n",
+    ]
+    with open(path, 'w', encoding='utf-16', newline='') as journal:
+        size, i = 0, 0
+        while size < size_kb << 10:
+            second = i % 3600
+            text = events[i % len(events)].format(second // 60, second % 60, i % 1000000, i % 9999, i % 97)
+            journal.write(text)
+            size += len(text) * 2
+            i += 1
+
+
 class _TJParserTest(unittest.TestCase):
+    SYNTHETIC_KB = 8 << 10
+
     def setUp(self) -> None:
-        self._path = '/var/folders/_h/try61xjj22b6hxn72f84f9s00000gn/T/rphost_10368_20092116.log'
         self._origin = 'rphost_1020_20092316.log'
+        self._path = os.path.join(tempfile.gettempdir(), self._origin)
+        _write_synthetic_journal(self._path, self.SYNTHETIC_KB)
+
+    def tearDown(self) -> None:
+        os.remove(self._path)
 
     def test_parse(self):
         for line in parse(self._path, self._origin, +3):
             print(line)
+            break
+
+    def test_compatibility(self):
+        self.assertEqual(
+            list(_parse_by_lines(self._path, self._origin, +3)),
+            [line._asdict() for line in parse(self._path, self._origin, +3)]
+        )
+
+    def test_split(self):
+        path = os.path.join(tempfile.gettempdir(), 'split_' + self._origin)
+        _write_synthetic_journal(path, 64)
+        with open(path, 'a', encoding='utf-16-le', newline='') as journal:  # lone CR breaks, surrogates, long event
+            journal.write('59:58.000001-1,EXCP,1,Descr=\'😀\'\r59:58.000002-2,EXCP,1,Descr=x\r\n')
+            journal.write('59:59.000003-3,EXCP,1,Descr=\'' + 'long\r\n' * 5000 + '\'\r\n')
+        reference = list(parse(path, self._origin, +3, PROPS))
+        for split_bytes in (4095, 6000, 1 << 15):
+            self.assertEqual(list(parse_split(path, self._origin, +3, PROPS, 2, split_bytes)), reference, split_bytes)
+        os.remove(path)
+
+    def test_block_boundaries(self):
+        path = os.path.join(tempfile.gettempdir(), 'small_' + self._origin)
+        _write_synthetic_journal(path, 64)
+        with open(path, encoding='utf-16') as log_file:
+            reference = list(_iter_events(log_file))
+        for block_size in (1, 7, 4096):
+            with open(path, encoding='utf-16') as log_file:
+                self.assertEqual(reference, list(_iter_events(log_file, block_size)), block_size)
+        os.remove(path)
+
+    def test_param(self):
+        for line in (
+                "00:01.0-1,EXCP,1,Descr=a,Descr=b\n",
+                "00:01.0-1,EXCP,1,xDescr=a,b Descr=c=d,Descr=\n",
+                "00:01.0-1,EXCP,1,Sql='Descr=1',Descr==,OSThread",
+        ):
+            params = dict(_RE_PARAMS.findall(line))
+            for key in ('OSThread', 'Exception', 'Descr'):
+                self.assertEqual(params.get(key), _param(line, key), line)
+
+    def test_props(self):
+        event = (
+            "00:01.000001-5,TLOCK,3,process=rphost,Usr=Иванов,Context='Док.Провести\r\n\tМодуль : 1',"
+            "Sql=\"SELECT 'a,Usr=fake', \"\"b\"\"\",WaitConnections=12,Usr=Петров,Empty=,Memory=1024\r\n"
+        )
+        self.assertEqual(
+            _props(event, frozenset(PROPS + ('Empty',))),
+            {
+                'Usr': 'Петров', 'Context': 'Док.Провести\r\n\tМодуль : 1',
+                'Sql': 'SELECT \'a,Usr=fake\', "b"', 'WaitConnections': '12', 'Empty': '', 'Memory': '1024'
+            }
+        )
+        lines = list(parse(self._path, self._origin, +3, props=PROPS))
+        self.assertEqual(lines[0][:-1], next(parse(self._path, self._origin, +3)))
+        self.assertEqual(json.loads(lines[0].props), {'Usr': 'User', 'Memory': '1024', 'CpuTime': '15'})
+        self.assertEqual(json.loads(lines[1].props)['Sql'], 'SELECT T1._IDRRef\nFROM dbo._Reference12 T1\nWHERE T1._Fld13 = @P1')
+
+    def test_throughput(self):
+        begin = time.perf_counter()
+        lines = sum(1 for _ in parse(self._path, self._origin, +3))
+        print(f'{lines / (time.perf_counter() - begin):.0f} lines/sec, {lines} lines, {self.SYNTHETIC_KB} KB')
 
 # if __name__ == '__main__':
-#     unittest.main()
\ No newline at end of file
+#     unittest.main()
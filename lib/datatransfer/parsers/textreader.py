@@ -0,0 +1,250 @@
+"""
+    Block decoding text reader for local journal files, shared by parsers
+
+    Local regular file is memory-mapped, named pipe (FtpSession stream mode) and compressed file are read
+    by binary blocks. Blocks are decoded at once, UTF-16 byte order is taken from BOM (fast path without
+    per block BOM checks). Text is the same as open(path, encoding=encoding) gives: universal newlines.
+"""
+
+import codecs
+import io
+import mmap
+import os
+import re
+
+from ..compression import SUFFIXES, open_binary
+
+BLOCK_SIZE = 1 << 21  # bytes decoded at once
+
+_BOMS = ((codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be'))
+
+
+class TextReader:
+    """ Read-only text file: read(size), lines() iterator (lines with '\\n', as file iteration gives),
+        use it as context manager
+    """
+
+    def __init__(self, path: str, encoding: str = None, block_size: int = BLOCK_SIZE):
+        self._encoding = encoding or 'utf-8'
+        self._block_size = block_size
+        self._file = None
+        self._map = None
+        self._offset = 0  # next mapped block offset
+        self._decoder = None  # made by the first block
+        self._buffer = ''  # decoded text
+        self._pos = 0  # buffer read position
+        self._lines = None  # lines() block iterator
+        self._eof = False
+
+        if path.endswith(SUFFIXES) or not os.path.isfile(path) or not os.path.getsize(path):
+            self._file = open_binary(path)
+        else:
+            self._file = open(path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _raw_block(self) -> bytes:
+        if self._map is None:
+            return self._file.read(self._block_size)
+        block = self._map[self._offset:self._offset + self._block_size]
+        self._offset += len(block)
+        return block
+
+    def _make_decoder(self, block: bytes) -> bytes:
+        # return block without BOM
+        encoding = codecs.lookup(self._encoding).name
+        if encoding == 'utf-16':
+            while len(block) < 2:  # BOM may be split by pipe reads
+                more = self._raw_block()
+                if not more:
+                    break
+                block += more
+            for bom, fixed in _BOMS:
+                if block.startswith(bom):
+                    encoding, block = fixed, block[len(bom):]
+                    break
+        self._decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+        return block
+
+    def _fill(self) -> bool:
+        # decode the next block into buffer, False at the end of file
+        if self._eof:
+            return False
+        block = self._raw_block()
+        self._eof = not block
+        if self._decoder is None:
+            block = self._make_decoder(block)  # BOM only block is not the end
+        text = self._decoder.decode(block, final=self._eof)
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return bool(text) or not self._eof
+
+    def _unread_lines(self):
+        # lines left by lines() iteration are returned into buffer
+        if self._lines is not None:
+            self._buffer = ''.join(self._lines) + self._buffer[self._pos:]
+            self._pos = 0
+            self._lines = None
+
+    def read(self, size: int = -1) -> str:
+        self._unread_lines()
+        while (size < 0 or len(self._buffer) - self._pos < size) and self._fill():
+            pass
+        end = len(self._buffer) if size < 0 else self._pos + size
+        result = self._buffer[self._pos:end]
+        self._pos += len(result)
+        return result
+
+    def lines(self):
+        self._unread_lines()
+        while True:
+            end = self._buffer.rfind('\n', self._pos) + 1
+            if not end:
+                if not self._fill():
+                    if self._pos < len(self._buffer):
+                        line = self._buffer[self._pos:]
+                        self._pos = len(self._buffer)
+                        yield line
+                    return
+                continue
+            text = self._buffer[self._pos:end]
+            self._pos = end
+            lines = text.splitlines(True)
+            if len(lines) != text.count('\n'):  # other line boundaries of splitlines(), text lines end by '\n' only
+                lines = [line + '\n' for line in text[:-1].split('\n')]
+            self._lines = iter(lines)
+            yield from self._lines
+            self._lines = None
+
+    def __iter__(self):
+        return self.lines()
+
+
+def iter_events(text_file, event_re: re.Pattern, block_size: int = 1 << 20):
+    """ Split text into events: event begins at the line matched by event_re (re.MULTILINE).
+        Text is read by blocks, events bodies are collected by parts and joined once.
+    """
+    parts = []  # current event parts
+    tail = []  # unfinished last line parts, header check is impossible for it yet
+
+    def scan(buffer: str, limit: int):
+        pos = 0
+        for match in event_re.finditer(buffer, 0, limit):
+            start = match.start()
+            if start > pos:
+                parts.append(buffer[pos:start])
+            if parts:
+                yield ''.join(parts)
+                parts.clear()
+            pos = start
+        if limit > pos:
+            parts.append(buffer[pos:limit])
+
+    while True:
+        block = text_file.read(block_size)
+        if not block:
+            break
+        tail.append(block)
+        last_line = block.rfind('\n') + 1
+        if not last_line:
+            continue
+        buffer = ''.join(tail)
+        limit = len(buffer) - len(block) + last_line
+        yield from scan(buffer, limit)
+        tail = [buffer[limit:]]
+
+    buffer = ''.join(tail)
+    yield from scan(buffer, len(buffer))
+    if parts:
+        yield ''.join(parts)
+
+
+import gzip
+import tempfile
+import threading
+import unittest
+
+
+class _TextReaderTest(unittest.TestCase):
+    TEXT = '\ufeffпервая строка\r\nвторая\rтретья\n \x0c\r\n' + '😀,x\r\n' * 5000 + 'last'
+
+    def setUp(self) -> None:
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        for name in os.listdir(self._dir):
+            os.remove(os.path.join(self._dir, name))
+        os.rmdir(self._dir)
+
+    def _write(self, name: str, encoding: str) -> str:
+        path = os.path.join(self._dir, name)
+        with open(path, 'w', encoding=encoding, newline='') as file:
+            file.write(self.TEXT)
+        return path
+
+    def _check(self, path: str, encoding: str):
+        with open(path, encoding=encoding) as file:
+            reference = file.read()
+        with open(path, encoding=encoding) as file:
+            reference_lines = list(file)
+        for block_size in (1, 3, 4096, BLOCK_SIZE):
+            with TextReader(path, encoding, block_size) as reader:
+                self.assertEqual(reader.read(), reference, block_size)
+            with TextReader(path, encoding, block_size) as reader:
+                self.assertEqual(list(reader.lines()), reference_lines, block_size)
+            with TextReader(path, encoding, block_size) as reader:
+                first = next(iter(reader))
+                self.assertEqual(first + reader.read(7) + reader.read(), reference, block_size)
+
+    def test_encodings(self):
+        for encoding in ('utf-16', 'utf-16-le', 'utf-16-be', 'utf-8'):
+            self._check(self._write(f'text_{encoding}.txt', encoding), encoding)
+
+    def test_empty(self):
+        path = os.path.join(self._dir, 'empty.txt')
+        open(path, 'wb').close()
+        with TextReader(path, 'utf-16') as reader:
+            self.assertEqual((reader.read(), list(reader.lines())), ('', []))
+
+    def test_gzip(self):
+        path = self._write('text.txt', 'utf-16')
+        with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+            target.write(source.read())
+        with TextReader(path + '.gz', 'utf-16', 4096) as reader, open(path, encoding='utf-16') as file:
+            self.assertEqual(reader.read(), file.read())
+
+    def test_pipe(self):
+        path = self._write('text.txt', 'utf-16')
+        pipe = os.path.join(self._dir, 'pipe.txt')
+        os.mkfifo(pipe)
+
+        def write():
+            with open(pipe, 'wb') as target, open(path, 'rb') as source:
+                for chunk in iter(lambda: source.read(1), b''):  # BOM is split
+                    target.write(chunk)
+        writer = threading.Thread(target=write)
+        writer.start()
+        with TextReader(pipe, 'utf-16') as reader, open(path, encoding='utf-16') as file:
+            self.assertEqual(reader.read(), file.read())
+        writer.join()
+
+    def test_events(self):
+        path = self._write('text.txt', 'utf-16')
+        event_re = re.compile(r'^😀', re.MULTILINE)
+        with open(path, encoding='utf-16') as file:
+            reference = list(iter_events(file, event_re))
+        self.assertEqual(len(reference), 5001)
+        for block_size in (1, 7, 4096):
+            with TextReader(path, 'utf-16', 16) as reader:
+                self.assertEqual(reference, list(iter_events(reader, event_re, block_size)), block_size)
@@ -1,8 +1,10 @@
+from dataclasses import asdict
 from datetime import datetime
+import io
 
-from lib.pg_utils import PGMix, sql
+from lib.pg_utils import PGMix, sql, copy_value, copy_text, copy_query, record_text
 
-from ._session import StorageSession, DataFilter, FileBadge
+from ._session import StorageSession, DataFilter, FileBadge, FileStages, line_fields, line_values
 
 
 # generate where filter subquery: and [field1 = value1] and [field2 = value2] ...
@@ -49,10 +51,12 @@ def _gen_values_for(_filter: DataFilter):
 
 class PGSession(StorageSession, PGMix):
     _file_table = 'TJFiles'
+    _stages_table = 'TJFileStages'  # see sql/tjfile_stages.sql
 
-    def __init__(self, key, _filter: DataFilter = None):
+    def __init__(self, key, _filter: DataFilter = None, dedup: bool = False):
         StorageSession.__init__(self, _filter)
         PGMix.__init__(self, key)
+        self._dedup = dedup  # content_hash is stored and duplicates are skipped, see sql/tjfiles_content_hash.sql
 
         # file badges local cash
         self._badges = {}
@@ -60,11 +64,15 @@ class PGSession(StorageSession, PGMix):
         # batch submit helpers
         self._batch_params = []
         self._batch_hdr = []
+        self._appended = set()  # side tables of the file with rows appended, see append_rows
 
         # Use for processing duration calculate:
         #   timestamp::<update file status> - timestamp::<attach file>
         self._attach_begin = None
 
+    def _spawn_args(self) -> tuple:
+        return self.PG_KEY, self._filter, self._dedup
+
     def _check_file_exist(self, badge: FileBadge):
         result = None  # in case file not exist
 
@@ -86,18 +94,37 @@ class PGSession(StorageSession, PGMix):
     def _id_to_badge(self, file_id):
         return self._badges[file_id]
 
-    def _clear_file_data(self, file_id):
-        delete_query = sql.SQL('DELETE FROM {} WHERE {}={}').format(
-            sql.Identifier(self._storage_rule[self._id_to_badge(file_id).data_type]),
-            sql.Identifier('file_id'), sql.Literal(file_id)
+    def is_duplicate(self, badge: FileBadge) -> bool:
+        if not self._dedup:
+            return False
+        check_query = sql.SQL('SELECT id FROM {} WHERE {}={} and {}={} and {}={} {} LIMIT 1').format(
+            sql.Identifier(self._file_table),
+            sql.Identifier('content_hash'), sql.Literal(badge.fingerprint),
+            sql.Identifier('type'), sql.Literal(badge.data_type),
+            sql.Identifier('status'), sql.Literal('done'),
+            _gen_where_for(self._filter)
         )
-        params = {
+        cursor = self.cursor()
+        cursor.execute(check_query)
+        return cursor.fetchone() is not None
+
+    def _update_params(self) -> dict:
+        # file fields reset for update
+        return {
             'lines_count': 0,
             'duration': 0,
             'status': 'update',
             'fail_descr': None,
-            'last_update': datetime.now()
+            'last_update': datetime.now(),
+            **({'content_hash': None} if self._dedup else {}),
         }
+
+    def _clear_file_data(self, file_id):
+        delete_query = sql.SQL('DELETE FROM {} WHERE {}={}').format(
+            sql.Identifier(self._storage_rule[self._id_to_badge(file_id).data_type]),
+            sql.Identifier('file_id'), sql.Literal(file_id)
+        )
+        params = self._update_params()
         update_query = sql.SQL('UPDATE {} SET ({}) = ({}) WHERE {}={}').format(
             sql.Identifier(self._file_table),
             sql.SQL(', ').join(sql.Identifier(key) for key in params.keys()),
@@ -150,9 +177,29 @@ class PGSession(StorageSession, PGMix):
         else:
             file_id = self._create_file(badge)
         self._batch_params.clear()
+        self._appended.clear()
 
         return file_id
 
+    def _set_file_status(self, file_id: int, lines_count: int, is_ok: bool, fail_reason: str = None):
+        params = {
+            'lines_count': lines_count,
+            'duration': (datetime.now() - self._attach_begin).seconds,
+            'status': 'done' if is_ok else 'fail',
+            'fail_descr': fail_reason,
+        }
+        if self._dedup:
+            params['content_hash'] = self._id_to_badge(file_id).fingerprint
+        update_query = sql.SQL('UPDATE {} SET ({})=({}) WHERE {}={}').format(
+            sql.Identifier(self._file_table),
+            sql.SQL(', ').join(sql.Identifier(key) for key in params.keys()),
+            sql.SQL(', ').join(sql.Literal(value) for value in params.values()),
+            sql.Identifier('id'), sql.Literal(file_id),
+        )
+
+        self.cursor().execute(update_query)
+        self.commit()
+
     def update_file_status(self, file_id: int, is_ok: bool, fail_reason: str = None):
         cursor = self.cursor(named=True)
         badge = self._id_to_badge(file_id)
@@ -171,12 +218,195 @@ class PGSession(StorageSession, PGMix):
 
         lines_count = len(self._batch_params)
         self._batch_params.clear()
+        self._set_file_status(file_id, lines_count, is_ok, fail_reason)
+
+    def drop_file(self, file_id: int):
+        # stored lines of the file are deleted with the file status commit
+        self._batch_params.clear()
+        self.cursor(named=False).execute(
+            sql.SQL('DELETE FROM {} WHERE {}={}').format(
+                sql.Identifier(self._storage_rule[self._id_to_badge(file_id).data_type]),
+                sql.Identifier('file_id'), sql.Literal(file_id)
+            )
+        )
+
+    def submit_rows(self, file_id: int, table: str, rows: list):
+        # committed with the file status
+        cursor = self.cursor(named=False)
+        cursor.execute(
+            sql.SQL('DELETE FROM {} WHERE {}={}').format(
+                sql.Identifier(table), sql.Identifier('file_id'), sql.Literal(file_id)
+            )
+        )
+        self._copy_rows(file_id, table, rows)
+
+    def append_rows(self, file_id: int, table: str, rows: list):
+        # committed with the next chunk of PGCheckpointSession or with the file status
+        if table not in self._appended:
+            self._appended.add(table)
+            self.submit_rows(file_id, table, rows)
+        else:
+            self._copy_rows(file_id, table, rows)
+
+    def _copy_rows(self, file_id: int, table: str, rows: list):
+        if not rows:
+            return
+        tail = '\t'.join(copy_value(value) for value in [file_id] + [item.value for item in self._filter])
+        self.cursor(named=False).copy_expert(
+            copy_query(table, list(line_fields(rows[0])) + ['file_id'] + [item.field for item in self._filter]),
+            io.StringIO(copy_text(list(map(line_values, rows)), tail))
+        )
+
+    def submit_dict(self, table: str, rows: list):
+        # committed with the next chunk of PGCheckpointSession or with the file status, rows are inserted in key order: concurrent workers
+        # adding the same keys wait for each other instead of deadlock
+        fields = line_fields(rows[0])
+        self._extras.execute_values(
+            self.cursor(named=False),
+            sql.SQL('INSERT INTO {} ({}) VALUES %s ON CONFLICT DO NOTHING').format(
+                sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, fields))
+            ),
+            sorted(map(line_values, rows), key=lambda values: values[0])
+        )
 
+    def submit_stages(self, file_id: int, stages: FileStages):
+        try:
+            self.submit_rows(file_id, self._stages_table, [asdict(stages)])
+            self.commit()
+        except Exception:
+            self._conn.rollback()  # the next file works in a new transaction
+            raise
+
+    def submit_line(self, file_id: int, line_data: tuple):
+        if not self._batch_params:
+            self._batch_hdr = list(line_fields(line_data))
+        self._batch_params.append(line_values(line_data))
+
+
+class PGCopySession(PGSession):
+    """ Streaming PGSession mode: lines are pushed to storage with COPY ... FROM STDIN
+        by chunks of chunk_size lines, so memory usage doesn't depend on file size.
+        All chunks of the file are committed together with file status, as PGSession does.
+    """
+    DEFAULT_CHUNK_SIZE = 10000
+
+    def __init__(self, key, _filter: DataFilter = None, chunk_size: int = DEFAULT_CHUNK_SIZE, dedup: bool = False):
+        PGSession.__init__(self, key, _filter, dedup)
+        self._chunk_size = chunk_size
+        self._chunk = []  # line values, encoded by columns at once, see pg_utils.copy_text
+        self._lines_count = 0
+        self._copy_query = None  # made by the first file line header
+        self._copy_tail = ''  # file_id and filter values, same for all file lines
+
+    def _spawn_args(self) -> tuple:
+        return self.PG_KEY, self._filter, self._chunk_size, self._dedup
+
+    def _reset_chunk(self):
+        self._chunk = []
+
+    def _chunk_stored(self, file_id: int):
+        """ Call after each chunk COPY """
+        pass
+
+    def _flush_chunk(self, file_id: int):
+        if not self._chunk:
+            return
+        self.cursor(named=False).copy_expert(self._copy_query, io.StringIO(copy_text(self._chunk, self._copy_tail)))
+        self._lines_count += len(self._chunk)
+        self._reset_chunk()
+        self._chunk_stored(file_id)
+
+    def _start_copy(self, file_id: int, lines_count: int = 0):
+        self._reset_chunk()
+        self._lines_count = lines_count
+        self._copy_query = None
+        self._copy_tail = '\t'.join(
+            copy_value(value) for value in [file_id] + [item.value for item in self._filter]
+        )
+
+    def attach_file(self, badge: FileBadge):
+        file_id = PGSession.attach_file(self, badge)
+        self._start_copy(file_id)
+        return file_id
+
+    def submit_line(self, file_id: int, line_data: tuple):
+        if self._copy_query is None:
+            self._copy_query = copy_query(
+                self._storage_rule[self._id_to_badge(file_id).data_type],
+                list(line_fields(line_data)) + ['file_id'] + [item.field for item in self._filter]
+            )
+        self._chunk.append(line_values(line_data))
+        if len(self._chunk) >= self._chunk_size:
+            self._flush_chunk(file_id)
+
+    def submit_batch(self, file_id: int, batch):
+        if not len(batch):
+            return
+        self._flush_chunk(file_id)  # lines order is kept
+
+        frame = batch.assign(file_id=file_id, **{item.field: item.value for item in self._filter})
+        for name, column in frame.items():
+            if column.dtype == object and isinstance(column.iat[0], tuple):
+                frame[name] = column.map({value: record_text(value) for value in set(column)})
+
+        data = io.StringIO()
+        frame.to_csv(data, header=False, index=False, na_rep='\\N')
+        data.seek(0)
+        self.cursor(named=False).copy_expert(
+            copy_query(self._storage_rule[self._id_to_badge(file_id).data_type], list(frame.columns), csv=True),
+            data
+        )
+        self._lines_count += len(batch)
+        self._chunk_stored(file_id)
+
+    def drop_file(self, file_id: int):
+        self._start_copy(file_id)
+        PGSession.drop_file(self, file_id)
+
+    def update_file_status(self, file_id: int, is_ok: bool, fail_reason: str = None):
+        self._flush_chunk(file_id)
+        self._set_file_status(file_id, self._lines_count, is_ok, fail_reason)
+
+
+class PGCheckpointSession(PGCopySession):
+    """ Resumable PGCopySession mode: each stored chunk is committed together with TJFiles.checkpoint,
+        the count of file lines in storage. Unfinished file (crashed run) is resumed from its checkpoint
+        on the next attach: no data delete, Processor skips already stored lines.
+        TJFiles.checkpoint column is required, see sql/tjfiles_checkpoint.sql
+    """
+    _unfinished = ('new', 'update')
+
+    def __init__(
+            self, key, _filter: DataFilter = None, chunk_size: int = PGCopySession.DEFAULT_CHUNK_SIZE,
+            dedup: bool = False
+    ):
+        PGCopySession.__init__(self, key, _filter, chunk_size, dedup)
+        self._resume_offset = 0
+
+    def _update_params(self) -> dict:
+        params = PGCopySession._update_params(self)
+        params['checkpoint'] = 0
+        return params
+
+    def _check_checkpoint(self, badge: FileBadge):
+        # return (file_id, checkpoint) for unfinished file or (None, 0)
+        check_query = sql.SQL('SELECT id, checkpoint FROM {} WHERE {}={} and {}={} and {} in ({}) {}').format(
+            sql.Identifier(self._file_table),
+            sql.Identifier('name'), sql.Literal(badge.name),
+            sql.Identifier('type'), sql.Literal(badge.data_type),
+            sql.Identifier('status'), sql.SQL(', ').join(map(sql.Literal, self._unfinished)),
+            _gen_where_for(self._filter)
+        )
+        cursor = self.cursor(named=True)
+        cursor.execute(check_query)
+        row = cursor.fetchone()
+        return (row.id, row.checkpoint) if row else (None, 0)
+
+    def _chunk_stored(self, file_id: int):
         params = {
-            'lines_count': lines_count,
-            'duration': (datetime.now() - self._attach_begin).seconds,
-            'status': 'done' if is_ok else 'fail',
-            'fail_descr': fail_reason,
+            'checkpoint': self._lines_count,
+            'lines_count': self._lines_count,
+            'last_update': datetime.now(),
         }
         update_query = sql.SQL('UPDATE {} SET ({})=({}) WHERE {}={}').format(
             sql.Identifier(self._file_table),
@@ -184,13 +414,25 @@ class PGSession(StorageSession, PGMix):
             sql.SQL(', ').join(sql.Literal(value) for value in params.values()),
             sql.Identifier('id'), sql.Literal(file_id),
         )
-
-        cursor.execute(update_query)
+        self.cursor().execute(update_query)
         self.commit()
 
-    def submit_line(self, file_id: int, line_data: dict):
-        self._batch_params.append(list(line_data.values()))
-        self._batch_hdr = list(line_data.keys())
+    def attach_file(self, badge: FileBadge):
+        file_id, checkpoint = self._check_checkpoint(badge)
+        if not checkpoint:
+            self._resume_offset = 0
+            return PGCopySession.attach_file(self, badge)
+
+        self._attach_begin = datetime.now()
+        self._badges[file_id] = badge
+        self._batch_params.clear()
+        self._appended.clear()
+        self._start_copy(file_id, checkpoint)
+        self._resume_offset = checkpoint
+        return file_id
+
+    def resume_offset(self, file_id: int) -> int:
+        return self._resume_offset
 
 
 from unittest import TestCase
@@ -216,3 +458,78 @@ class _PGSessionTest(TestCase):
             self.session.submit_line(_id, line)
 
         self.session.update_file_status(_id, True)
+
+    def test_duplicate(self):
+        fingerprint = f'{datetime.now().timestamp():064}'
+        _id = self.session.attach_file(FileBadge(f'plain_{fingerprint}.xml', 'apdx', fingerprint))
+        self.session.update_file_status(_id, True)
+        cursor = self.session.cursor()
+        cursor.execute('SELECT content_hash FROM "TJFiles" WHERE id = %s', (_id,))
+        self.assertIsNone(cursor.fetchone().content_hash)  # without dedup the column is not used
+        self.assertFalse(self.session.is_duplicate(FileBadge('renamed.xml', 'apdx', fingerprint)))
+
+        session = type(self.session)(KeyChain.PG_PERF_KEY, DataFilter().add('base1s', 'test_filter'), dedup=True)
+        session.add_store_rule('apdx', 'ApdexLines')
+        badge = FileBadge(f'dup_{fingerprint}.xml', 'apdx', fingerprint)
+        self.assertFalse(session.is_duplicate(badge))
+        session.update_file_status(session.attach_file(badge), True)
+        self.assertTrue(session.is_duplicate(FileBadge('renamed.xml', 'apdx', fingerprint)))
+
+
+class _PGCheckpointSessionTest(TestCase):
+    def setUp(self) -> None:
+        self.badge = FileBadge(f'resume_{datetime.now().timestamp()}.xml', 'apdx')
+        self.session = self._session()
+
+    @staticmethod
+    def _session():
+        session = PGCheckpointSession(KeyChain.PG_PERF_KEY, DataFilter().add('base1s', 'test_filter'), chunk_size=10)
+        session.add_store_rule('apdx', 'ApdexLines')
+        return session
+
+    @staticmethod
+    def _line(i):
+        return {'ops_uid': '100', 'ops_name': 'Cool operation', 'user': 'Donald', 'start': datetime.now(), 'duration': i}
+
+    def test_resume(self):
+        _id = self.session.attach_file(self.badge)
+        self.assertEqual(self.session.resume_offset(_id), 0)
+        for i in range(25):
+            self.session.submit_line(_id, self._line(i))
+        # crash: no update_file_status, not committed chunk is lost
+
+        session = self._session()
+        self.assertEqual(session.attach_file(self.badge), _id)
+        self.assertEqual(session.resume_offset(_id), 20)
+        for i in range(20, 25):
+            session.submit_line(_id, self._line(i))
+        session.update_file_status(_id, True)
+
+        cursor = session.cursor()
+        cursor.execute(f'SELECT lines_count FROM "TJFiles" WHERE id={_id}')
+        self.assertEqual(cursor.fetchone().lines_count, 25)
+        cursor.execute(f'SELECT count(*) FROM "ApdexLines" WHERE file_id={_id}')
+        self.assertEqual(cursor.fetchone()[0], 25)
+
+        # done file is reloaded from the beginning
+        session = self._session()
+        self.assertEqual(session.attach_file(self.badge), _id)
+        self.assertEqual(session.resume_offset(_id), 0)
+
+
+class _PGCopySessionTest(_PGSessionTest):
+    def setUp(self) -> None:
+        self.badge = FileBadge('some_data_file.xml', 'apdx')
+        self.session = PGCopySession(KeyChain.PG_PERF_KEY, DataFilter().add('base1s', 'test_filter'), chunk_size=3)
+        self.session.add_store_rule('apdx', 'ApdexLines')
+
+    def test_batch_usage(self):
+        import pandas as pd
+        _id = self.session.attach_file(self.badge)
+        self.session.submit_batch(_id, pd.DataFrame({
+            'ops_uid': ['100', '101'],
+            'user': ['Donald', None],
+            'start': pd.to_datetime([datetime.now(), datetime.now()]),
+            'duration': [1.5, float('nan')],
+        }))
+        self.session.update_file_status(_id, True)
@@ -2,11 +2,16 @@
     File processor utils
 """
 
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from itertools import zip_longest
+import os
+import pickle
 from typing import List, Callable
+import time
 import traceback
 
-from ._session import TransferSession, StorageSession, FileBadge
+from ._session import TransferSession, StorageSession, FileBadge, FileStages, batch_lines
 
 
 @dataclass()
@@ -14,10 +19,72 @@ class ParserJob:
     class Validator:
         """ Interface for validators class, use it for manage transfer process """
 
-        def on_line(self, line: dict):
-            """ call for all parsing lines, until it storage submitted (read/write) """
+        def on_line(self, line: tuple):
+            """ call for all parsing lines (typed records, e.g. techjrnl.TJLine), until it storage submitted """
             pass
 
+        def on_batch(self, batch):
+            """ call for parser lines batch (pandas.DataFrame), until it storage submitted """
+            for line in batch_lines(batch):
+                self.on_line(line)
+
+        def merge(self, other):
+            """ call for join results of validator copy, used by worker process """
+            pass
+
+    class Aggregator:
+        """ Interface for streaming aggregators: file lines are aggregated while they flow to storage,
+            results are submitted into storage side tables with the file status, see aggregators.py
+        """
+
+        def on_line(self, line: tuple):
+            """ call for all parsing lines, including lines skipped by resume """
+            pass
+
+        def on_batch(self, batch):
+            """ call for parser lines batch (pandas.DataFrame) """
+            for line in batch_lines(batch):
+                self.on_line(line)
+
+        def flush(self) -> dict:
+            """ call while the file is parsed: return {side table: [row]} of rows complete already and reset them,
+                rows are stored by parts, so they don't collect in memory (e.g. EventFacts)
+            """
+            return {}
+
+        def rows(self) -> dict:
+            """ call after the file: return {side table: [row]} of the file (rest after flushes) and reset
+                for the next one, all tables are returned, even empty
+            """
+            return {}
+
+        def dicts(self) -> dict:
+            """ call after the file: return {dictionary table: [row]} of the file and reset, see StorageSession.submit_dict """
+            return {}
+
+    class Encoder:
+        """ Interface for line encoders: parser lines are changed before storage, e.g. dimension values
+            are replaced by dictionary ids, see encoders.py. Validator and aggregator get parser lines
+        """
+
+        def encode_line(self, line: tuple) -> tuple:
+            return line
+
+        def encode_batch(self, batch):
+            return batch
+
+        def flush(self) -> dict:
+            """ call after each encoded line or batch: return {dictionary table: [row]} of values met first since
+                the last call, they are stored before the lines, which chunks may be committed while the file is parsed
+            """
+            return {}
+
+        def dicts(self) -> dict:
+            """ call after the file: return {dictionary table: [row]} of the file (rest after flushes) and reset,
+                see StorageSession.submit_dict
+            """
+            return {}
+
     parser: Callable
     data_type: str
     transfer_path: str
@@ -25,14 +92,20 @@ class ParserJob:
     time_zone_adjust: int = +3
     max_files: int = 500
     validator: Validator = None
+    aggregator: Aggregator = None
+    encoder: Encoder = None
+    workers: int = 1  # worker processes count, each with own transfer and storage sessions
+    batches: bool = False  # parser yields lines batches (pandas.DataFrame), see syscounters.parse_columnar
 
 
 class _Log:
     def __init__(self):
         self._data = {}
+        self._stages = {}  # data type -> FileStages totals
 
     def register_type(self, data_type: str) -> None:
-        self._data[data_type] = {'f': 0, 'd': 0}
+        self._data[data_type] = {'f': 0, 'd': 0, 's': 0, 'r': 0}
+        self._stages[data_type] = FileStages()
 
     def done(self, badge: FileBadge) -> None:
         self._data[badge.data_type]['d'] += 1
@@ -40,13 +113,51 @@ class _Log:
     def fail(self, badge: FileBadge) -> None:
         self._data[badge.data_type]['f'] += 1
 
+    def skip(self, badge: FileBadge) -> None:
+        self._data[badge.data_type]['s'] += 1
+
+    def remain(self, data_type: str, count: int) -> None:
+        self._data[data_type]['r'] += count
+
+    def add_stages(self, data_type: str, stages: FileStages) -> None:
+        self._stages[data_type].add(stages)
+
+    def remaining(self) -> dict:
+        return {data_type: counters['r'] for data_type, counters in self._data.items() if counters['r']}
+
+    def merge(self, other: '_Log') -> None:
+        for data_type, counters in other._data.items():
+            for key, value in counters.items():
+                self._data[data_type][key] += value
+            self._stages[data_type].add(other._stages[data_type])
+
+    def samples(self, labels: dict) -> list:
+        """ Metric samples by data type: (metric, labels, value), see write_metrics """
+        result = []
+        for data_type, counters in self._data.items():
+            _labels = dict(labels, type=data_type)
+            for key, status in (('d', 'done'), ('f', 'fail'), ('s', 'skip')):
+                result.append(('tj_transfer_files', dict(_labels, status=status), counters[key]))
+            result.append(('tj_transfer_remaining_files', _labels, counters['r']))
+            stages = self._stages[data_type]
+            for stage in ('list', 'download', 'parse', 'submit', 'commit'):
+                result.append(
+                    ('tj_transfer_stage_seconds', dict(_labels, stage=stage), getattr(stages, f'{stage}_ms') / 1000)
+                )
+            result.append(('tj_transfer_bytes', dict(_labels, kind='wire'), stages.wire_bytes))
+            result.append(('tj_transfer_bytes', dict(_labels, kind='plain'), stages.bytes))
+            result.append(('tj_transfer_lines', _labels, stages.lines))
+        return result
+
     def __repr__(self) -> str:
         return '-'.join(
             [
-                '[{}]:d.{}:f.{}'.format(
+                '[{}]:d.{}:f.{}{}{}'.format(
                     key,
                     self._data[key]['d'],
-                    self._data[key]['f']
+                    self._data[key]['f'],
+                    ':s.{}'.format(self._data[key]['s']) if self._data[key]['s'] else '',
+                    ':r.{}'.format(self._data[key]['r']) if self._data[key]['r'] else ''
                 )
                 for key in self._data.keys()
             ]
@@ -54,11 +165,21 @@ class _Log:
 
 
 class Processor:
-    def __init__(self, transfer: TransferSession, storage: StorageSession):
+    """ Jobs are processed round-robin by one file. With time budget (wall-clock seconds per run) the job stops
+        when its file expected duration (mean of processed files of the type) doesn't fit in the budget rest,
+        files left are reported by remaining()
+    """
+
+    FLUSH_LINES = 10000  # parsed lines between aggregator flushes, see ParserJob.Aggregator.flush
+
+    def __init__(self, transfer: TransferSession, storage: StorageSession, budget: float = None):
         self._transfer = transfer
         self._storage = storage
         self.parser_jobs: List[ParserJob] = []
         self._log = _Log()
+        self.budget = budget
+        self._deadline = None  # time.time() of budget end
+        self._costs = {}  # data type -> [files count, seconds]
 
     def add_parser_job(self, job: ParserJob):
         self.parser_jobs.append(job)
@@ -66,49 +187,332 @@ class Processor:
         self._storage.add_store_rule(job.data_type, job.store_place)
         self._log.register_type(job.data_type)
 
-    def execute(self):
-        for job in self.parser_jobs:
-            for i in range(job.max_files):
-                trans_id = self._transfer.attach_file(job.data_type)
-
-                if not trans_id:
-                    break
-
-                store_badge = FileBadge(
-                    self._transfer.file_name(trans_id),
-                    job.data_type
-                )
-                batch_id = self._storage.attach_file(store_badge)
-
-                try:
-                    path = self._transfer.local_path(trans_id)
-
-                    for line in job.parser(path, store_badge.name, job.time_zone_adjust):
-                        if job.validator:
-                            job.validator.on_line(line)
-                        self._storage.submit_line(batch_id, line)
-
-                except Exception:
-                    self._transfer.to_fail(trans_id)
-                    self._storage.update_file_status(batch_id, False, traceback.format_exc())
-                    self._log.fail(store_badge)
+    def _flush_aggregates(self, job: ParserJob, batch_id: int):
+        for table, rows in job.aggregator.flush().items():
+            self._storage.append_rows(batch_id, table, rows)
+
+    def _flush_dicts(self, job: ParserJob):
+        # dictionary rows of the lines are stored before them, failed file ones too
+        for table, rows in job.encoder.flush().items():
+            if rows:
+                self._storage.submit_dict(table, rows)
+
+    def _submit_aggregates(self, job: ParserJob, batch_id: int, is_ok: bool):
+        # failed file side rows are cleared, flushed ones too
+        if job.aggregator:
+            for table, rows in job.aggregator.rows().items():
+                if is_ok:
+                    self._storage.append_rows(batch_id, table, rows)
                 else:
-                    self._transfer.to_done(trans_id)
-                    self._storage.update_file_status(batch_id, True)
-                    self._log.done(store_badge)
-
-        print(self._storage.filter(), self._log, sep=':')
+                    self._storage.submit_rows(batch_id, table, [])
+        for source in filter(None, (job.aggregator, job.encoder)):
+            for table, rows in source.dicts().items():
+                if is_ok and rows:
+                    self._storage.submit_dict(table, rows)
+
+    def _commit_file(self, job: ParserJob, batch_id: int, is_ok: bool, fail_reason: str = None) -> float:
+        # storage commit of file: side rows and status, return ms
+        begin = time.perf_counter()
+        self._submit_aggregates(job, batch_id, is_ok)
+        self._storage.update_file_status(batch_id, is_ok, fail_reason)
+        return (time.perf_counter() - begin) * 1000
+
+    def _process_file(self, job: ParserJob) -> bool:  # False if no files to process
+        trans_id = self._transfer.attach_file(job.data_type)
+
+        if not trans_id:
+            return False
+
+        store_badge = FileBadge(
+            self._transfer.file_name(trans_id),
+            job.data_type,
+            self._transfer.fingerprint(trans_id)
+        )
+        if store_badge.fingerprint and self._storage.is_duplicate(store_badge):
+            self._transfer.to_done(trans_id)  # the same content is already loaded
+            self._log.skip(store_badge)
+            return True
+
+        batch_id = self._storage.attach_file(store_badge)
+        lines = 0
+        flush_at = self.FLUSH_LINES  # lines count of the next aggregator flush
+        submit = 0.0  # seconds of submit calls
+        begin = time.perf_counter()
+
+        try:
+            path = self._transfer.local_path(trans_id)
+            skip = self._storage.resume_offset(batch_id)  # lines already stored by unfinished attach
+
+            for line in job.parser(path, store_badge.name, job.time_zone_adjust):
+                if job.batches:
+                    lines += len(line)
+                    if job.validator:
+                        job.validator.on_batch(line)
+                    if job.aggregator:
+                        job.aggregator.on_batch(line)
+                        if lines >= flush_at:
+                            self._flush_aggregates(job, batch_id)
+                            flush_at = lines + self.FLUSH_LINES
+                    if job.encoder:
+                        line = job.encoder.encode_batch(line)  # skipped lines too: dictionary is stored with file
+                        self._flush_dicts(job)
+                    if skip >= len(line):
+                        skip -= len(line)
+                        continue
+                    submit_begin = time.perf_counter()
+                    self._storage.submit_batch(batch_id, line.iloc[skip:])
+                    submit += time.perf_counter() - submit_begin
+                    skip = 0
+                    continue
+                lines += 1
+                if job.validator:
+                    job.validator.on_line(line)
+                if job.aggregator:
+                    job.aggregator.on_line(line)
+                    if lines >= flush_at:
+                        self._flush_aggregates(job, batch_id)
+                        flush_at = lines + self.FLUSH_LINES
+                if job.encoder:
+                    line = job.encoder.encode_line(line)
+                    self._flush_dicts(job)
+                if skip:
+                    skip -= 1
+                    continue
+                submit_begin = time.perf_counter()
+                self._storage.submit_line(batch_id, line)
+                submit += time.perf_counter() - submit_begin
+            self._transfer.finish_file(trans_id)
+            duplicate = False
+            if not store_badge.fingerprint:  # streamed file hash is known now
+                store_badge.fingerprint = self._transfer.fingerprint(trans_id)
+                duplicate = bool(store_badge.fingerprint) and self._storage.is_duplicate(store_badge)
+
+        except Exception:
+            parse_ms = (time.perf_counter() - begin - submit) * 1000
+            self._transfer.to_fail(trans_id)
+            commit_ms = self._commit_file(job, batch_id, False, traceback.format_exc())
+            self._log.fail(store_badge)
+        else:
+            parse_ms = (time.perf_counter() - begin - submit) * 1000
+            self._transfer.to_done(trans_id)
+            if duplicate:  # the same content is already loaded, file lines are not committed
+                self._storage.drop_file(batch_id)
+                commit_ms = self._commit_file(job, batch_id, False, 'Duplicate: the same content is already loaded')
+                self._log.skip(store_badge)
+            else:
+                commit_ms = self._commit_file(job, batch_id, True)
+                self._log.done(store_badge)
+
+        stages = FileStages(
+            **self._transfer.file_stages(trans_id),
+            parse_ms=parse_ms, submit_ms=submit * 1000, commit_ms=commit_ms, lines=lines
+        )
+        try:  # the file is committed already, stages are not the file data
+            self._storage.submit_stages(batch_id, stages)
+        except Exception as e:
+            print(f'{store_badge.name}: stages are not stored: {e!r}')
+        self._log.add_stages(job.data_type, stages)
+        return True
+
+    def _file_cost(self, data_type: str) -> float:
+        # expected file seconds, the most expensive type is used until the type files are measured
+        costs = {_type: seconds / files for _type, (files, seconds) in self._costs.items()}
+        return costs.get(data_type, max(costs.values(), default=0.0))
+
+    def _in_budget(self, data_type: str) -> bool:
+        return self._deadline is None or time.time() + self._file_cost(data_type) < self._deadline
+
+    def _process_jobs(self, jobs: List[ParserJob]):
+        left = {job.data_type: job.max_files for job in jobs}
+        active = [job for job in jobs if job.max_files]
+        while active:
+            for job in list(active):
+                if not self._in_budget(job.data_type):
+                    active.remove(job)
+                    pending = self._transfer.pending(job.data_type)
+                    remain = left[job.data_type] if pending is None else min(pending, left[job.data_type])
+                    self._log.remain(job.data_type, remain)
+                    continue
+
+                begin = time.time()
+                if not self._process_file(job):
+                    active.remove(job)
+                    continue
+                cost = self._costs.setdefault(job.data_type, [0, 0.0])
+                cost[0] += 1
+                cost[1] += time.time() - begin
+
+                left[job.data_type] -= 1
+                if not left[job.data_type]:
+                    active.remove(job)
+
+    @staticmethod
+    def _worker_jobs(jobs: List[ParserJob], worker: int) -> List[ParserJob]:
+        """ Job copies for worker process, job max_files are shared between job workers """
+        result = []
+        for job in jobs:
+            share, rest = divmod(job.max_files, job.workers)
+            max_files = share + (1 if worker < rest else 0)
+            if worker < job.workers and max_files:
+                result.append(replace(job, max_files=max_files, workers=1))
+        return result
+
+    def _worker_tasks(self) -> List[List[ParserJob]]:
+        """ Jobs of each worker process, workers count is the processor quota """
+        workers = max([job.workers for job in self.parser_jobs] or [1])
+        return [self._worker_jobs(self.parser_jobs, worker) for worker in range(workers)]
+
+    def _merge_work(self, jobs: List[ParserJob], result: tuple):
+        log, validators = result
+        self._log.merge(log)
+        for job, validator in zip(jobs, validators):
+            if job.validator:
+                job.validator.merge(validator)
+
+    def _process_parallel(self, workers: int):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tasks = []
+            for jobs in self._worker_tasks():
+                tasks.append((jobs, pool.submit(_work, self._transfer, self._storage, jobs, self._deadline)))
+            for jobs, task in tasks:
+                self._merge_work(jobs, task.result())
+
+    def process(self):
+        self._start_budget()
+        workers = max([job.workers for job in self.parser_jobs] or [1])
+        if workers > 1:
+            self._process_parallel(workers)
+        else:
+            self._process_jobs(self.parser_jobs)
+
+    def _start_budget(self):
+        if self.budget and self._deadline is None:
+            self._deadline = time.time() + self.budget
+
+    def remaining(self) -> dict:
+        """ Files left by budget stop by data type, empty if all the work is done """
+        return self._log.remaining()
+
+    def summary(self) -> str:
+        return '{}:{}'.format(self._storage.filter(), self._log)
+
+    def metric_samples(self, error: bool = False) -> list:
+        """ Run metrics: (metric, labels, value), labels are storage filter fields and data type """
+        labels = {item.field: item.value for item in self._storage.filter()}
+        return self._log.samples(labels) + [
+            ('tj_transfer_error', labels, int(error)),
+            ('tj_transfer_last_run_timestamp_seconds', labels, time.time()),
+        ]
+
+    def execute(self, metrics_path: str = None):
+        self.process()
+        print(self.summary())
+        if metrics_path:
+            write_metrics(metrics_path, self.metric_samples())
+
+
+METRICS = {
+    'tj_transfer_files': 'Files of the last run by status',
+    'tj_transfer_remaining_files': 'Files left by the last run budget',
+    'tj_transfer_stage_seconds': 'Stage time of the last run files, stream mode download overlaps parse',
+    'tj_transfer_bytes': 'Bytes of the last run files: wire (compressed) and plain',
+    'tj_transfer_lines': 'Parsed lines of the last run files',
+    'tj_transfer_error': '1 if a worker of the last run failed',
+    'tj_transfer_last_run_timestamp_seconds': 'The last run end time',
+}
+
+
+def _label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_metrics(path: str, samples: list):
+    """ Write Prometheus text format file, e.g. for node_exporter textfile collector.
+        File is replaced at once, so a collector doesn't read a partial file
+    """
+    text = []
+    for metric, description in METRICS.items():
+        text.append(f'# HELP {metric} {description}')
+        text.append(f'# TYPE {metric} gauge')
+        for _metric, labels, value in samples:
+            if _metric == metric:
+                _labels = ','.join(f'{key}="{_label_value(value)}"' for key, value in labels.items())
+                text.append(f'{metric}{{{_labels}}} {value}')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        file.write('\n'.join(text) + '\n')
+    os.replace(tmp_path, path)
+
+
+def execute_fleet(processors: List[Processor], workers: int, metrics_path: str = None):
+    """ Process several processors (e.g. one per 1C base) in the shared pool of worker processes.
+        Processor quota is its jobs workers count. Worker tasks of processors are queued in turn,
+        so every processor gets a worker early, however long the queue of others is.
+        A failed worker task is reported in its processor summary line and doesn't stop the others.
+        With metrics_path run metrics of all processors are written there, see write_metrics
+    """
+    for processor in processors:
+        processor._start_budget()
+    queues = [[(processor, jobs) for jobs in processor._worker_tasks()] for processor in processors]
+    errors = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tasks = []
+        for turn in zip_longest(*queues):
+            for processor, jobs in filter(None, turn):
+                sessions = pickle.dumps((processor._transfer, processor._storage))
+                tasks.append((processor, jobs, pool.submit(_fleet_work, sessions, jobs, processor._deadline)))
+        for processor, jobs, task in tasks:
+            try:
+                processor._merge_work(jobs, task.result())
+            except Exception as e:
+                errors[processor] = e
+    for processor in processors:
+        print(processor.summary() + (f':error.{errors[processor]!r}' if processor in errors else ''))
+    if metrics_path:
+        samples = [processor.metric_samples(processor in errors) for processor in processors]
+        write_metrics(metrics_path, sum(samples, []))
+
+
+def _work(transfer: TransferSession, storage: StorageSession, jobs: List[ParserJob], deadline: float = None):
+    """ Worker process entry, sessions are the worker own copies, deadline is the processor budget end """
+    processor = Processor(transfer=transfer, storage=storage)
+    processor._deadline = deadline
+    for job in jobs:
+        processor.add_parser_job(job)
+    processor.process()
+    return processor._log, [job.validator for job in jobs]
+
+
+def _fleet_work(sessions: bytes, jobs: List[ParserJob], deadline: float = None):
+    """ Fleet worker process entry, sessions are restored (connected) here:
+        a failed connect is the task error, not a broken pool of other processors """
+    transfer, storage = pickle.loads(sessions)
+    return _work(transfer, storage, jobs, deadline)
 
 
 from unittest import TestCase
 
 
 from keys import KeyChain
-from .pg_session import PGSession, DataFilter
+from .pg_session import PGSession, PGCheckpointSession, DataFilter
 from .ftp_session import FtpSession
 from .parsers import techjrnl, apdex, syscounters
 
 
+def _crashing_parse(path: str, name: str, time_zone_adjust: int):
+    for i, line in enumerate(techjrnl.parse(path, name, time_zone_adjust)):
+        if i == 250:
+            os._exit(1)  # process crash: no fail status, the file is left claimed
+        yield line
+
+
+def _crashed_run(ftp_key: dict, pg_key: dict):
+    storage = PGCheckpointSession(pg_key, DataFilter().add('base1s', 'crash_test'), chunk_size=100)
+    processor = Processor(FtpSession(ftp_key), storage)
+    processor.add_parser_job(ParserJob(_crashing_parse, 'logs', 'logs', 'TJLines', max_files=1))
+    processor.process()
+
+
 class _ProcessorTest(TestCase):
     def setUp(self) -> None:
         ftp_key = KeyChain.FTP_TJ_KEYS['tjtest']
@@ -153,6 +557,51 @@ class _ProcessorTest(TestCase):
 
         processor.execute()
 
+    def test_execute_parallel(self):
+        processor = Processor(transfer=self.transfer, storage=self.storage)
+        processor.add_parser_job(
+            ParserJob(
+                parser=techjrnl.parse,
+                data_type='logs',
+                transfer_path='logs',
+                store_place='TJLines',
+                time_zone_adjust=+1,
+                max_files=4,
+                workers=2,
+            )
+        )
+        processor.execute()
+
+    def test_crash_resume(self):
+        import multiprocessing
+
+        class Counter(ParserJob.Validator):
+            lines = 0
+
+            def on_line(self, line: tuple):
+                self.lines += 1
+
+        ftp_key = KeyChain.FTP_TJ_KEYS['tjtest']
+        crashed = multiprocessing.Process(target=_crashed_run, args=(ftp_key, KeyChain.PG_PERF_KEY))
+        crashed.start()
+        crashed.join()
+        self.assertEqual(crashed.exitcode, 1)
+
+        transfer = FtpSession(ftp_key, stale_age=0)  # crashed run file is stale at once
+        storage = PGCheckpointSession(KeyChain.PG_PERF_KEY, DataFilter().add('base1s', 'crash_test'), chunk_size=100)
+        counter = Counter()
+        processor = Processor(transfer, storage)
+        processor.add_parser_job(ParserJob(techjrnl.parse, 'logs', 'logs', 'TJLines', max_files=1, validator=counter))
+        processor.process()
+        self.assertEqual(storage.resume_offset(0), 200)  # the file is reclaimed and resumed by 2 stored chunks
+
+        cursor = storage.cursor()
+        cursor.execute(
+            'SELECT f.status, f.lines_count, (SELECT count(*) FROM "TJLines" l WHERE l.file_id = f.id) AS stored '
+            'FROM "TJFiles" f WHERE f.name = %s AND f.base1s = %s', (transfer.file_name(1), 'crash_test')
+        )
+        self.assertEqual(tuple(cursor.fetchone()), ('done', counter.lines, counter.lines))
+
 
 class _LogTest(TestCase):
     def setUp(self) -> None:
@@ -167,3 +616,198 @@ class _LogTest(TestCase):
 
     def test_repr(self):
         print(self.log)
+
+    def test_merge(self):
+        other = _Log()
+        other.register_type('type1')
+        other.done(FileBadge('', 'type1'))
+        self.log.merge(other)
+        self.assertEqual(repr(self.log), '[type1]:d.2:f.1-[type2]:d.2:f.2-[type3]:d.3:f.3')
+
+    def test_skip(self):
+        self.log.skip(FileBadge('', 'type2'))
+        self.assertEqual(repr(self.log), '[type1]:d.1:f.1-[type2]:d.2:f.2:s.1-[type3]:d.3:f.3')
+
+    def test_remain(self):
+        self.log.remain('type3', 2)
+        self.assertEqual(repr(self.log), '[type1]:d.1:f.1-[type2]:d.2:f.2-[type3]:d.3:f.3:r.2')
+        self.assertEqual(self.log.remaining(), {'type3': 2})
+
+
+class _ProcessorBudgetTest(TestCase):
+    class Transfer(TransferSession):
+        """ Files of type are the same local file """
+        def __init__(self, files: int, path: str):
+            super().__init__()
+            self.files = {}
+            self._count = files
+            self._path = path
+
+        def attach_file(self, data_type: str) -> int:
+            self.files.setdefault(data_type, self._count)
+            if not self.files[data_type]:
+                return 0
+            self.files[data_type] -= 1
+            return 1
+
+        def local_path(self, file_id) -> str:
+            return self._path
+
+        def file_name(self, file_id) -> str:
+            return 'file.txt'
+
+        def pending(self, data_type: str) -> int:
+            return self.files.get(data_type, self._count)
+
+    @staticmethod
+    def parser(path: str, name: str, time_zone_adjust: int):
+        time.sleep(0.1)
+        yield {'name': name}
+
+    def test_budget(self):
+        from .mem_session import MemSession
+
+        transfer = self.Transfer(10, __file__)
+        processor = Processor(transfer, MemSession(), budget=0.65)
+        for data_type in ('logs', 'cntr'):
+            processor.add_parser_job(ParserJob(self.parser, data_type, data_type, data_type, max_files=8))
+        processor.process()
+        self.assertEqual(transfer.files, {'logs': 7, 'cntr': 7})  # round-robin, 3 files of each type in budget
+        self.assertEqual(processor.remaining(), {'logs': 5, 'cntr': 5})  # max_files is the limit
+        self.assertEqual(repr(processor._log), '[logs]:d.3:f.0:r.5-[cntr]:d.3:f.0:r.5')
+
+    def test_stages(self):
+        import tempfile
+        from .mem_session import MemSession
+        from ._session import DataFilter
+
+        storage = MemSession(DataFilter().add('base1s', 'test'))
+        processor = Processor(self.Transfer(2, __file__), storage)
+        processor.add_parser_job(ParserJob(self.parser, 'logs', 'logs', 'logs'))
+        path = os.path.join(tempfile.gettempdir(), 'processor_test.prom')
+        processor.execute(metrics_path=path)
+        for file in storage.files.values():
+            self.assertEqual(file.stages.lines, 1)
+            self.assertGreaterEqual(file.stages.parse_ms, 100)
+        with open(path) as file:
+            metrics = file.read().splitlines()
+        os.remove(path)
+        self.assertIn('# TYPE tj_transfer_stage_seconds gauge', metrics)
+        self.assertIn('tj_transfer_files{base1s="test",type="logs",status="done"} 2', metrics)
+        self.assertIn('tj_transfer_lines{base1s="test",type="logs"} 2', metrics)
+
+    def test_stream_duplicate(self):
+        from .mem_session import MemSession
+
+        class Streamed(self.Transfer):
+            """ Files of other names, content hash is known after finish_file as FtpSession stream mode gives """
+            finished = False
+
+            def attach_file(self, data_type: str) -> int:
+                self.finished = False
+                return super().attach_file(data_type)
+
+            def finish_file(self, file_id: int):
+                self.finished = True
+
+            def file_name(self, file_id) -> str:
+                return f'file{self.files["logs"]}.txt'
+
+            def fingerprint(self, file_id) -> str:
+                return 'hash' if self.finished else None
+
+        storage = MemSession()
+        processor = Processor(Streamed(2, __file__), storage)
+        processor.add_parser_job(ParserJob(self.parser, 'logs', 'logs', 'logs'))
+        processor.execute()
+        self.assertEqual(repr(processor._log), '[logs]:d.1:f.0:s.1')
+        self.assertEqual([(file.status, file.lines_count) for file in storage.files.values()], [('done', 1), ('fail', 0)])
+
+    def test_stages_fail(self):
+        from .mem_session import MemSession
+
+        class Storage(MemSession):
+            def submit_stages(self, file_id: int, stages: FileStages):
+                raise RuntimeError('no stages table')
+
+        processor = Processor(self.Transfer(2, __file__), Storage())
+        processor.add_parser_job(ParserJob(self.parser, 'logs', 'logs', 'logs'))
+        processor.execute()
+        self.assertEqual(repr(processor._log), '[logs]:d.2:f.0')  # the run goes on
+
+    def test_aggregate_flush(self):
+        from .mem_session import MemSession
+
+        class Facts(ParserJob.Aggregator):
+            def __init__(self):
+                self._rows = []
+
+            def on_line(self, line: tuple):
+                self._rows.append({'n': line['n']})
+
+            def flush(self) -> dict:
+                return self.rows()
+
+            def rows(self) -> dict:
+                rows, self._rows = self._rows, []
+                return {'Facts': rows}
+
+        class Storage(MemSession):
+            parts = []
+
+            def append_rows(self, file_id: int, table: str, rows: list):
+                self.parts.append(len(rows))
+                MemSession.append_rows(self, file_id, table, rows)
+
+        def parser(path: str, name: str, time_zone_adjust: int):
+            yield from ({'n': n} for n in range(25))
+
+        storage = Storage()
+        processor = Processor(self.Transfer(1, __file__), storage)
+        processor.FLUSH_LINES = 10
+        processor.add_parser_job(ParserJob(parser, 'logs', 'logs', 'logs', aggregator=Facts()))
+        processor.process()
+        self.assertEqual(storage.parts, [10, 10, 5])  # rows are stored by parts, not collected for the file
+        self.assertEqual([row['n'] for row in storage.files[1].rows['Facts']], list(range(25)))
+
+    def test_dict_flush(self):
+        from .mem_session import MemSession
+
+        class Keys(ParserJob.Encoder):
+            def __init__(self):
+                self._new = []
+
+            def encode_line(self, line: tuple) -> tuple:
+                if line['n'] % 3 == 0:
+                    self._new.append({'id': line['n'] // 3})
+                return {'key_id': line['n'] // 3}
+
+            def flush(self) -> dict:
+                rows, self._new = self._new, []
+                return {'Keys': rows}
+
+        class Storage(MemSession):
+            events = []
+
+            def submit_dict(self, table: str, rows: list):
+                self.events.extend(('dict', row['id']) for row in rows)
+                MemSession.submit_dict(self, table, rows)
+
+            def submit_line(self, file_id: int, line_data: tuple):
+                self.events.append(('line', line_data['key_id']))
+                MemSession.submit_line(self, file_id, line_data)
+
+        def parser(path: str, name: str, time_zone_adjust: int):
+            yield from ({'n': n} for n in range(7))
+
+        storage = Storage()
+        processor = Processor(self.Transfer(1, __file__), storage)
+        processor.add_parser_job(ParserJob(parser, 'logs', 'logs', 'logs', encoder=Keys()))
+        processor.process()
+        stored = set()
+        for kind, key_id in storage.events:  # the key is stored before the line, not with the file status
+            if kind == 'dict':
+                stored.add(key_id)
+            else:
+                self.assertIn(key_id, stored)
+        self.assertEqual(stored, {0, 1, 2})
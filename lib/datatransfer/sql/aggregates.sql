@@ -0,0 +1,62 @@
+-- aggregators.CounterMinutes: per file partial counter aggregates by minute
+CREATE TABLE IF NOT EXISTS "CounterMinuteAggs" (
+    file_id INT NOT NULL,
+    base1s TEXT,
+    stamp TIMESTAMP NOT NULL,
+    counter TEXT,
+    host TEXT,
+    context TEXT,
+    type TEXT,
+    flt_value_sum DOUBLE PRECISION,
+    flt_value_count BIGINT NOT NULL,
+    flt_value_min DOUBLE PRECISION,
+    flt_value_max DOUBLE PRECISION
+);
+CREATE INDEX IF NOT EXISTS "CounterMinuteAggs_file_id_idx" ON "CounterMinuteAggs" (file_id);
+CREATE INDEX IF NOT EXISTS "CounterMinuteAggs_base1s_stamp_idx" ON "CounterMinuteAggs" (base1s, stamp);
+
+-- the same values as "CounterLinesRoll1Min" (_minutes = 1) and "CounterLinesRoll15Min" (_minutes = 15) of the period:
+-- stamp is the interval middle. Aggregates are filtered by raw stamp before grouping, so the stamp index is used,
+-- see datarollup.CounterAggsRoll
+DROP VIEW IF EXISTS "CounterMinuteRoll", "CounterQuarterRoll";
+CREATE OR REPLACE FUNCTION counter_aggs_roll(_base1s TEXT, _from TIMESTAMP, _to TIMESTAMP, _minutes INT)
+    RETURNS TABLE (
+        base1s TEXT, stamp TIMESTAMP, counter TEXT, host TEXT, context TEXT, type TEXT,
+        flt_value_sum DOUBLE PRECISION, flt_value_count BIGINT, flt_value_avg DOUBLE PRECISION,
+        flt_value_min DOUBLE PRECISION, flt_value_max DOUBLE PRECISION
+    )
+    LANGUAGE SQL STABLE AS $$
+SELECT a.base1s,
+       date_trunc('hour', a.stamp)
+           + (date_part('minute', a.stamp)::INT / _minutes * _minutes + _minutes / 2.0) * INTERVAL '1 minute',
+       a.counter, a.host, a.context, a.type,
+       sum(a.flt_value_sum),
+       sum(a.flt_value_count)::BIGINT,
+       sum(a.flt_value_sum) / NULLIF(sum(a.flt_value_count), 0),
+       min(a.flt_value_min),
+       max(a.flt_value_max)
+  FROM "CounterMinuteAggs" a
+ WHERE a.base1s = _base1s AND a.stamp >= _from AND a.stamp < _to
+ GROUP BY a.base1s, 2, a.counter, a.host, a.context, a.type
+$$;
+
+-- aggregators.ApdexHours: per file APDEX measures count by operation and hour
+CREATE TABLE IF NOT EXISTS "ApdexHourAggs" (
+    file_id INT NOT NULL,
+    base1s TEXT,
+    ops_uid TEXT,
+    start TIMESTAMP NOT NULL,
+    n BIGINT NOT NULL,
+    ns BIGINT NOT NULL,
+    nt BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS "ApdexHourAggs_file_id_idx" ON "ApdexHourAggs" (file_id);
+CREATE INDEX IF NOT EXISTS "ApdexHourAggs_base1s_start_idx" ON "ApdexHourAggs" (base1s, start);
+
+-- the same values as ApdexCalc sets into "ApdexLines".apdex, see ApdexAggCalc
+CREATE OR REPLACE VIEW "ApdexHourRoll" AS
+SELECT base1s, ops_uid, start,
+       sum(n) AS n, sum(ns) AS ns, sum(nt) AS nt,
+       ((sum(ns) + sum(nt)::REAL / 2)::REAL / sum(n)::REAL)::REAL AS apdex
+  FROM "ApdexHourAggs"
+ GROUP BY base1s, ops_uid, start;
@@ -0,0 +1,55 @@
+-- encoders.CounterDims: counter dimensions stored once, id is the hash of dimension values
+CREATE TABLE IF NOT EXISTS "CounterDims" (
+    id BIGINT PRIMARY KEY,
+    counter TEXT,
+    host TEXT,
+    context TEXT,
+    type TEXT
+);
+
+-- counter lines of CounterDims encoded jobs, ParserJob.store_place = 'CounterFacts'
+CREATE TABLE IF NOT EXISTS "CounterFacts" (
+    file_id INT NOT NULL,
+    base1s TEXT,
+    dim_id BIGINT NOT NULL,
+    stamp TIMESTAMP NOT NULL,
+    flt_value DOUBLE PRECISION,
+    str_value TEXT
+);
+CREATE INDEX IF NOT EXISTS "CounterFacts_file_id_idx" ON "CounterFacts" (file_id);
+CREATE INDEX IF NOT EXISTS "CounterFacts_base1s_stamp_idx" ON "CounterFacts" (base1s, stamp);
+
+-- "CounterLines" columns for existing queries
+CREATE OR REPLACE VIEW "CounterFactLines" AS
+SELECT f.file_id, f.base1s, f.stamp, d.counter, d.host, d.context, d.type, f.flt_value, f.str_value
+  FROM "CounterFacts" f
+  JOIN "CounterDims" d ON d.id = f.dim_id;
+
+-- datarollup.CounterFactsRoll: the same aggregates as "CounterLinesRoll1Min", "CounterLinesRoll15Min"
+CREATE TABLE IF NOT EXISTS "CounterFactsRoll1Min" (
+    base1s TEXT,
+    stamp TIMESTAMP NOT NULL,
+    dim_id BIGINT NOT NULL,
+    flt_value_sum DOUBLE PRECISION,
+    flt_value_count BIGINT,
+    flt_value_avg DOUBLE PRECISION,
+    flt_value_min DOUBLE PRECISION,
+    flt_value_max DOUBLE PRECISION
+);
+CREATE INDEX IF NOT EXISTS "CounterFactsRoll1Min_base1s_stamp_idx" ON "CounterFactsRoll1Min" (base1s, stamp);
+
+CREATE TABLE IF NOT EXISTS "CounterFactsRoll15Min" (LIKE "CounterFactsRoll1Min");
+CREATE INDEX IF NOT EXISTS "CounterFactsRoll15Min_base1s_stamp_idx" ON "CounterFactsRoll15Min" (base1s, stamp);
+
+-- "CounterLinesRoll1Min", "CounterLinesRoll15Min" columns
+CREATE OR REPLACE VIEW "CounterFactLinesRoll1Min" AS
+SELECT r.base1s, r.stamp, d.counter, d.host, d.context, d.type,
+       r.flt_value_sum, r.flt_value_count, r.flt_value_avg, r.flt_value_min, r.flt_value_max
+  FROM "CounterFactsRoll1Min" r
+  JOIN "CounterDims" d ON d.id = r.dim_id;
+
+CREATE OR REPLACE VIEW "CounterFactLinesRoll15Min" AS
+SELECT r.base1s, r.stamp, d.counter, d.host, d.context, d.type,
+       r.flt_value_sum, r.flt_value_count, r.flt_value_avg, r.flt_value_min, r.flt_value_max
+  FROM "CounterFactsRoll15Min" r
+  JOIN "CounterDims" d ON d.id = r.dim_id;
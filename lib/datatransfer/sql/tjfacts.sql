@@ -0,0 +1,73 @@
+-- aggregators.text_hash: signed 64 bit hash of Sql, Context, Descr texts,
+-- e.g. "TJSqlFacts".context_hash = tj_text_hash("TJLines".props->>'Context')
+CREATE OR REPLACE FUNCTION tj_text_hash(text) RETURNS BIGINT AS $$
+    SELECT ('x' || substr(md5($1), 1, 16))::bit(64)::bigint
+$$ LANGUAGE SQL IMMUTABLE STRICT;
+
+-- aggregators.EventFacts: typed facts of journal events, dur_us is the event header duration
+CREATE TABLE IF NOT EXISTS "TJSqlFacts" (
+    file_id INT NOT NULL,
+    base1s TEXT,
+    stamp TIMESTAMP NOT NULL,
+    rphost INT,
+    dur_us BIGINT,
+    usr TEXT,
+    session_id INT,
+    context_hash BIGINT,
+    event TEXT,
+    rows BIGINT,
+    rows_affected BIGINT,
+    sql_hash BIGINT
+);
+CREATE INDEX IF NOT EXISTS "TJSqlFacts_file_id_idx" ON "TJSqlFacts" (file_id);
+CREATE INDEX IF NOT EXISTS "TJSqlFacts_base1s_stamp_idx" ON "TJSqlFacts" (base1s, stamp);
+CREATE INDEX IF NOT EXISTS "TJSqlFacts_base1s_dur_us_idx" ON "TJSqlFacts" (base1s, dur_us DESC);
+
+CREATE TABLE IF NOT EXISTS "TJCallFacts" (
+    file_id INT NOT NULL,
+    base1s TEXT,
+    stamp TIMESTAMP NOT NULL,
+    rphost INT,
+    dur_us BIGINT,
+    usr TEXT,
+    session_id INT,
+    context_hash BIGINT,
+    memory BIGINT,
+    memory_peak BIGINT,
+    in_bytes BIGINT,
+    out_bytes BIGINT,
+    cpu_time BIGINT
+);
+CREATE INDEX IF NOT EXISTS "TJCallFacts_file_id_idx" ON "TJCallFacts" (file_id);
+CREATE INDEX IF NOT EXISTS "TJCallFacts_base1s_stamp_idx" ON "TJCallFacts" (base1s, stamp);
+CREATE INDEX IF NOT EXISTS "TJCallFacts_base1s_memory_idx" ON "TJCallFacts" (base1s, memory DESC);
+
+CREATE TABLE IF NOT EXISTS "TJLockFacts" (
+    file_id INT NOT NULL,
+    base1s TEXT,
+    stamp TIMESTAMP NOT NULL,
+    rphost INT,
+    dur_us BIGINT,
+    usr TEXT,
+    session_id INT,
+    context_hash BIGINT,
+    regions TEXT,
+    wait_connections TEXT
+);
+CREATE INDEX IF NOT EXISTS "TJLockFacts_file_id_idx" ON "TJLockFacts" (file_id);
+CREATE INDEX IF NOT EXISTS "TJLockFacts_base1s_stamp_idx" ON "TJLockFacts" (base1s, stamp);
+
+CREATE TABLE IF NOT EXISTS "TJExcpFacts" (
+    file_id INT NOT NULL,
+    base1s TEXT,
+    stamp TIMESTAMP NOT NULL,
+    rphost INT,
+    dur_us BIGINT,
+    usr TEXT,
+    session_id INT,
+    context_hash BIGINT,
+    exception TEXT,
+    descr_hash BIGINT
+);
+CREATE INDEX IF NOT EXISTS "TJExcpFacts_file_id_idx" ON "TJExcpFacts" (file_id);
+CREATE INDEX IF NOT EXISTS "TJExcpFacts_base1s_stamp_idx" ON "TJExcpFacts" (base1s, stamp);
@@ -0,0 +1,15 @@
+-- Processor: stage timings of the last file load, ms, see _session.FileStages
+CREATE TABLE IF NOT EXISTS "TJFileStages" (
+    file_id INT NOT NULL,
+    base1s TEXT,
+    stamp TIMESTAMP NOT NULL DEFAULT now(),
+    list_ms DOUBLE PRECISION,
+    download_ms DOUBLE PRECISION,
+    parse_ms DOUBLE PRECISION,
+    submit_ms DOUBLE PRECISION,
+    commit_ms DOUBLE PRECISION,
+    wire_bytes BIGINT,
+    bytes BIGINT,
+    lines BIGINT
+);
+CREATE INDEX IF NOT EXISTS "TJFileStages_file_id_idx" ON "TJFileStages" (file_id);
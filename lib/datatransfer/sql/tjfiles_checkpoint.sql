@@ -0,0 +1,2 @@
+-- PGCheckpointSession: count of file lines committed to storage
+ALTER TABLE "TJFiles" ADD COLUMN IF NOT EXISTS checkpoint BIGINT NOT NULL DEFAULT 0;
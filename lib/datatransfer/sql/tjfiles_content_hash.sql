@@ -0,0 +1,3 @@
+-- PGSession: sha256 of loaded file content, used for duplicate files skip
+ALTER TABLE "TJFiles" ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+CREATE INDEX IF NOT EXISTS "TJFiles_content_hash_idx" ON "TJFiles" (content_hash) WHERE content_hash IS NOT NULL;
@@ -0,0 +1,11 @@
+-- techjrnl.parse(props=...): extracted event properties
+ALTER TABLE "TJLines" ADD COLUMN IF NOT EXISTS props JSONB;
+
+-- containment lookups: props @> '{"Usr": "Иванов"}'
+CREATE INDEX IF NOT EXISTS "TJLines_props_gin_idx" ON "TJLines" USING GIN (props jsonb_path_ops);
+
+-- "all TLOCK events for user X in hour Y":
+--   WHERE base1s = 'vgunf' AND event = 'TLOCK' AND props->>'Usr' = 'Иванов'
+--     AND stamp >= '2020-09-23 10:00' AND stamp < '2020-09-23 11:00'
+CREATE INDEX IF NOT EXISTS "TJLines_event_usr_stamp_idx" ON "TJLines" (base1s, event, (props->>'Usr'), stamp)
+    WHERE props IS NOT NULL;
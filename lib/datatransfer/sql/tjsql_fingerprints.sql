@@ -0,0 +1,31 @@
+-- aggregators.SqlFingerprints: normalized statement texts of DBMSSQL events, stored once,
+-- fingerprint = tj_text_hash(sql), see sql/tjfacts.sql
+CREATE TABLE IF NOT EXISTS "TJSqlFingerprints" (
+    fingerprint BIGINT PRIMARY KEY,
+    sql TEXT NOT NULL
+);
+
+-- per file partial DBMSSQL aggregates by fingerprint and hour, dur_sum and dur_max are microseconds
+CREATE TABLE IF NOT EXISTS "TJSqlHourAggs" (
+    file_id INT NOT NULL,
+    base1s TEXT,
+    fingerprint BIGINT NOT NULL,
+    hour TIMESTAMP NOT NULL,
+    n BIGINT NOT NULL,
+    dur_sum BIGINT NOT NULL,
+    dur_max BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS "TJSqlHourAggs_file_id_idx" ON "TJSqlHourAggs" (file_id);
+CREATE INDEX IF NOT EXISTS "TJSqlHourAggs_base1s_hour_idx" ON "TJSqlHourAggs" (base1s, hour);
+
+-- top queries: SELECT ... FROM "TJSqlHourRoll" WHERE base1s = ... AND hour >= ... ORDER BY dur_sum DESC
+CREATE OR REPLACE VIEW "TJSqlHourRoll" AS
+SELECT a.base1s, a.fingerprint, a.hour,
+       sum(a.n) AS n,
+       sum(a.dur_sum) AS dur_sum,
+       sum(a.dur_sum) / sum(a.n) AS dur_avg,
+       max(a.dur_max) AS dur_max,
+       f.sql
+  FROM "TJSqlHourAggs" a
+  LEFT JOIN "TJSqlFingerprints" f ON f.fingerprint = a.fingerprint
+ GROUP BY a.base1s, a.fingerprint, a.hour, f.sql;
@@ -0,0 +1,103 @@
+from ._session import StorageSession, FileBadge, FileStages
+
+
+class TeeSession(StorageSession):
+    """ Submit the same files into several storages, e.g. PGSession and ParquetSession.
+        Filter of the first session is used for the log. Resumed sessions get only own not stored lines
+    """
+
+    def __init__(self, *sessions: StorageSession):
+        StorageSession.__init__(self, sessions[0].filter())
+        self._sessions = sessions
+        self._files = {}  # tee file_id -> session file ids
+        self._offsets = {}  # tee file_id -> session resume offsets
+        self._positions = {}  # tee file_id -> next submitted line number
+
+    def _spawn_args(self) -> tuple:
+        return self._sessions
+
+    def add_store_rule(self, data_type: str, storage_place: str):
+        StorageSession.add_store_rule(self, data_type, storage_place)
+        for session in self._sessions:
+            session.add_store_rule(data_type, storage_place)
+
+    def attach_file(self, badge: FileBadge) -> int:
+        file_id = len(self._files) + 1
+        self._files[file_id] = [session.attach_file(badge) for session in self._sessions]
+        self._offsets[file_id] = [
+            session.resume_offset(_id) for session, _id in zip(self._sessions, self._files[file_id])
+        ]
+        self._positions[file_id] = self.resume_offset(file_id)
+        return file_id
+
+    def resume_offset(self, file_id: int) -> int:
+        return min(self._offsets[file_id])
+
+    def submit_line(self, file_id: int, line_data: dict):
+        position = self._positions[file_id]
+        for session, _id, offset in zip(self._sessions, self._files[file_id], self._offsets[file_id]):
+            if position >= offset:
+                session.submit_line(_id, line_data)
+        self._positions[file_id] += 1
+
+    def submit_batch(self, file_id: int, batch):
+        position = self._positions[file_id]
+        for session, _id, offset in zip(self._sessions, self._files[file_id], self._offsets[file_id]):
+            skip = max(offset - position, 0)
+            if skip < len(batch):
+                session.submit_batch(_id, batch.iloc[skip:] if skip else batch)
+        self._positions[file_id] += len(batch)
+
+    def submit_rows(self, file_id: int, table: str, rows: list):
+        for session, _id in zip(self._sessions, self._files[file_id]):
+            session.submit_rows(_id, table, rows)
+
+    def append_rows(self, file_id: int, table: str, rows: list):
+        for session, _id in zip(self._sessions, self._files[file_id]):
+            session.append_rows(_id, table, rows)
+
+    def submit_dict(self, table: str, rows: list):
+        for session in self._sessions:
+            session.submit_dict(table, rows)
+
+    def drop_file(self, file_id: int):
+        for session, _id in zip(self._sessions, self._files[file_id]):
+            session.drop_file(_id)
+
+    def update_file_status(self, file_id, is_ok, fail_reason=None):
+        for session, _id in zip(self._sessions, self._files[file_id]):
+            session.update_file_status(_id, is_ok, fail_reason)
+        del self._offsets[file_id], self._positions[file_id]
+
+    def submit_stages(self, file_id: int, stages: FileStages):
+        for session, _id in zip(self._sessions, self._files.pop(file_id)):
+            session.submit_stages(_id, stages)
+
+    def is_duplicate(self, badge: FileBadge) -> bool:
+        return all(session.is_duplicate(badge) for session in self._sessions)
+
+
+from unittest import TestCase
+import pandas as pd
+from .mem_session import MemSession
+
+
+class _TeeSessionTest(TestCase):
+    def test_resume(self):
+        class Resumed(MemSession):
+            def resume_offset(self, file_id: int) -> int:
+                return 3
+
+        first, second = MemSession(keep_lines=True), Resumed(keep_lines=True)
+        tee = TeeSession(first, second)
+        tee.add_store_rule('cntr', 'CounterLines')
+        _id = tee.attach_file(FileBadge('counters.csv', 'cntr'))
+        self.assertEqual(tee.resume_offset(_id), 0)
+        tee.submit_line(_id, {'value': 0})
+        tee.submit_batch(_id, pd.DataFrame({'value': [1, 2, 3, 4]}))
+        tee.submit_line(_id, {'value': 5})
+        tee.update_file_status(_id, True)
+
+        self.assertEqual(first.files[1].lines_count, 6)
+        self.assertEqual(second.files[1].lines_count, 3)
+        self.assertEqual(list(second.files[1].lines[0]['value']), [3, 4])
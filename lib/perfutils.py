@@ -8,7 +8,7 @@ from collections import namedtuple
 import csv
 import os
 import traceback
-import xml.etree.ElementTree as ET
+import io
 
 from typing import NamedTuple
 
@@ -17,6 +17,10 @@ import psycopg2.extras
 from psycopg2 import sql as pgs
 
 from lib.schedutils import Activity, NullStarter
+from lib.pg_utils import copy_query, copy_text
+from lib.datatransfer.parsers.apdex import iter_measures, decode_stamp
+from lib.datatransfer import compression
+from lib.datatransfer.parsers.textreader import TextReader, iter_events
 from keys import KeyChain
 
 type_logs = 'logs'
@@ -115,6 +119,12 @@ class ABaseAdapter:
     def apdx_set_for(self, operation, p: Period, apdex_value):  # set APDEX value for ops/hour
         pass
 
+    def apdx_set_period(self, p: Period):  # set APDEX values for all period operations
+        for ops in self.apdx_get_ops_for(p):
+            v = self.apdx_get_n_ns_nt_for(ops, p)
+            adpex = (v.ns + v.nt / 2) / v.n
+            self.apdx_set_for(ops, p, adpex)
+
     def cntr_get_update_period(self, file_id):
         pass
 
@@ -152,11 +162,7 @@ def _calculate_apdex(adapter: ABaseAdapter):
         if period.is_empty() or i >= max_hours:
             break
         i += 1
-        ops_list = adapter.apdx_get_ops_for(period)
-        for ops in ops_list:
-            v = adapter.apdx_get_n_ns_nt_for(ops, period)
-            adpex = (v.ns + v.nt / 2) / v.n
-            adapter.apdx_set_for(ops, period, adpex)
+        adapter.apdx_set_period(period)
     adapter.log_data[type_apdx]['periods'] = i
 
 
@@ -229,7 +235,7 @@ def _parse_tj_line(line: str, db_adapter: ABaseAdapter, file_meta):
 
 def _parser_logs(local_file, file_id, file_name, db_adapter):
     # Parse local copy
-    log_file = open(local_file, encoding='utf-16')
+    log_file = TextReader(local_file, 'utf-16')
     with log_file:
         def get_meta(log_name):
             re_params = r'_(\d+)_(\d\d)(\d\d)(\d\d)(\d\d)'
@@ -242,27 +248,12 @@ def _parser_logs(local_file, file_id, file_name, db_adapter):
                 'hh': int(prm[4])
             }
 
-        re_hdr = r'^\d\d:\d\d\.\d+-'
-        accumulate_line = ''
+        re_hdr = re.compile(r'^\d\d:\d\d\.\d+-', re.MULTILINE)
         file_meta = get_meta(file_name)
         file_meta['file_id'] = file_id
 
-        while True:
-            log_line = log_file.readline()
-
-            if not log_line:
-                if len(accumulate_line):
-                    _parse_tj_line(accumulate_line, db_adapter, file_meta)
-                break
-            elif re.match(re_hdr, log_line):  # new line tag found
-                if len(accumulate_line) == 0:  # no line accumulated
-                    accumulate_line += log_line
-                else:
-                    _parse_tj_line(accumulate_line, db_adapter, file_meta)
-                    accumulate_line = log_line
-                    continue
-            else:
-                accumulate_line += log_line
+        for accumulate_line in iter_events(log_file, re_hdr):
+            _parse_tj_line(accumulate_line, db_adapter, file_meta)
 
 
 def _parser_cntr(local_file, file_id, file_name, db_adapter):
@@ -307,26 +298,21 @@ def _parser_cntr(local_file, file_id, file_name, db_adapter):
 def _parser_apdx(local_file, file_id, file_name, db_adapter):
     apdx_file = open(local_file)
     with apdx_file:
-        root = ET.parse(apdx_file).getroot()
-        for ops in root:
-            for measure in ops:
-                ops_attribute = ops.attrib
-                measure_attribute = measure.attrib
-                line = {
-                    'file_id': file_id,
-                    'ops_uid': ops_attribute['uid'],
-                    'ops_name': ops_attribute['name'],
-                    'duration': float(measure_attribute['value']),
-                    'user': measure_attribute['userName'],
-                    'start': datetime.strptime(measure_attribute['tSaveUTC'], '%Y-%m-%dT%H:%M:%S')
-                             + timedelta(hours=db_adapter.GMT),
-                    'session': int(measure_attribute['sessionNumber']),
-                    'fail': not bool(measure_attribute['runningError']),
-                    'target': float(ops_attribute['targetValue']),
-                    'priority': ops_attribute['priority'],
-                }
-                line['status'] = 'NS' if line['target'] >= line['duration'] else 'NT'
-                db_adapter.submit_line(line, type_apdx)
+        for ops_attribute, measure_attribute in iter_measures(apdx_file):
+            line = {
+                'file_id': file_id,
+                'ops_uid': ops_attribute['uid'],
+                'ops_name': ops_attribute['name'],
+                'duration': float(measure_attribute['value']),
+                'user': measure_attribute['userName'],
+                'start': decode_stamp(measure_attribute['tSaveUTC'], db_adapter.GMT),
+                'session': int(measure_attribute['sessionNumber']),
+                'fail': not bool(measure_attribute['runningError']),
+                'target': float(ops_attribute['targetValue']),
+                'priority': ops_attribute['priority'],
+            }
+            line['status'] = 'NS' if line['target'] >= line['duration'] else 'NT'
+            db_adapter.submit_line(line, type_apdx)
 
 
 def _parse_unify_file(ftp_con, file_type, file_name, db_adapter, parser, move_done):
@@ -340,15 +326,22 @@ def _parse_unify_file(ftp_con, file_type, file_name, db_adapter, parser, move_do
     fail_dir = file_tree[file_type]["fail"]
 
     tmp_dir = tempfile.gettempdir()
-    out_name = f"{tmp_dir}/{file_name}"
+    plain_name = compression.plain_name(file_name)  # .gz and .zst files are decompressed while download
+    out_name = f"{tmp_dir}/{plain_name}"
     parse_file = open(out_name, 'wb')
-    ftp_con.retrbinary("RETR " + f'{root_dir}/{file_name}', parse_file.write)
+    unpack = compression.decompressor(file_name)
+    ftp_con.retrbinary(
+        "RETR " + f'{root_dir}/{file_name}',
+        (lambda data: parse_file.write(unpack.decompress(data))) if unpack else parse_file.write
+    )
+    if unpack:
+        parse_file.write(unpack.flush())
     parse_file.close()
 
-    file_id = db_adapter.submit_file(file_name, file_type)
+    file_id = db_adapter.submit_file(plain_name, file_type)
 
     try:
-        parser(out_name, file_id, file_name, db_adapter)
+        parser(out_name, file_id, plain_name, db_adapter)
     except Exception:
         if not move_done:
             raise Exception
@@ -384,6 +377,7 @@ class PGAdapter(ABaseAdapter):
         type_apdx: 'ApdexLines',
         type_cntr: 'CounterLines'
     }
+    COPY_CHUNK = 10000  # lines of one COPY
 
     def __init__(self, key, base1s_id):
         super().__init__(key, base1s_id)
@@ -392,91 +386,81 @@ class PGAdapter(ABaseAdapter):
         self._batch_params = []
         self._batch_type = ''
         self._batch_hdr = ()
+        self._lines_count = 0  # file lines already copied
+        self.round_trips = 0  # DB requests count: statements, COPY and commits
 
-    def _check_tjfile_exist(self, file_name, file_type):
-        result = -1  # in case file not exist
-        check_query = pgs.SQL('SELECT {} FROM {} WHERE {}={} and {}={} and {}={}').format(
-            pgs.Identifier('id'),
-            pgs.Identifier('TJFiles'),
-            pgs.Identifier('base1s'),
-            pgs.Literal(self.base1s_id),
-            pgs.Identifier('name'),
-            pgs.Literal(file_name),
-            pgs.Identifier('type'),
-            pgs.Literal(file_type),
-        )
+    def get_log_str(self):
+        return super().get_log_str() + f'rt.{self.round_trips} '
+
+    def _execute(self, query, params=None):
         cursor = self._con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
-        qstr = check_query.as_string(self._con)
-        cursor.execute(qstr)
-        rows = cursor.fetchall()
+        cursor.execute(query, params)
+        self.round_trips += 1
+        return cursor
 
-        if len(rows) != 0:
-            result = rows[0].id
-        return result
+    def _commit(self):
+        self._con.commit()
+        self.round_trips += 1
 
-    def _remove_file_data(self, file_id, file_type):
-        delete_query = pgs.SQL('DELETE FROM {} WHERE {}={}').format(
-            pgs.Identifier(self.tables[file_type]),
-            pgs.Identifier('file_id'),
-            pgs.Literal(file_id)
-        )
-        params = {
+    def submit_file(self, name, file_type):
+        """ One statement file registry upsert: clear data of already submitted file or register the new one """
+        update_params = {
             'lines_count': 0,
             'duration': 0,
             'status': 'update',
             'fail_descr': None,
             'last_update': datetime.now()
         }
-        update_query = pgs.SQL('UPDATE {} SET ({}) = ({}) WHERE {}={}').format(
-            pgs.Identifier('TJFiles'),
-            pgs.SQL(', ').join(pgs.Identifier(key) for key in params.keys()),
-            pgs.SQL(', ').join(pgs.Literal(value) for value in params.values()),
-            pgs.Identifier('id'),
-            pgs.Literal(file_id)
-        )
-        cursor = self._con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
-        cursor.execute(delete_query)
-        cursor.execute(update_query)
-        self._con.commit()
-
-    def _get_new_tjfile_id(self, name, type):
-        params = {
-            'lines_count': 0,
-            'duration': 0,
-            'status': 'new',
-            'fail_descr': None,
-            'last_update': datetime.now(),
-            'name': name,
-            'base1s': self.base1s_id,
-            'type': type,
-        }
-
-        insert_query = pgs.SQL('INSERT INTO {}({}) VALUES ({}) RETURNING {}').format(
-            pgs.Identifier('TJFiles'),
-            pgs.SQL(', ').join(pgs.Identifier(key) for key in params.keys()),
-            pgs.SQL(', ').join(pgs.Literal(value) for value in params.values()),
-            pgs.Identifier('id'),
+        insert_params = dict(update_params, status='new', name=name, base1s=self.base1s_id, type=file_type)
+
+        upsert_query = pgs.SQL(
+            'WITH {found} AS (SELECT {id} FROM {files} WHERE {base1s}={base1s_value} '
+            'AND {name}={name_value} AND {type}={type_value} ORDER BY {id} LIMIT 1), '
+            '{cleared} AS (DELETE FROM {lines} WHERE {file_id} IN (SELECT {id} FROM {found})), '
+            '{updated} AS (UPDATE {files} SET ({update_fields})=({update_values}) '
+            'WHERE {id} IN (SELECT {id} FROM {found}) RETURNING {id}), '
+            '{inserted} AS (INSERT INTO {files}({insert_fields}) SELECT {insert_values} '
+            'WHERE NOT EXISTS (SELECT 1 FROM {found}) RETURNING {id}) '
+            'SELECT {id} FROM {updated} UNION ALL SELECT {id} FROM {inserted}'
+        ).format(
+            found=pgs.Identifier('found'),
+            cleared=pgs.Identifier('cleared'),
+            updated=pgs.Identifier('updated'),
+            inserted=pgs.Identifier('inserted'),
+            id=pgs.Identifier('id'),
+            files=pgs.Identifier('TJFiles'),
+            lines=pgs.Identifier(self.tables[file_type]),
+            file_id=pgs.Identifier('file_id'),
+            base1s=pgs.Identifier('base1s'),
+            base1s_value=pgs.Literal(self.base1s_id),
+            name=pgs.Identifier('name'),
+            name_value=pgs.Literal(name),
+            type=pgs.Identifier('type'),
+            type_value=pgs.Literal(file_type),
+            update_fields=pgs.SQL(', ').join(pgs.Identifier(key) for key in update_params.keys()),
+            update_values=pgs.SQL(', ').join(pgs.Literal(value) for value in update_params.values()),
+            insert_fields=pgs.SQL(', ').join(pgs.Identifier(key) for key in insert_params.keys()),
+            insert_values=pgs.SQL(', ').join(pgs.Literal(value) for value in insert_params.values()),
         )
-
-        cursor = self._con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
-        qstr = insert_query.as_string(self._con)
-        cursor.execute(qstr)
-        self._con.commit()
-        return cursor.fetchone().id
-
-    def submit_file(self, name, file_type):
-        file_id = self._check_tjfile_exist(name, file_type)
-        if file_id != -1:  # this file already submitted
-            self._remove_file_data(file_id, file_type)
-        else:
-            file_id = self._get_new_tjfile_id(name, file_type)
+        file_id = self._execute(upsert_query).fetchone().id
+        self._batch_params.clear()
+        self._lines_count = 0
+        return file_id  # committed with file status and lines
+
+    def _copy_batch(self):
+        # file lines are copied by chunks into the open transaction, committed with file status
+        if not self._batch_params:
+            return
+        data = io.StringIO(copy_text(self._batch_params))
+        self._con.cursor().copy_expert(copy_query(self.tables[self._batch_type], self._batch_hdr), data)
+        self.round_trips += 1
+        self._lines_count += len(self._batch_params)
         self._batch_params.clear()
-        return file_id
 
     def update_file_status(self, file_id, duration, isOk, fail_descr=None):
-        lines_count = len(self._batch_params)
+        self._copy_batch()
         params = {
-            'lines_count': lines_count,
+            'lines_count': self._lines_count,
             'duration': duration,
             'status': 'done' if isOk else 'fail',
             'fail_descr': fail_descr
@@ -488,42 +472,17 @@ class PGAdapter(ABaseAdapter):
             pgs.Identifier('id'),
             pgs.Literal(file_id),
         )
-
-        cursor = self._con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
-        qstr = update_query.as_string(self._con)
-        cursor.execute(qstr)
-
-        if len(self._batch_params):
-            params_count = len(self._batch_params[0])
-            hdr_params = [self.tables[self._batch_type]] + self._batch_hdr
-
-            part_into = ' (' + ', '.join(['{}' for i in range(0, params_count)]) + ')'
-            part_values = ' (' + ', '.join(['%s' for i in range(0, params_count)]) + ')'
-
-            batch_query = pgs.SQL('insert into {} ' + part_into).format(
-                *[pgs.Identifier(h) for h in hdr_params]
-            ) + pgs.SQL(' values ' + part_values)
-            psycopg2.extras.execute_batch(cursor, batch_query, self._batch_params)
-
-        self._con.commit()
-        self._batch_params.clear()
-
-    def _unify_line_submit(self, line, table_name):
-        insert_query = pgs.SQL('INSERT INTO {} ({}) VALUES ({})').format(
-            pgs.Identifier(table_name),
-            pgs.SQL(', ').join(pgs.Identifier(field) for field in line.keys()),
-            pgs.SQL(', ').join(pgs.Literal(value) for value in line.values())
-        )
-        cursor = self._con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
-        qstr = insert_query.as_string(self._con)
-        cursor.execute(qstr)
+        self._execute(update_query)
+        self._commit()
+        self._lines_count = 0
 
     def submit_line(self, line, line_type):
         line['base1s'] = self.base1s_id
-        #  self._unify_line_submit(line, self.tables[line_type])
-        self._batch_params.append(list(line.values()))
+        self._batch_params.append(tuple(line.values()))
         self._batch_type = line_type
         self._batch_hdr = list(line.keys())
+        if len(self._batch_params) >= self.COPY_CHUNK:
+            self._copy_batch()
 
     def apdx_get_next_period(self):  # return next empty period for APDEX calc or None
         select_query = pgs.SQL(
@@ -535,10 +494,7 @@ class PGAdapter(ABaseAdapter):
             pgs.Identifier('apdex'),
             pgs.Identifier('start'),
         )
-        cursor = self._con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
-        qstr = select_query.as_string(self._con)
-        cursor.execute(qstr)
-        rows = cursor.fetchall()
+        rows = self._execute(select_query).fetchall()
         return Period(rows[0].start) if len(rows) != 0 else Period()
 
     def apdx_get_ops_for(self, period: Period):  # return ops list
@@ -552,14 +508,15 @@ class PGAdapter(ABaseAdapter):
             pgs.Identifier('base1s'),
             pgs.Literal(self.base1s_id),
         )
-
-        cursor = self._con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
-        cursor.execute(select_query)
-        rows = cursor.fetchall()
+        rows = self._execute(select_query).fetchall()
         return [row.ops_uid for row in rows]
 
     def apdx_get_n_ns_nt_for(self, operation, period: Period) -> NamedTuple:  # return dict
-        n_query = pgs.SQL('SELECT count(*) FROM {} WHERE {} BETWEEN {} AND {} AND {}={} AND {}={}').format(
+        n_query = pgs.SQL(
+            'SELECT count(*) AS n, count(*) FILTER (WHERE {status}={ns}) AS ns, '
+            'count(*) FILTER (WHERE {status}={nt}) AS nt '
+            'FROM {} WHERE {} BETWEEN {} AND {} AND {}={} AND {}={}'
+        ).format(
             pgs.Identifier('ApdexLines'),
             pgs.Identifier('start'),
             pgs.Literal(period.begin),
@@ -568,23 +525,12 @@ class PGAdapter(ABaseAdapter):
             pgs.Literal(operation),
             pgs.Identifier('base1s'),
             pgs.Literal(self.base1s_id),
+            status=pgs.Identifier('status'),
+            ns=pgs.Literal('NS'),
+            nt=pgs.Literal('NT'),
         )
-        ns_query = n_query + pgs.SQL(' AND {}={}').format(
-            pgs.Identifier('status'),
-            pgs.Literal('NS'),
-        )
-        nt_query = n_query + pgs.SQL(' AND {}={}').format(
-            pgs.Identifier('status'),
-            pgs.Literal('NT'),
-        )
-        cursor = self._con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
-        cursor.execute(n_query)
-        n = cursor.fetchone()[0]
-        cursor.execute(ns_query)
-        ns = cursor.fetchone()[0]
-        cursor.execute(nt_query)
-        nt = cursor.fetchone()[0]
-        return namedtuple('AdpexParams', 'n, ns, nt')(n, ns, nt)
+        row = self._execute(n_query).fetchone()
+        return namedtuple('AdpexParams', 'n, ns, nt')(row.n, row.ns, row.nt)
 
     def apdx_set_for(self, operation, period: Period, apdex_value):  # set APDEX value for ops/hour
         update_query = pgs.SQL('UPDATE {} SET {}={} WHERE {} BETWEEN {} AND {} AND {}={} AND {}={}').format(
@@ -599,18 +545,42 @@ class PGAdapter(ABaseAdapter):
             pgs.Identifier('ops_uid'),
             pgs.Literal(operation),
         )
-        cursor = self._con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
-        cursor.execute(update_query)
-        self._con.commit()
+        self._execute(update_query)
+        self._commit()
+
+    def apdx_set_period(self, period: Period):
+        """ One grouped statement for all period operations, float8 math is the same as Python one """
+        update_query = pgs.SQL(
+            'UPDATE {lines} AS {l} SET {apdex}={g}.{apdex} FROM ('
+            'SELECT {ops_uid}, (count(*) FILTER (WHERE {status}={ns})::float8 '
+            '+ count(*) FILTER (WHERE {status}={nt})::float8 / 2) / count(*)::float8 AS {apdex} '
+            'FROM {lines} WHERE {start} BETWEEN {begin} AND {end} AND {base1s}={base1s_value} '
+            'GROUP BY {ops_uid}) AS {g} '
+            'WHERE {l}.{start} BETWEEN {begin} AND {end} AND {l}.{base1s}={base1s_value} '
+            'AND {l}.{ops_uid}={g}.{ops_uid}'
+        ).format(
+            lines=pgs.Identifier('ApdexLines'),
+            l=pgs.Identifier('l'),
+            g=pgs.Identifier('g'),
+            apdex=pgs.Identifier('apdex'),
+            ops_uid=pgs.Identifier('ops_uid'),
+            status=pgs.Identifier('status'),
+            ns=pgs.Literal('NS'),
+            nt=pgs.Literal('NT'),
+            start=pgs.Identifier('start'),
+            begin=pgs.Literal(period.begin),
+            end=pgs.Literal(period.end),
+            base1s=pgs.Identifier('base1s'),
+            base1s_value=pgs.Literal(self.base1s_id),
+        )
+        self._execute(update_query)
+        self._commit()
 
     def cntr_get_update_period(self, file_id):
         update_query = pgs.SQL('select min(stamp), max(stamp) from "CounterLines" where file_id={}').format(
             pgs.Literal(file_id)
         )
-
-        cursor = self._con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
-        cursor.execute(update_query)
-        result = cursor.fetchone()
+        result = self._execute(update_query).fetchone()
 
         return (result[0], result[1]) if result else (None, None)
 
@@ -659,6 +629,48 @@ class FtptjparserTestCase(TestCase):
         file_id = adapter.submit_file(file_name, type_logs)
         adapter.update_file_status(file_id, 27, 3, True)
 
+    def test_copy_lines(self):
+        base1s = 'test_copy_lines'
+        name = 'rphost_1234_21010112.log'
+        path = f'{tempfile.gettempdir()}/{name}'
+        with open(path, 'w', encoding='utf-16') as file:
+            file.write(
+                '01:02.000001-15,DBMSSQL,3,OSThread=101,Sql=SELECT 1\tFROM "T" \\x,Descr=a\\b\n'
+                '01:02.000002-0,EXCP,1,Exception=Err,Descr=multi\nline \'text\'\n'
+                '01:03.100000-7,CALL,2,Context=Форма.Вызов\n'
+            )
+        copying = PGAdapter(self.pg_key, base1s)
+        copying.COPY_CHUNK = 2
+        copied_id = copying.submit_file(name, type_logs)
+        _parser_logs(path, copied_id, name, copying)
+        copying.update_file_status(copied_id, 0, True)
+
+        # the previous path: lines are inserted by execute_batch
+        inserting = PGAdapter(self.pg_key, base1s)
+        inserted_id = inserting.submit_file(f'{name}.insert', type_logs)
+        _parser_logs(path, inserted_id, name, inserting)
+        os.remove(path)
+        cursor = inserting._con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
+        psycopg2.extras.execute_batch(cursor, pgs.SQL('INSERT INTO {} ({}) VALUES ({})').format(
+            pgs.Identifier('TJLines'),
+            pgs.SQL(', ').join(map(pgs.Identifier, inserting._batch_hdr)),
+            pgs.SQL(', ').join(pgs.Placeholder() * len(inserting._batch_hdr)),
+        ), inserting._batch_params)
+        inserting._con.commit()
+
+        lines_query = 'SELECT base1s, rphost, ms, dur, event, lvl, osthread, exception, descr, stamp, source ' \
+                      'FROM "TJLines" WHERE file_id=%s ORDER BY stamp, source'
+        cursor.execute(lines_query, (copied_id,))
+        copied = cursor.fetchall()
+        cursor.execute(lines_query, (inserted_id,))
+        self.assertEqual(copied, cursor.fetchall())
+        cursor.execute('SELECT lines_count FROM "TJFiles" WHERE id=%s', (copied_id,))
+        self.assertEqual(cursor.fetchone().lines_count, 3)
+
+        cursor.execute('DELETE FROM "TJLines" WHERE base1s=%s', (base1s,))
+        cursor.execute('DELETE FROM "TJFiles" WHERE base1s=%s', (base1s,))
+        inserting._con.commit()
+
     def test_connect_server(self):
         ftp_con = connect_server(self.ftp_key)
         ftp_con.quit()
@@ -1,4 +1,6 @@
 import io
+from datetime import datetime
+from itertools import repeat
 from typing import Optional
 
 import psycopg2
@@ -11,7 +13,11 @@ __all__ = \
     (
         'PGMix',
         'sql',
-        'DataBaseKey'
+        'DataBaseKey',
+        'copy_value',
+        'copy_text',
+        'copy_query',
+        'record_text',
     )
 
 
@@ -23,6 +29,90 @@ class DataBaseKey(BaseModel):
     port: Optional[int] = None
 
 
+_COPY_ESCAPE = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+_COPY_REPLACES = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'))  # backslash first
+_RECORD_QUOTE = set('"\\(),')
+
+
+def record_text(values: tuple) -> str:
+    """ Row value text as Postgres casts it: ('a', 'b c') -> (a,"b c") """
+    def item(value):
+        if value is None:
+            return ''
+        value = str(value)
+        if value and not any(ch in _RECORD_QUOTE or ch.isspace() for ch in value):
+            return value
+        return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '""'))
+    return '({})'.format(','.join(map(item, values)))
+
+
+def copy_value(value) -> str:
+    """ Encode value for COPY ... FROM STDIN text format, the same way as psycopg2 adapts it for INSERT """
+    if value.__class__ is str:  # most frequent case fast path
+        return value.translate(_COPY_ESCAPE)
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, tuple):
+        value = record_text(value)
+    elif isinstance(value, datetime):
+        value = value.isoformat(' ')
+    return str(value).translate(_COPY_ESCAPE)
+
+
+def _copy_column(column: tuple) -> list:
+    # the same values as copy_value, by one call per column for columns of one type
+    kinds = set(map(type, column))
+    kinds.discard(type(None))
+    if len(kinds) != 1:
+        return list(map(copy_value, column))
+    kind = kinds.pop()
+    nulls = [i for i, value in enumerate(column) if value is None] if None in column else ()
+    if kind is str:
+        # COPY text has no NUL chars, so they split the column translated at once
+        values = '\x00'.join(['' if value is None else value for value in column] if nulls else column)
+        for char, escaped in _COPY_REPLACES:  # str.replace is faster than translate() for large texts
+            values = values.replace(char, escaped)
+        result = values.split('\x00')
+        if len(result) != len(column):  # NUL chars of values, they are encoded one by one
+            return list(map(copy_value, column))
+    elif kind is datetime:
+        result = list(map(datetime.isoformat, [datetime.min if value is None else value for value in column]
+                          if nulls else column, repeat(' ')))
+    elif kind in (int, float):
+        result = list(map(str, column))
+    else:  # bool, tuple and others: repeated values are encoded once
+        encoded = {value: copy_value(value) for value in set(column)}
+        result = list(map(encoded.__getitem__, column))
+    for i in nulls:
+        result[i] = '\\N'
+    return result
+
+
+def copy_text(rows: list, tail: str = None) -> str:
+    """ COPY ... FROM STDIN text format lines of rows (value sequences of the same fields), encoded by columns.
+        tail is the text of constant last fields, already encoded
+    """
+    if not rows:
+        return ''
+    columns = [_copy_column(column) for column in zip(*rows)]
+    if tail is not None:
+        columns.append(repeat(tail))
+    return '\n'.join(map('\t'.join, zip(*columns))) + '\n'
+
+
+def copy_query(table: str, fields: list, csv: bool = False) -> sql.Composed:
+    """ COPY table (fields) FROM STDIN, csv format uses \\N for NULL and "" for empty strings """
+    return sql.SQL('COPY {} ({}) FROM STDIN{}').format(
+        sql.Identifier(table),
+        sql.SQL(', ').join(map(sql.Identifier, fields)),
+        sql.SQL(" WITH (FORMAT csv, NULL '\\N')" if csv else '')
+    )
+
+
 class PGMix:
     PG_KEY = None
     """ 
@@ -80,6 +170,39 @@ class PGMix:
 from unittest import TestCase
 
 
+class TestCopyValue(TestCase):
+    def test_scalars(self):
+        self.assertEqual(copy_value(None), '\\N')
+        self.assertEqual(copy_value(True), 't')
+        self.assertEqual(copy_value(0.1), '0.1')
+        self.assertEqual(copy_value(datetime(2020, 9, 23, 16, 5, 1, 120)), '2020-09-23 16:05:01.000120')
+        self.assertEqual(copy_value('a\tb\\c\r\n'), 'a\\tb\\\\c\\r\\n')
+
+    def test_record(self):
+        self.assertEqual(
+            copy_value(('HOST', 'Processor(_Total)', '% Processor Time', '')),
+            '(HOST,"Processor(_Total)","% Processor Time","")'
+        )
+
+
+class TestCopyText(TestCase):
+    def test_columns(self):
+        rows = [
+            ('a\tb', 1, 0.5, datetime(2020, 9, 23, 16, 5, 1, 120), True, ('HOST', 'x y'), None, 'dur'),
+            (None, None, None, None, False, ('HOST', 'x y'), None, 7),
+            ('\\', 3, float('nan'), datetime(2020, 9, 23), None, None, None, None),
+        ]
+        self.assertEqual(
+            copy_text(rows, '1\ttst'),
+            ''.join('\t'.join(list(map(copy_value, row)) + ['1', 'tst']) + '\n' for row in rows)
+        )
+        self.assertEqual(copy_text([]), '')
+
+    def test_nul_chars(self):
+        rows = [('a\x00b', 1), (None, 2), ('c', 3)]
+        self.assertEqual(copy_text(rows), ''.join('\t'.join(map(copy_value, row)) + '\n' for row in rows))
+
+
 class TestPGMix(TestCase):
     def test_init(self):
         from keys import KeyChain